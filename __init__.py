@@ -19,6 +19,7 @@ from collections import namedtuple
 
 from .operators import *
 from .panels import *
+from .operators.scene_index import memoized_poll
 
 bl_info = {
     "name" : "Cyanic Toolbox",
@@ -40,6 +41,7 @@ bl_info = {
 Dependency = namedtuple("Dependency", ["module", "package", "name"])
 dependencies = (
     Dependency(module="numpy", package="numpy==1.26.4", name='np'), # numpy 2.0 had just released, and wasn't compatible with mediapipe yet
+    Dependency(module="scipy", package="scipy==1.13.1", name=None), # Pinned alongside numpy, so a scipy update can't pull in a different numpy
     Dependency(module="skimage", package="scikit-image", name=None),
     Dependency(module="cv2", package="opencv-python", name=None),
     Dependency(module="mediapipe", package=None, name=None),
@@ -182,6 +184,10 @@ class CYANIC_OT_install_dependencies(bpy.types.Operator):
             bpy.utils.register_class(cls)
         for cls in panel_classes:
             bpy.utils.register_class(cls)
+        # register() stopped before these too. Both skip handlers that are already there, so a later register()
+        # won't add them twice
+        register_handlers()
+        register_scene_index()
 
         return {"FINISHED"}
 
@@ -284,6 +290,45 @@ class CYANIC_preferences(bpy.types.AddonPreferences):
 
     custom_path: bpy.props.StringProperty(name='Custom Path', default='', subtype="FILE_PATH")
 
+    save_files: bpy.props.BoolProperty(
+        name='Save face mesh files',
+        description='Save the .obj, .mtl and texture of every new face mesh. The mesh is always added to the scene directly',
+        default=True,
+    )
+
+    texture_size: bpy.props.IntProperty(
+        name='Texture size',
+        description='Width and height of face mesh textures, in pixels',
+        default=512,
+        min=64,
+        max=8192,
+    )
+
+    landmark_cache_mb: bpy.props.IntProperty(
+        name='Landmark cache (MB)',
+        description='Disk space for remembering the landmarks found in images, so the same image is never processed twice. 0 turns the cache off',
+        default=64,
+        min=0,
+    )
+
+    landmark_backend: bpy.props.EnumProperty(
+        items=[
+            ('solutions', 'Legacy solutions', 'Mediapipe FaceMesh and Holistic'),
+            ('tasks', 'Tasks API', 'Mediapipe Tasks API models. Face meshes use the included face_landmarker.task, mocap needs pose_landmarker_*.task (and hand_landmarker.task for hands) added to the data folder'),
+        ],
+        name='Landmark detector',
+        description='Which mediapipe models find the landmarks for face meshes and mocap',
+        default='solutions'
+    )
+
+    obj_precision: bpy.props.IntProperty(
+        name='OBJ precision',
+        description='Digits after the decimal point for face mesh .obj files. Fewer digits make smaller files',
+        default=6,
+        min=1,
+        max=17,
+    )
+
     def draw_dependency(self, dependency, dependency_box):
         # module name, version, install/remove button
         # Check if installed
@@ -328,6 +373,13 @@ class CYANIC_preferences(bpy.types.AddonPreferences):
         layout.label(text="Set first choices for face mesh save directory. If .blend file isn't saved, custom path will be tried.")
         layout.prop(self, 'save_dir')
         layout.prop(self, 'custom_path')
+        layout.prop(self, 'save_files')
+        layout.prop(self, 'texture_size')
+        layout.prop(self, 'obj_precision')
+        layout.prop(self, 'landmark_cache_mb')
+        layout.prop(self, 'landmark_backend')
+        if dependencies_installed:
+            layout.operator(ReleaseLandmarkersOperator.bl_idname)
         
         # Dependency sub-box
         dependency_box = layout.box()
@@ -371,7 +423,8 @@ def armature_bone_count_match(_, obj):
 def facemesh_vertex_count_match(_, obj):
     facemesh_vertices_count = 468 # How many verticies a facemesh should have
     # return len(obj.vertices) == facemesh_vertices_count
-    return obj.users > 0 and len(obj.vertices) >= facemesh_vertices_count # Went with >= incase the user extends the mesh to add more verts. Program will break with less verts, but not more
+    # Went with >= incase the user extends the mesh to add more verts. Program will break with less verts, but not more
+    return obj.users > 0 and memoized_poll('facemesh_vertex_count', obj, lambda mesh: len(mesh.vertices) >= facemesh_vertices_count)
 
 def armature_face_bones_match(_, obj):
     manditory_bones = ["eye.L", "eye.R", "jaw", "jaw.L", "jaw.L.001", "jaw.R", "jaw.R.001", "temple.L", "temple.R", "chin", "chin.001", "chin.L", "chin.R", "lip.B.L", "lip.B.L.001", "lip.B.R", "lip.B.R.001", "lip.T.L", "lip.T.L.001", "lip.T.R", "lip.T.R.001", "cheek.B.L", "cheek.B.L.001", "cheek.B.R", "cheek.B.R.001", "cheek.T.L", "cheek.T.L.001", "cheek.T.R", "cheek.T.R.001", "brow.T.L", "brow.T.L.001", "brow.T.L.002", "brow.T.L.003", "brow.T.R", "brow.T.R.001", "brow.T.R.002", "brow.T.R.003", "forehead.L", "forehead.L.001", "forehead.L.002", "forehead.R", "forehead.R.001", "forehead.R.002", "nose", "nose.001", "nose.002", "nose.003", "nose.004", "nose.L", "nose.L.001", "nose.R", "nose.R.001", "lid.B.L", "lid.B.L.001", "lid.B.L.002", "lid.B.L.003", "lid.T.L", "lid.T.L.001", "lid.T.L.002", "lid.T.L.003", "lid.B.R", "lid.B.R.001", "lid.B.R.002", "lid.B.R.003", "lid.T.R", "lid.T.R.001", "lid.T.R.002", "lid.T.R.003", "brow.B.L", "brow.B.L.001", "brow.B.L.002", "brow.B.L.003", "brow.B.R", "brow.B.R.001", "brow.B.R.002", "brow.B.R.003" ]
@@ -382,7 +435,8 @@ def armature_face_bones_match(_, obj):
     return True
 
 def valid_metarig(_, obj):
-    return obj.users > 0 and 'rigify_target_rig' in dir(obj) and armature_face_bones_match(_, obj)
+    # users can change without the armature itself changing, so it's checked every time. The rest is cached
+    return obj.users > 0 and memoized_poll('valid_metarig', obj, lambda armature: 'rigify_target_rig' in dir(armature) and armature_face_bones_match(_, armature))
 
 
 def register():
@@ -393,6 +447,25 @@ def register():
         # default="*.jpg;*.jpg"
     )
 
+    bpy.types.Scene.cyanic_img_batch_path = bpy.props.StringProperty(
+        name='Face Images',
+        description='Folder of images (or a pattern like *.jpg) that will each be converted to a face mesh',
+        subtype="DIR_PATH",
+    )
+
+    bpy.types.Scene.cyanic_batch_workers = bpy.props.IntProperty(
+        name='Workers',
+        description='Processes used for a batch. 1 runs everything inside Blender, 0 uses one process per CPU core',
+        default=1,
+        min=0,
+    )
+
+    bpy.types.Scene.cyanic_batch_import = bpy.props.BoolProperty(
+        name='Import results',
+        description='Import every face mesh into the scene once the batch is done',
+        default=False,
+    )
+
     bpy.types.Scene.cyanic_facemesh = bpy.props.PointerProperty(
         name="FaceMesh",
         description="FaceMesh generated from Mediapipe",
@@ -450,6 +523,93 @@ def register():
         subtype="FILE_PATH",
     )
 
+    bpy.types.Scene.cyanic_mocap_recording_path = bpy.props.StringProperty(
+        name='Recording',
+        description='Saved landmarks from an earlier video mocap (a .mocap folder), replayed without running mediapipe',
+        subtype="DIR_PATH",
+    )
+
+    bpy.types.Scene.cyanic_mocap_frame_start = bpy.props.IntProperty(
+        name='Start',
+        description='First video frame to use',
+        default=0,
+        min=0,
+    )
+
+    bpy.types.Scene.cyanic_mocap_frame_end = bpy.props.IntProperty(
+        name='End',
+        description='Last video frame to use. 0 goes to the end of the video',
+        default=0,
+        min=0,
+    )
+
+    bpy.types.Scene.cyanic_mocap_frame_stride = bpy.props.IntProperty(
+        name='Stride',
+        description='Only detect every Nth frame, the keyframes in between are interpolated',
+        default=1,
+        min=1,
+    )
+
+    bpy.types.Scene.cyanic_mocap_downscale = bpy.props.FloatProperty(
+        name='Downscale',
+        description='Shrink video frames by this much before detection. Faster on high resolution video, less accurate',
+        default=1.0,
+        min=0.1,
+        max=1.0,
+    )
+
+    bpy.types.Scene.cyanic_mocap_model_complexity = bpy.props.EnumProperty(
+        name='Model',
+        items=[
+            ('auto', 'Auto', 'Fast for the webcam, so it keeps up in real time, detailed for files'),
+            ('0', 'Fast', 'Least accurate, fastest model'),
+            ('1', 'Balanced', 'Middle ground between speed and accuracy'),
+            ('2', 'Detailed', 'Most accurate, slowest model'),
+        ],
+        default='auto',
+    )
+
+    bpy.types.Scene.cyanic_mocap_filter = bpy.props.EnumProperty(
+        name='Smoothing',
+        description='Filter the landmarks over time before keyframing them. Recordings keep the unfiltered landmarks',
+        items=[
+            ('none', 'None', 'Use the landmarks as detected'),
+            ('one_euro', 'One Euro', 'Smooths jitter while still, follows fast movement closely'),
+            ('kalman', 'Kalman', 'Constant velocity prediction, corrected by each detection'),
+            ('savgol', 'Savitzky-Golay', 'Polynomial fit over nearby frames. Lag free when replaying a recording'),
+        ],
+        default='none',
+    )
+
+    bpy.types.Scene.cyanic_mocap_filter_cutoff = bpy.props.FloatProperty(
+        name='Cutoff (Hz)',
+        description='How much the One Euro filter smooths landmarks that are standing still. Lower is smoother',
+        default=1.0,
+        min=0.01,
+    )
+
+    bpy.types.Scene.cyanic_mocap_filter_beta = bpy.props.FloatProperty(
+        name='Speed response',
+        description='How quickly the One Euro filter stops smoothing when landmarks move fast. Higher means less lag',
+        default=20.0,
+        min=0.0,
+    )
+
+    bpy.types.Scene.cyanic_mocap_filter_noise = bpy.props.FloatProperty(
+        name='Detection noise',
+        description='How far off the Kalman filter expects detections to be, as a fraction of the image. Higher is smoother',
+        default=0.01,
+        min=0.0001,
+        precision=4,
+    )
+
+    bpy.types.Scene.cyanic_mocap_filter_window = bpy.props.IntProperty(
+        name='Window',
+        description='Frames the Savitzky-Golay filter fits at once. Higher is smoother',
+        default=9,
+        min=3,
+    )
+
     global dependencies_installed
     dependencies_installed = False
 
@@ -468,9 +628,14 @@ def register():
         bpy.utils.register_class(cls)
     for cls in panel_classes:
         bpy.utils.register_class(cls)
+    register_handlers()
+    register_scene_index()
 
 def unregister():
     del bpy.types.Scene.cyanic_img_path
+    del bpy.types.Scene.cyanic_img_batch_path
+    del bpy.types.Scene.cyanic_batch_workers
+    del bpy.types.Scene.cyanic_batch_import
     del bpy.types.Scene.cyanic_facemesh
     del bpy.types.Scene.cyanic_eye_left
     del bpy.types.Scene.cyanic_eye_right
@@ -480,10 +645,23 @@ def unregister():
     del bpy.types.Scene.cyanic_source_type
     del bpy.types.Scene.cyanic_source_input
     del bpy.types.Scene.cyanic_mocap_file_path
+    del bpy.types.Scene.cyanic_mocap_recording_path
+    del bpy.types.Scene.cyanic_mocap_frame_start
+    del bpy.types.Scene.cyanic_mocap_frame_end
+    del bpy.types.Scene.cyanic_mocap_frame_stride
+    del bpy.types.Scene.cyanic_mocap_downscale
+    del bpy.types.Scene.cyanic_mocap_model_complexity
+    del bpy.types.Scene.cyanic_mocap_filter
+    del bpy.types.Scene.cyanic_mocap_filter_cutoff
+    del bpy.types.Scene.cyanic_mocap_filter_beta
+    del bpy.types.Scene.cyanic_mocap_filter_noise
+    del bpy.types.Scene.cyanic_mocap_filter_window
 
     for cls in preference_classes:
         bpy.utils.unregister_class(cls)
 
+    unregister_handlers() # Also closes any landmark models still loaded
+    unregister_scene_index()
     for cls in operator_classes:
         bpy.utils.unregister_class(cls)
     for cls in panel_classes:
@@ -1,12 +1,15 @@
 from .filebrowser import FileBrowserOperator
-from .faceimg2facemesh import FaceImg2FacemeshOperator
+from .faceimg2facemesh import FaceImg2FacemeshOperator, FaceImg2FacemeshBatchOperator
 from .facemesh_cleanup import FacemeshCleanupOpenEyesOperator, FacemeshCleanupOpenMouthOperator, FacemeshCleanupSymmetrizeOperator, FacemeshCleanupSmartSymmetrizeOperator, FacemeshCleanupCloseEyesOperator, FacemeshCleanupCloseMouthOperator
 from .rig_facemesh import RigFacemeshOperator, ParentFacemeshToRigOperator, AddRigOperator
-from .mocap import GenRigFromMetaRigOperator, MocapOperator
+from .mocap import GenRigFromMetaRigOperator, MocapOperator, MocapReplayOperator, MocapRetargetOperator, MocapLiveStopOperator
+from .session import ReleaseLandmarkersOperator, register_handlers, unregister_handlers
+from .scene_index import register_scene_index, unregister_scene_index
 
 operator_classes = (
     FileBrowserOperator,
     FaceImg2FacemeshOperator,
+    FaceImg2FacemeshBatchOperator,
     FacemeshCleanupOpenEyesOperator,
     FacemeshCleanupOpenMouthOperator,
     FacemeshCleanupSymmetrizeOperator,
@@ -18,4 +21,8 @@ operator_classes = (
     AddRigOperator,
     GenRigFromMetaRigOperator,
     MocapOperator,
+    MocapReplayOperator,
+    MocapRetargetOperator,
+    MocapLiveStopOperator,
+    ReleaseLandmarkersOperator,
 )
\ No newline at end of file
@@ -1,15 +1,25 @@
 import bpy
 import os
-import json
-import math
+import sys
+import time
 
 import importlib
 from collections import namedtuple
+
+# The bpy-free parts of the pipeline live in scripts/ so worker processes can import them without Blender
+script_dir = os.path.dirname(__file__)
+pipeline_dir = os.path.join(os.path.split(script_dir)[0], 'scripts')
+if pipeline_dir not in sys.path:
+    sys.path.append(pipeline_dir)
+
 Dependency = namedtuple("Dependency", ["module", "package", "name"])
 dependencies = (
     Dependency(module="numpy", package=None, name='np'),
+    Dependency(module="scipy", package=None, name=None),
     Dependency(module="skimage", package="scikit-image", name=None),
-    Dependency(module="mediapipe", package=None, name=None),
+    Dependency(module="facemesh_pipeline", package=None, name=None),
+    Dependency(module="landmark_cache", package=None, name=None),
+    Dependency(module="landmark_backends", package=None, name=None),
 )
 dependencies_imported = False
 
@@ -40,13 +50,122 @@ def import_dependencies():
         dependencies_imported = True
 
 
-class FaceImg2FacemeshOperator(bpy.types.Operator):
-    """Convert image to face mesh"""
-    bl_idname = "object.faceimg2facemesh"
-    bl_label = "FaceImg2Facemesh"
+def get_save_dir(img_path):
+    # Determine save path
+    save_dir = ''
+    addon_prefs = bpy.context.preferences.addons
+    if 'cyanic_toolbox' in addon_prefs.keys():
+        cyanic_prefs = addon_prefs['cyanic_toolbox'].preferences
+        fallback_to_img_path = False
+        fallback_to_custom_path = False
+        fallback_to_last_resort = False
+
+        # Choose where to save the facemesh files based on user preferences
+        if cyanic_prefs.save_dir == 'BLEND_DIR':
+            # Check if the file has been saved already, and save to that directory
+            blend_path = bpy.data.filepath
+            if len(blend_path) > 0:
+                save_dir = os.path.split(blend_path)[0]
+            else:
+                # Not saved, fallback to another option
+                fallback_to_custom_path = True
+
+        if cyanic_prefs.save_dir == 'CUSTOM_DIR' or fallback_to_custom_path:
+            # Try to save to a specified custom directory
+            if not os.path.isdir(cyanic_prefs.custom_path):
+                # 4.1 has a bug where it can append "Documents" or the username to the end of the path when it's selected
+                # https://projects.blender.org/blender/blender/issues/123471
+                # Attempt to fix it
+                fixed_path = os.path.sep.join(cyanic_prefs.custom_path.split(os.path.sep)[:-1])
+                if os.path.isdir(fixed_path):
+                    bpy.context.preferences.addons['cyanic_toolbox'].preferences.custom_path = fixed_path
+                    cyanic_prefs = addon_prefs['cyanic_toolbox'].preferences
+                else:
+                    fallback_to_img_path = True
+
+            if not fallback_to_img_path: # The custom path either was fine or was fixed
+                save_dir = cyanic_prefs.custom_path
 
+        if cyanic_prefs.save_dir == 'IMG_DIR' or fallback_to_img_path:
+            # Worst case scenario - save to the directory the source image was in.
+            if len(img_path) > 0:
+                save_dir = os.path.split(img_path)[0] # Save OBJ to the same directory as the source image
+            else:
+                fallback_to_last_resort = True
+
+        # If pasted image, and there's no custom path, and it's not saved... 
+        if len(save_dir) == 0 or fallback_to_last_resort:
+            import pathlib
+            save_dir = os.path.join('%s' % pathlib.Path.home(), 'cyanic_face_meshes') # C:\Users\Username\cyanic_face_meshes on Windows
+    return save_dir
+
+def get_preference(name, default):
+    # Value of an add-on preference, or default if the preferences can't be found (ex: running from the text editor)
+    addon_prefs = bpy.context.preferences.addons
+    if 'cyanic_toolbox' in addon_prefs.keys():
+        return getattr(addon_prefs['cyanic_toolbox'].preferences, name)
+    return default
+
+def get_landmark_backend(pose_options=None):
+    # The detector picked in the add-on preferences, see scripts/landmark_backends.py
+    import_dependencies() # Also used by the mocap operators. mediapipe isn't imported until a solutions or tasks model is made, so replay works without it
+    return landmark_backends.get_backend(get_preference('landmark_backend', 'solutions'), pose_options)
+
+def create_facemesh_object(context, name, vertices, face_model, texture, texture_path=None):
+    # Builds the mesh straight from the arrays, instead of writing an .obj and importing it
+    # .obj files are Y up and the importer converts them to Blender's Z up, do the same here so both ways match
+    vertices = np.asarray(vertices)[:, [0, 2, 1]] * (1, -1, 1)
+    faces = face_model.faces
+
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(len(vertices))
+    mesh.vertices.foreach_set('co', vertices.astype(np.float32).ravel())
+    mesh.loops.add(faces.size)
+    mesh.loops.foreach_set('vertex_index', faces.astype(np.int32).ravel())
+    mesh.polygons.add(len(faces))
+    mesh.polygons.foreach_set('loop_start', np.arange(0, faces.size, 3, dtype=np.int32))
+    if bpy.app.version < (4, 0, 0):
+        # 4.0 works out the polygon sizes from loop_start, and made loop_total read only
+        mesh.polygons.foreach_set('loop_total', np.full(len(faces), 3, dtype=np.int32))
+    mesh.update(calc_edges=True)
+
+    uv_layer = mesh.uv_layers.new(name='UVMap')
+    uv_layer.data.foreach_set('uv', face_model.uvcoords[face_model.uv_faces.ravel()].astype(np.float32).ravel())
+
+    # texture_path is only given when the texture was just saved there, an older file could be from another image
+    if texture_path is not None and os.path.isfile(texture_path):
+        image = bpy.data.images.load(texture_path, check_existing=False)
+    else:
+        # Nothing on disk, keep the texture inside the .blend file
+        height, width = texture.shape[:2]
+        if texture.ndim == 2:
+            texture = np.repeat(texture[..., None], 3, axis=2) # Grayscale
+        image = bpy.data.images.new('%s_texture' % name, width, height)
+        pixels = np.ones((height, width, 4), dtype=np.float32)
+        pixels[..., :3] = texture[..., :3] / 255
+        image.pixels.foreach_set(pixels[::-1].ravel()) # Blender images start at the bottom left
+        image.pack()
+
+    material = bpy.data.materials.new('FaceTexture')
+    material.use_nodes = True
+    texture_node = material.node_tree.nodes.new('ShaderNodeTexImage')
+    texture_node.image = image
+    bsdf = material.node_tree.nodes.get('Principled BSDF')
+    if bsdf is not None:
+        material.node_tree.links.new(bsdf.inputs['Base Color'], texture_node.outputs['Color'])
+    mesh.materials.append(material)
+
+    obj = bpy.data.objects.new(name, mesh)
+    context.collection.objects.link(obj)
+    for selected_obj in context.view_layer.objects.selected:
+        selected_obj.select_set(False)
+    obj.select_set(True)
+    context.view_layer.objects.active = obj
+    return obj
+
+class FacemeshBuilder:
+    """Shared steps for turning an image into a face mesh. Mixed into the single and batch operators"""
     # data_dir = 'data'
-    script_dir = os.path.dirname(__file__)
     data_dir = os.path.join(os.path.split(script_dir)[0], 'data')
 
     img_path = ''
@@ -54,358 +173,187 @@ class FaceImg2FacemeshOperator(bpy.types.Operator):
     obj_name = ''
     texture_name = ''
     uv_map = None
+    saved_files = False # Whether landmarks_to_3d wrote the .obj and texture for the current image
+
+    def set_image(self, img_path):
+        self.img_path = img_path
+        self.save_dir = get_save_dir(img_path)
+        self.obj_name, self.texture_name = facemesh_pipeline.output_names(img_path)
+
+    def prep_uv_map(self):
+        self.uv_map = facemesh_pipeline.load_uv_map(self.data_dir)
+
+    def landmark_detection(self):
+        self.img = skimage.io.imread(self.img_path)
+
+        # Same image + same settings = same landmarks, skip mediapipe if they're already cached
+        backend = get_landmark_backend()
+        landmark_cache.max_cache_bytes = get_preference('landmark_cache_mb', 64) * 1024 * 1024
+        cache_key = None
+        if backend.face_cache_key() is not None:
+            cache_key = landmark_cache.image_key(self.img_path, *backend.face_cache_key())
+        cached = landmark_cache.load(cache_key) if cache_key is not None else None
+        if cached is not None:
+            landmarks = cached['landmarks']
+            if self.img.ndim == 3 and self.img.shape[2] == 4:
+                # Mediapipe needed this converted to RGB the first time
+                self.img = skimage.color.rgba2rgb(self.img)
+        else:
+            try:
+                self.img, landmarks = backend.detect_face(self.img)
+            except (ValueError, IOError) as e:
+                self.report({'ERROR_INVALID_INPUT'}, '%s' % e)
+                return {'CANCELLED'}
+            if cache_key is not None:
+                landmark_cache.save(cache_key, landmarks=landmarks)
+
+        self.keypoints, self.keypoints3d = facemesh_pipeline.landmarks_to_keypoints(landmarks, self.img.shape)
+
+    def prep_texture(self):
+        self.texture = facemesh_pipeline.prep_texture(self.img, self.keypoints, self.uv_map, get_preference('texture_size', 512))
+
+    def landmarks_to_3d(self, save_files=True):
+        self.vertices = facemesh_pipeline.landmarks_to_3d(self.keypoints3d)
+        self.prep_texture()
+        self.saved_files = save_files
+        if save_files:
+            facemesh_pipeline.save_facemesh(os.path.join(self.save_dir, self.obj_name),
+                                            os.path.join(self.save_dir, self.texture_name),
+                                            self.vertices,
+                                            self.texture,
+                                            self.data_dir,
+                                            get_preference('obj_precision', 6))
+
+    def create_object(self, context):
+        return create_facemesh_object(context,
+                                      os.path.splitext(self.obj_name)[0],
+                                      self.vertices,
+                                      facemesh_pipeline.load_face_model(self.data_dir),
+                                      self.texture,
+                                      os.path.join(self.save_dir, self.texture_name) if self.saved_files else None)
+
+
+class FaceImg2FacemeshOperator(FacemeshBuilder, bpy.types.Operator):
+    """Convert image to face mesh"""
+    bl_idname = "object.faceimg2facemesh"
+    bl_label = "FaceImg2Facemesh"
 
     def execute(self, context):
         import_dependencies()
         # Read img from context.scene.cyanic_img_path
-        self.img_path = context.scene.cyanic_img_path
+        img_path = context.scene.cyanic_img_path
 
-        if len(self.img_path) == 0 or not os.path.exists(self.img_path):
+        if len(img_path) == 0 or not os.path.exists(img_path):
             self.report({'ERROR_INVALID_INPUT'}, 'Please select an image (jpg/jpeg work best)')
             return {'CANCELLED'}
 
-        # Determine save path
-        addon_prefs = bpy.context.preferences.addons
-        if 'cyanic_toolbox' in addon_prefs.keys():
-            cyanic_prefs = addon_prefs['cyanic_toolbox'].preferences
-            fallback_to_img_path = False
-            fallback_to_custom_path = False
-            fallback_to_last_resort = False
-
-            # Choose where to save the facemesh files based on user preferences
-            if cyanic_prefs.save_dir is 'BLEND_DIR':
-                # Check if the file has been saved already, and save to that directory
-                blend_path = bpy.data.filepath
-                if len(blend_path) > 0:
-                    self.save_dir = os.path.split(blend_path)[0]
-                else:
-                    # Not saved, fallback to another option
-                    fallback_to_custom_path = True
-
-            if cyanic_prefs.save_dir is 'CUSTOM_DIR' or fallback_to_custom_path:
-                # Try to save to a specified custom directory
-                if not os.path.isdir(cyanic_prefs.custom_path):
-                    # 4.1 has a bug where it can append "Documents" or the username to the end of the path when it's selected
-                    # https://projects.blender.org/blender/blender/issues/123471
-                    # Attempt to fix it
-                    fixed_path = os.path.sep.join(cyanic_prefs.custom_path.split(os.path.sep)[:-1])
-                    if os.path.isdir(fixed_path):
-                        bpy.context.preferences.addons['cyanic_toolbox'].preferences.custom_path = fixed_path
-                        cyanic_prefs = addon_prefs['cyanic_toolbox'].preferences
-                    else:
-                        fallback_to_img_path = True
-
-                if not fallback_to_img_path: # The custom path either was fine or was fixed
-                    self.save_dir = cyanic_prefs.custom_path
-
-            if cyanic_prefs.save_dir is 'IMG_DIR' or fallback_to_img_path:
-                # Worst case scenario - save to the directory the source image was in.
-                if len(self.img_path) > 0:
-                    self.save_dir = os.path.split(self.img_path)[0] # Save OBJ to the same directory as the source image
-                else:
-                    fallback_to_last_resort = True
-
-            # If pasted image, and there's no custom path, and it's not saved... 
-            if len(self.save_dir) == 0 or fallback_to_last_resort:
-                import pathlib
-                self.save_dir = os.path.join('%s' % pathlib.Path.home(), 'cyanic_face_meshes') # C:\Users\Username\cyanic_face_meshes on Windows
-
-        # self.save_dir = os.path.split(self.img_path)[0] # Save OBJ to the same directory as the source image
-        filename =  os.path.splitext(os.path.basename(self.img_path))[0] # the name without the extension
-        self.obj_name =  "%s.obj" % filename
-        self.texture_name = ".%s_texture.jpg" % filename
+        self.set_image(img_path)
 
         self.prep_uv_map()
         response = self.landmark_detection()
         # Because mediapipe is particular about how the PNG is formatted, it might fail - even with rgba2rgb
         if response is not None:
             return response
-        self.landmarks_to_3d()
+        self.landmarks_to_3d(get_preference('save_files', True))
 
-        # Import finished file into Blender
-        bpy.ops.wm.obj_import(filepath=os.path.join(self.save_dir, self.obj_name))
-        # The object is now the active object, assign it to cyanic_facemesh
-        context.scene.cyanic_facemesh = bpy.context.view_layer.objects.active.data # Gets the active mesh (data) instead of just the object
+        # Build the mesh in Blender, saving the .obj (if enabled) is only for use outside of Blender
+        facemesh_obj = self.create_object(context)
+        context.scene.cyanic_facemesh = facemesh_obj.data # The mesh (data) instead of just the object
         return {'FINISHED'}
 
-    # borrowed from https://github.com/YadiraF/DECA/blob/f84855abf9f6956fb79f3588258621b363fa282c/decalib/utils/util.py
-    def load_obj(self, obj_filename):
-        """ Ref: https://github.com/facebookresearch/pytorch3d/blob/25c065e9dafa90163e7cec873dbb324a637c68b7/pytorch3d/io/obj_io.py
-        Load a mesh from a file-like object.
-        """
-        with open(obj_filename, 'r') as f:
-            lines = [line.strip() for line in f]
-
-        verts, uvcoords = [], []
-        faces, uv_faces = [], []
-        # startswith expects each line to be a string. If the file is read in as
-        # bytes then first decode to strings.
-        if lines and isinstance(lines[0], bytes):
-            lines = [el.decode("utf-8") for el in lines]
-
-        for line in lines:
-            tokens = line.strip().split()
-            if line.startswith("v "):  # Line is a vertex.
-                vert = [float(x) for x in tokens[1:4]]
-                if len(vert) != 3:
-                    msg = "Vertex %s does not have 3 values. Line: %s"
-                    raise ValueError(msg % (str(vert), str(line)))
-                verts.append(vert)
-            elif line.startswith("vt "):  # Line is a texture.
-                tx = [float(x) for x in tokens[1:3]]
-                if len(tx) != 2:
-                    raise ValueError(
-                        "Texture %s does not have 2 values. Line: %s" % (str(tx), str(line))
-                    )
-                uvcoords.append(tx)
-            elif line.startswith("f "):  # Line is a face.
-                # Update face properties info.
-                face = tokens[1:]
-                face_list = [f.split("/") for f in face]
-                for vert_props in face_list:
-                    # Vertex index.
-                    faces.append(int(vert_props[0]))
-                    if len(vert_props) > 1:
-                        if vert_props[1] != "":
-                            # Texture index is present e.g. f 4/1/1.
-                            uv_faces.append(int(vert_props[1]))
-
-        verts = np.array(verts)
-        uvcoords = np.array(uvcoords)
-        faces = np.array(faces); faces = faces.reshape(-1, 3) - 1
-        uv_faces = np.array(uv_faces); uv_faces = uv_faces.reshape(-1, 3) - 1
-        return (
-            verts,
-            uvcoords,
-            faces,
-            uv_faces
-        )
-    
-    # borrowed from https://github.com/YadiraF/DECA/blob/f84855abf9f6956fb79f3588258621b363fa282c/decalib/utils/util.py
-    def write_obj(self, 
-                obj_name,
-                vertices,
-                faces,
-                texture_name = "texture.jpg",
-                colors=None,
-                texture=None,
-                uvcoords=None,
-                uvfaces=None
-                ):
-        ''' Save 3D face model with texture. 
-        Ref: https://github.com/patrikhuber/eos/blob/bd00155ebae4b1a13b08bf5a991694d682abbada/include/eos/core/Mesh.hpp
-        Args:
-            obj_name: str
-            vertices: shape = (nver, 3)
-            colors: shape = (nver, 3)
-            faces: shape = (ntri, 3)
-            texture: shape = (uv_size, uv_size, 3)
-            uvcoords: shape = (nver, 2) max value<=1
-        '''
-        if os.path.splitext(obj_name)[-1] != '.obj':
-            obj_name = obj_name + '.obj'
-        mtl_name = obj_name.replace('.obj', '.mtl')
-        texture_name
-        material_name = 'FaceTexture'
-
-        faces = faces.copy()
-        # mesh lab start with 1, python/c++ start from 0
-        faces += 1
-
-        # write obj
-        with open(obj_name, 'w') as f:
-            # first line: write mtlib(material library)
-            if texture is not None:
-                f.write('mtllib %s\n\n' % os.path.basename(mtl_name))
-
-            # write vertices
-            if colors is None:
-                for i in range(vertices.shape[0]):
-                    f.write('v {} {} {}\n'.format(vertices[i, 0], vertices[i, 1], vertices[i, 2]))
-            else:
-                for i in range(vertices.shape[0]):
-                    f.write('v {} {} {} {} {} {}\n'.format(vertices[i, 0], vertices[i, 1], vertices[i, 2], colors[i, 0], colors[i, 1], colors[i, 2]))
-
-            # write uv coords
-            if texture is None:
-                for i in range(faces.shape[0]):
-                    f.write('f {} {} {}\n'.format(faces[i, 2], faces[i, 1], faces[i, 0]))
-            else:
-                for i in range(uvcoords.shape[0]):
-                    f.write('vt {} {}\n'.format(uvcoords[i,0], uvcoords[i,1]))
-                f.write('usemtl %s\n' % material_name)
-                # write f: ver ind/ uv ind
-                uvfaces = uvfaces + 1
-                for i in range(faces.shape[0]):
-                    f.write('f {}/{} {}/{} {}/{}\n'.format(
-                        faces[i, 0], uvfaces[i, 0],
-                        faces[i, 1], uvfaces[i, 1],
-                        faces[i, 2], uvfaces[i, 2]
-                    )
-                    )
-                # write mtl
-                with open(mtl_name, 'w') as f:
-                    f.write('newmtl %s\n' % material_name)
-                    s = 'map_Kd {}\n'.format(os.path.basename(texture_name)) # map to image
-                    f.write(s)
-                try:
-                    skimage.io.imsave(texture_name, texture)
-                except Exception as e:
-                    # There's still an alpha channel in the image
-                    skimage.io.imsave(texture_name, skimage.color.rgba2rgb(texture))
-
-    def normalize_keypoints(self, keypoints3d):
-        # Rotates and centers the points.
-        # One of the rotations is a little too far
-        #  Landmarks labeled
-        #  https://github.com/google/mediapipe/blob/a908d668c730da128dfa8d9f6bd25d519d006692/mediapipe/modules/face_geometry/data/canonical_face_model_uv_visualization.png
-        center = keypoints3d[0]
-        keypoints3d = keypoints3d - center # This centering is undone by some later step
-        # axis1 = keypoints3d[165] - keypoints3d[391] # 165 = left side between nose and lip, # right side between nose and lip (one vertex off center)
-        # axis2 = keypoints3d[2] - keypoints3d[0] # 2 = below nose, 0 = above lip (only 1 vertex apart)
-        axis1 = keypoints3d[454] - keypoints3d[234] # side of face to side of face
-        axis2 = keypoints3d[10] - keypoints3d[152] # forehead to chin
-        axis3 = np.cross(axis2,axis1)
-        axis3 = axis3/np.linalg.norm(axis3)
-        axis2 = axis2/np.linalg.norm(axis2)
-        axis1 = np.cross(axis3, axis2) # Should be redundant
-        axis1 = axis1/np.linalg.norm(axis1)
-        U = np.array([axis3,axis2,axis1]) # Would changing this order help correctly orient the object?
-        keypoints3d = keypoints3d.dot(U)
-        keypoints3d = keypoints3d - keypoints3d.mean(axis=0) # Doesn't seem to make a difference
-
-        return keypoints3d
-
-    def rotate_around_origin(self, keypoints3d, opp_side, adj_side, angle):
-        for row in keypoints3d:
-            a0 = math.cos(angle) * row[opp_side] - math.sin(angle) * row[adj_side]
-            a1 = math.cos(angle) * row[adj_side] + math.sin(angle) * row[opp_side]
-            row[opp_side] = a0
-            row[adj_side] = a1
-        return keypoints3d
-
-    def align_keypoints_to_grid(self, keypoints3d):
-        # Center at keypoints3d[0]
-        # Put chin and forehead (keypoints3d[152] and keypoints3d[10]) on Z axis
-        # Put left and right cheeks (keypoints3d[234] and keypoints3d[454]) on X axis
-        #  Landmarks labeled
-        #  https://github.com/google/mediapipe/blob/a908d668c730da128dfa8d9f6bd25d519d006692/mediapipe/modules/face_geometry/data/canonical_face_model_uv_visualization.png
-        # If needed, center the face 
-        if np.count_nonzero(keypoints3d[0]) > 0: # Check if the values are all zeros
-            keypoints3d = keypoints3d - keypoints3d[0]
-
-        # Rotate the face left-to-right to be straight up-and-down
-        adj_side, opp_side = keypoints3d[10][1], keypoints3d[10][2] # Forehead
-        angle = math.atan2(opp_side, adj_side)
-        keypoints3d = self.rotate_around_origin(keypoints3d, 2, 1, angle)
-
-        # Rotate the face forward-and-back
-        adj_side, opp_side = keypoints3d[9][1], keypoints3d[9][0] # Center of brow
-        angle = math.atan2(opp_side, adj_side)
-        keypoints3d = self.rotate_around_origin(keypoints3d, 0, 1, angle)
-
-        # Rotate the face to be looking straight ahead
-        face_left = keypoints3d[454]
-        face_right = keypoints3d[234]
-        # Need a midpoint between these two to rotate between
-        middle = (face_left + face_right) / 2
-        keypoints3d = keypoints3d - middle
-        # Re-determine the left/right side
-        face_left = keypoints3d[454]
-        face_right = keypoints3d[234]
-        adj_side, opp_side = face_left[0], face_left[2]
-        angle = math.atan2(opp_side, adj_side)
-        keypoints3d = self.rotate_around_origin(keypoints3d, 2, 0, angle)
-        
-        # Return center it's original location
-        keypoints3d = keypoints3d - keypoints3d[0]
-        return keypoints3d
 
-    def prep_uv_map(self):
-        uv_path = os.path.join(self.data_dir, "uv_map.json") # taken from https://github.com/spite/FaceMeshFaceGeometry/blob/353ee557bec1c8b55a5e46daf785b57df819812c/js/geometry.js
-        uv_map_dict = json.load(open(uv_path))
-        self.uv_map = np.array([ (uv_map_dict["u"][str(i)],uv_map_dict["v"][str(i)]) for i in range(468)])
+class FaceImg2FacemeshBatchOperator(FacemeshBuilder, bpy.types.Operator):
+    """Convert every image in a folder (or matching a glob pattern) to a face mesh"""
+    bl_idname = "object.faceimg2facemesh_batch"
+    bl_label = "FaceImg2FacemeshBatch"
 
-    def landmark_detection(self):
-        self.img = skimage.io.imread(self.img_path)
-
-        H,W,_ = self.img.shape
-        # run facial landmark detection
-        with mediapipe.solutions.face_mesh.FaceMesh(
-                static_image_mode=True,
-                refine_landmarks=True,
-                max_num_faces=1,
-                min_detection_confidence=0.5) as face_mesh:
-            
-            # TODO: Just check the extension of self.img_path first to see if it's a PNG
-            try:
-                results = face_mesh.process(self.img)
-            except Exception as e:
-                if type(e) == ValueError and 'must contain three channel rgb info' in '%s' % e:
-                    # PNG was probaly provided, try to convert to JPG
-                    try:
-                        # tmp_path = 'converted.jpg'
-                        # png_img = skimage.io.imread(self.img_path)
-                        # rgb_img = skimage.color.rgba2rgb(png_img)
-                        # skimage.io.imsave(tmp_path, rgb_img, quality=100)
-                        # self.img = skimage.io.imread(tmp_path)
-                        # os.remove(tmp_path) # Cleanup
-                        # results = face_mesh.process(self.img)
-
-                        self.img = skimage.color.rgba2rgb(self.img)
-                        results = face_mesh.process(self.img)
-                    except Exception as e:
-                        # raise Exception('Unable to use a PNG, and unable to automatically convert PNG to JPG')
-                        self.report({'ERROR_INVALID_INPUT'}, 'Unable to use this image, please try a JPG/JPEG image instead.')
-                        return {'CANCELLED'}
-                else:
-                    # Not a 3-channel issue
-                    self.report({'ERROR_INVALID_INPUT'}, '%s: %s' % (type(e), e))
-                    return {'CANCELLED'}
+    def execute(self, context):
+        import_dependencies()
+        batch_path = context.scene.cyanic_img_batch_path
+        img_paths = facemesh_pipeline.collect_batch_images(bpy.path.abspath(batch_path)) if len(batch_path) > 0 else []
 
-        # Only support one face per image, ignores any other faces detected
-        if len(results.multi_face_landmarks) == 0:
-            self.report({'ERROR_INVALID_INPUT'}, 'Unable to find a face in this image. Please try a closer image.')
+        if len(img_paths) == 0:
+            self.report({'ERROR_INVALID_INPUT'}, 'No images found. Select a folder, or a pattern like *.jpg')
             return {'CANCELLED'}
-        face_landmarks = results.multi_face_landmarks[0]
-        self.keypoints = np.array([(W*point.x,H*point.y) for point in face_landmarks.landmark[0:468]])#after 468 is iris or something else
-
-        # The X, Y, and Z coords are normalized to 0.0 to 1.0 for the width and height of the image (Z is at the same scale as X).
-        # To restore the face to it's original ratio, the X and Z coordinates need to be scaled by the ratio of width to height
-        # See https://google.github.io/mediapipe/solutions/face_mesh#output for more details
 
-        width_ratio = W / H
-        self.keypoints3d = np.array([(width_ratio * point.x, point.y, width_ratio * point.z) for point in face_landmarks.landmark[0:468]])
-
-    def prep_texture(self):
-        H_new,W_new = 512,512
-        keypoints_uv = np.array([(W_new*x, H_new*y) for x,y in self.uv_map])
-
-        tform = skimage.transform.PiecewiseAffineTransform()
-        tform.estimate(keypoints_uv,self.keypoints)
-        self.texture = skimage.transform.warp(self.img, tform, output_shape=(H_new,W_new))
-        self.texture = (255*self.texture).astype(np.uint8)
-
-    def landmarks_to_3d(self):
-        obj_filename = os.path.join(self.data_dir, "canonical_face_model.obj")
-        canonical_verts,uvcoords,faces,uv_faces = self.load_obj(obj_filename)
-
-        # keypoints3d already has a face that's more round than the original
-        vertices = self.normalize_keypoints(self.keypoints3d)
-        # Rotate the vertices so the face isn't at an odd angle
-        vertices = self.align_keypoints_to_grid(vertices)
-
-        if not os.path.isdir(self.save_dir):
-            os.makedirs(self.save_dir)
-
-        self.prep_texture()
+        batch_start = time.perf_counter()
+        workers = context.scene.cyanic_batch_workers
+        if workers == 1:
+            finished, created, failed = self.run_in_blender(context, img_paths)
+        else:
+            finished, created, failed = self.run_in_workers(img_paths, workers)
+        batch_time = time.perf_counter() - batch_start
+
+        if context.scene.cyanic_batch_import and workers != 1:
+            # Worker processes can't touch the scene, bring in what they saved
+            for obj_path in finished:
+                bpy.ops.wm.obj_import(filepath=obj_path)
+            if len(finished) > 0:
+                context.scene.cyanic_facemesh = bpy.context.view_layer.objects.active.data
+
+        if len(failed) > 0:
+            self.report({'WARNING'}, 'Created %s face meshes in %.1fs, %s failed: %s' % (created, batch_time, len(failed), ', '.join([os.path.basename(path) for path in failed])))
+        else:
+            self.report({'INFO'}, 'Created %s face meshes in %.1fs' % (created, batch_time))
+
+        if created == 0:
+            return {'CANCELLED'}
+        return {'FINISHED'}
 
-        # borrowed from https://github.com/YadiraF/PRNet/blob/master/utils/write.py
-        self.write_obj(os.path.join(self.save_dir, self.obj_name),
-                    vertices,
-                    faces,
-                    os.path.join(self.save_dir, self.texture_name),
-                    texture=self.texture,
-                    uvcoords=uvcoords,
-                    uvfaces=uv_faces,
-                    )
\ No newline at end of file
+    def run_in_blender(self, context, img_paths):
+        self.prep_uv_map() # Same for every image
+        finished = [] # .obj files written, only with the save_files preference on
+        created = 0 # Images that became a face mesh, as a file, an object in the scene or both
+        failed = []
+        # The landmark backend keeps the model loaded for the whole batch (and for any runs after it)
+        for index, img_path in enumerate(img_paths):
+            img_start = time.perf_counter()
+            imported = False
+            try:
+                self.set_image(img_path)
+                response = self.landmark_detection()
+                if response is None:
+                    self.landmarks_to_3d(get_preference('save_files', True))
+                    if context.scene.cyanic_batch_import:
+                        context.scene.cyanic_facemesh = self.create_object(context).data
+                        imported = True
+            except Exception as e:
+                # Keep going, one bad image shouldn't stop the rest of the batch
+                self.report({'WARNING'}, '%s: %s' % (img_path, e))
+                response = {'CANCELLED'}
+            img_time = time.perf_counter() - img_start
+
+            if response is None:
+                if self.saved_files:
+                    finished.append(os.path.join(self.save_dir, self.obj_name))
+                if self.saved_files or imported:
+                    created += 1
+                print('[%s/%s] %s: %.2fs' % (index + 1, len(img_paths), os.path.basename(img_path), img_time))
+            else:
+                failed.append(img_path)
+                print('[%s/%s] %s: FAILED after %.2fs' % (index + 1, len(img_paths), os.path.basename(img_path), img_time))
+        return finished, created, failed
+
+    def run_in_workers(self, img_paths, workers):
+        # Save paths need bpy, so they're worked out here before handing the jobs to the worker processes.
+        # The workers always write the .obj and texture, whatever the save_files preference says, since that's
+        # the only way their results get back into Blender for the import
+        jobs = []
+        precision = get_preference('obj_precision', 6)
+        texture_size = get_preference('texture_size', 512)
+        for img_path in img_paths:
+            obj_name, texture_name = facemesh_pipeline.output_names(img_path)
+            jobs.append(facemesh_pipeline.FacemeshJob(img_path, get_save_dir(img_path), obj_name, texture_name, precision, texture_size))
+
+        finished = []
+        failed = []
+        for index, result in enumerate(facemesh_pipeline.run_batch(jobs, workers, self.data_dir, get_preference('landmark_backend', 'solutions'))):
+            if result.error is None:
+                finished.append(result.obj_path)
+                print('[%s/%s] %s: %.2fs (%s)' % (index + 1, len(jobs), os.path.basename(result.img_path), sum(result.timings.values()),
+                                                   ', '.join(['%s %.2fs' % (stage, t) for stage, t in result.timings.items()])))
+            else:
+                failed.append(result.img_path)
+                self.report({'WARNING'}, '%s: %s' % (result.img_path, result.error))
+                print('[%s/%s] %s: FAILED' % (index + 1, len(jobs), os.path.basename(result.img_path)))
+        return finished, len(finished), failed
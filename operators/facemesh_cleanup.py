@@ -1,110 +1,136 @@
 import bpy
+import bmesh
 import os
-import json
-
-# data_dir = 'data'
-script_dir = os.path.dirname(__file__)
-data_dir = os.path.join(os.path.split(script_dir)[0], 'data')
-facemesh_mapping_file = os.path.join(data_dir, 'facemesh_rigify_mapping.json')
-facemesh_config_data = {}
-
-def load_config():
-    global facemesh_config_data
-    # with open(os.path.join(root_url, facemesh_mapping_file), 'r') as input_file:
-    with open(facemesh_mapping_file, 'r') as input_file:
-        string_format = input_file.read()
-        facemesh_config_data = json.loads(string_format)
-
-def findObjectByNameAndType(name, obj_type):
-    objects = [obj for obj in bpy.context.scene.objects if obj.type == obj_type and obj.data.name == name]
-    if len(objects) == 1:
-        return objects[0]
-    print('Found %s objects for %s, %s' % (len(objects), name, obj_type))
-    print(objects)
-    return objects[-1]
-
-def selectObject(name, obj_type):
-    bpy.ops.object.mode_set(mode='OBJECT')
-    bpy.ops.object.select_all(action='DESELECT')
-    obj = findObjectByNameAndType(name, obj_type)
-    bpy.context.view_layer.objects.active = obj # Active object is what transform_apply is interacting with
-    bpy.data.objects[obj.name].select_set(True)
-    return obj
-
-
-def delete_faces(facemesh, face_vert_list):
-    selectObject(facemesh.name, 'MESH')
-
-    bpy.ops.object.mode_set(mode='EDIT')
-    bpy.ops.mesh.select_mode(type='VERT')
-    bpy.ops.mesh.select_all(action='DESELECT')
-    
-    # Counter-intuitively, you select the vertexes in Object mode, then switch to Edit mode
-    bpy.ops.object.mode_set(mode='OBJECT')
-    for vert in facemesh.vertices:
-        vert.select = False
-
-    for face in face_vert_list:
-        for v in face:
-            facemesh.vertices[v].select = True
-
-        bpy.ops.object.mode_set(mode='EDIT')
-        bpy.ops.mesh.delete(type='ONLY_FACE')
-        bpy.ops.object.mode_set(mode='OBJECT')
-        
-        for v in face:
-            facemesh.vertices[v].select = False
 
-
-def delete_edges(facemesh, edge_vert_list):
-    selectObject(facemesh.name, 'MESH')
-
-    bpy.ops.object.mode_set(mode='EDIT')
-    bpy.ops.mesh.select_mode(type='VERT')
-    bpy.ops.mesh.select_all(action='DESELECT')
+import importlib
+from collections import namedtuple
+
+from . import scene_index
+from .scene_index import findObjectByNameAndType, selectObject
+
+Dependency = namedtuple("Dependency", ["module", "package", "name"])
+dependencies = (
+    Dependency(module="numpy", package=None, name='np'),
+)
+dependencies_imported = False
+
+def import_module(module_name, global_name, reload=True):
+    """
+    Import a module.
+    :param module_name: Module to import.
+    :param global_name: (Optional) Name under which the module is imported. If None the module_name will be used.
+        This allows to import under a different name with the same effect as e.g. "import numpy as np" where "np" is
+        the global_name under which the module can be accessed.
+    :raises: ImportError and ModuleNotFoundError
+    """
+    if global_name is None:
+        global_name = module_name
     
-    # Counter-intuitively, you select the vertexes in Object mode, then switch to Edit mode
-    bpy.ops.object.mode_set(mode='OBJECT')
-    for vert in facemesh.vertices:
-        vert.select = False
-
-    for face in edge_vert_list:
-        for v in face:
-            facemesh.vertices[v].select = True
-
-        bpy.ops.object.mode_set(mode='EDIT')
-        bpy.ops.mesh.delete(type='EDGE')
-        bpy.ops.object.mode_set(mode='OBJECT')
-        
-        for v in face:
-            facemesh.vertices[v].select = False
-
-def rebuild_faces(facemesh, face_vert_list):
-    selectObject(facemesh.name, 'MESH')
-
-    bpy.ops.object.mode_set(mode='EDIT')
-    bpy.ops.mesh.select_mode(type='VERT')
-    bpy.ops.mesh.select_all(action='DESELECT')
-    
-    # Counter-intuitively, you select the vertexes in Object mode, then switch to Edit mode
-    bpy.ops.object.mode_set(mode='OBJECT')
-    for vert in facemesh.vertices:
-        vert.select = False
-
-    for face in face_vert_list:
-        for v in face:
-            facemesh.vertices[v].select = True
-
-        bpy.ops.object.mode_set(mode='EDIT')
-        bpy.ops.mesh.edge_face_add()
-        bpy.ops.object.material_slot_assign()
-        # bpy.ops.mesh.f2()
-
-        bpy.ops.mesh.select_all(action='DESELECT')
-        bpy.ops.object.mode_set(mode='OBJECT')
-
-        for v in face:
-            facemesh.vertices[v].select = False
+    if global_name in globals():
+        importlib.reload(globals()[global_name])
+    else:
+        # Attempt to import the module and assign it to globals dictionary. This allow to access the module under
+        # the given name, just like the regular import would.
+        globals()[global_name] = importlib.import_module(module_name)
+
+def import_dependencies():
+    global dependencies_imported
+    if not dependencies_imported:
+        for dependency in dependencies:
+            import_module(dependency.module, dependency.name)
+        dependencies_imported = True
+
+def open_bmesh(facemesh):
+    # All the edits for one click happen on a single bmesh, so there's only one trip out of (and back into)
+    # Edit mode no matter how many faces get changed
+    obj = selectObject(facemesh.name, 'MESH')
+    bm = bmesh.new()
+    bm.from_mesh(facemesh)
+    return obj, bm
+
+def close_bmesh(facemesh, bm):
+    bm.to_mesh(facemesh)
+    bm.free()
+    facemesh.update()
+
+def lookup_verts(bm, vert_list):
+    # vert_list is an int array from facemesh_mapping, with indexes for the untouched facemesh.
+    # Indexes are only right before anything is deleted, so callers resolve every region with this first and then
+    # work on the BMVerts. Indexes past the end (a facemesh that doesn't match the mapping) are skipped
+    bm.verts.ensure_lookup_table()
+    return [[bm.verts[v] for v in verts if v < len(bm.verts)] for verts in vert_list.tolist()]
+
+def find_face(verts):
+    # The face made of exactly these verts, or None
+    if len(verts) == 0:
+        return None
+    faces = set(verts[0].link_faces)
+    for v in verts[1:]:
+        faces &= set(v.link_faces)
+    for face in faces:
+        if len(face.verts) == len(verts):
+            return face
+    return None
+
+def find_faces(bm, face_vert_list):
+    faces = []
+    for verts in lookup_verts(bm, face_vert_list):
+        face = find_face(verts)
+        if face is not None and face not in faces:
+            faces.append(face)
+    return faces
+
+def find_edges(bm, edge_vert_list):
+    edges = []
+    for verts in lookup_verts(bm, edge_vert_list):
+        if len(verts) != 2:
+            continue
+        edge = bm.edges.get(verts)
+        if edge is not None and edge not in edges:
+            edges.append(edge)
+    return edges
+
+
+def delete_faces(bm, faces):
+    # Same as selecting each face's verts and deleting Only Faces, but all at once.
+    # An earlier delete may already have taken some of them
+    bmesh.ops.delete(bm, geom=[face for face in faces if face.is_valid], context='FACES_ONLY')
+
+
+def delete_edges(bm, edges):
+    # Same as selecting each edge's verts and deleting Edges (which also takes faces using them and loose verts)
+    bmesh.ops.delete(bm, geom=[edge for edge in edges if edge.is_valid], context='EDGES')
+
+def rebuild_faces(bm, face_vert_list, material_index=0):
+    # Same as selecting each face's verts, Fill (F) and assigning the active material
+    new_faces = []
+    for verts in lookup_verts(bm, face_vert_list):
+        if len(verts) < 3 or find_face(verts) is not None:
+            continue # Already filled
+        face = bm.faces.new(verts)
+        face.material_index = material_index
+        new_faces.append(face)
+    wind_like_neighbours(new_faces)
+    bm.normal_update()
+
+def wind_like_neighbours(faces):
+    # The mapping's triangles aren't in the facemesh's winding order, so flip each new face to run the opposite way
+    # along a shared edge from the face next to it (like Fill does). Starts from the faces touching the old mesh and
+    # works inwards, faces that don't touch anything are left as they are
+    pending = set(faces)
+    settled = True
+    while settled:
+        settled = False
+        for face in list(pending):
+            for loop in face.loops:
+                neighbour = loop.link_loop_radial_next
+                if neighbour == loop or neighbour.face in pending:
+                    continue
+                if neighbour.vert == loop.vert:
+                    face.normal_flip()
+                pending.remove(face)
+                settled = True
+                break
 
 class FacemeshCleanupSmartSymmetrizeOperator(bpy.types.Operator):
     """Symmetry by vertex. More precise than Blender's Symmetrize for the facemesh"""
@@ -113,43 +139,38 @@ class FacemeshCleanupSmartSymmetrizeOperator(bpy.types.Operator):
     bl_options = {'REGISTER', 'UNDO'} # Enable undo for operations
 
     def execute(self, context):
-        if len(facemesh_config_data.keys()) == 0:
-            load_config()
+        mapping = scene_index.get_mapping()
         facemesh = context.scene.cyanic_facemesh
         starting_mode = bpy.context.object.mode
 
+        import_dependencies()
         selectObject(facemesh.name, 'MESH')
 
         # Doing it simple for now
         #   * Assuming Mirroring over X
-
-        bpy.ops.object.mode_set(mode='EDIT')
-        bpy.ops.mesh.select_mode(type='VERT')
-
-        # Counter-intuitively, you select the vertexes in Object mode, then switch to Edit mode
-        bpy.ops.object.mode_set(mode='OBJECT')
-        for vert_index in facemesh_config_data['symmetry']['center']:
-            # facemesh.vertices[vert_index].select = True
-            facemesh.vertices[vert_index].co.x = 0
-      
-        for vert_pair in facemesh_config_data['symmetry']['mirror_pairs']:
-            # Find the distance between the two X axis, split that distance left and right.
-            # Average the Y and Z 
-            left_side = facemesh.vertices[vert_pair[0]]
-            right_side = facemesh.vertices[vert_pair[1]]
-
-            x_distance = abs(left_side.co.x) + abs(right_side.co.x)
-            facemesh.vertices[vert_pair[0]].co.x = -1 * x_distance/2
-            facemesh.vertices[vert_pair[1]].co.x = x_distance/2
-
-            z_average = (left_side.co.z + right_side.co.z) / 2
-            facemesh.vertices[vert_pair[0]].co.z = z_average
-            facemesh.vertices[vert_pair[1]].co.z = z_average
-
-            y_average = (left_side.co.y + right_side.co.y) / 2
-            facemesh.vertices[vert_pair[0]].co.y = y_average
-            facemesh.vertices[vert_pair[1]].co.y = y_average
-
+        # The config only has indexes for the first 468 verts, any extra verts (subdivided or extended meshes) are left alone
+
+        # Read every vert once, fix the symmetry with index arrays, write them all back at once
+        co = np.empty(len(facemesh.vertices) * 3, dtype=np.float32)
+        facemesh.vertices.foreach_get('co', co)
+        co = co.reshape(-1, 3)
+
+        co[mapping.center, 0] = 0
+
+        mirror_pairs = mapping.mirror_pairs
+        left_side = co[mirror_pairs[:, 0]]
+        right_side = co[mirror_pairs[:, 1]]
+        # Find the distance between the two X axis, split that distance left and right.
+        # Average the Y and Z 
+        x_distance = np.abs(left_side[:, 0]) + np.abs(right_side[:, 0])
+        yz_average = (left_side[:, 1:] + right_side[:, 1:]) / 2
+        co[mirror_pairs[:, 0], 0] = -1 * x_distance/2
+        co[mirror_pairs[:, 1], 0] = x_distance/2
+        co[mirror_pairs[:, 0], 1:] = yz_average
+        co[mirror_pairs[:, 1], 1:] = yz_average
+
+        facemesh.vertices.foreach_set('co', co.ravel())
+        facemesh.update()
 
         bpy.ops.object.mode_set(mode=starting_mode)
         return {'FINISHED'}
@@ -187,17 +208,18 @@ class FacemeshCleanupOpenEyesOperator(bpy.types.Operator):
 
 
     def execute(self, context):
-        if len(facemesh_config_data.keys()) == 0:
-            load_config()
+        mapping = scene_index.get_mapping()
 
         facemesh = context.scene.cyanic_facemesh
         starting_mode = bpy.context.object.mode
 
-        delete_faces(facemesh, facemesh_config_data['face_verts']['eye.L'])
-        delete_faces(facemesh, facemesh_config_data['face_verts']['eye.R'])
-
-        delete_edges(facemesh, facemesh_config_data['edge_verts']['eye.L'])
-        delete_edges(facemesh, facemesh_config_data['edge_verts']['eye.R'])
+        obj, bm = open_bmesh(facemesh)
+        # Find everything by index before the first delete, deleting edges takes loose verts and shifts the indexes
+        faces = find_faces(bm, mapping.face_verts['eye.L']) + find_faces(bm, mapping.face_verts['eye.R'])
+        edges = find_edges(bm, mapping.edge_verts['eye.L']) + find_edges(bm, mapping.edge_verts['eye.R'])
+        delete_faces(bm, faces)
+        delete_edges(bm, edges)
+        close_bmesh(facemesh, bm)
 
         bpy.ops.object.mode_set(mode=starting_mode)
 
@@ -210,14 +232,15 @@ class FacemeshCleanupCloseEyesOperator(bpy.types.Operator):
     bl_options = {'REGISTER', 'UNDO'} # Enable undo for operations
 
     def execute(self, context):
-        if len(facemesh_config_data.keys()) == 0:
-            load_config()
+        mapping = scene_index.get_mapping()
 
         facemesh = context.scene.cyanic_facemesh
         starting_mode = bpy.context.object.mode
 
-        rebuild_faces(facemesh, facemesh_config_data['face_verts']['eye.L'])
-        rebuild_faces(facemesh, facemesh_config_data['face_verts']['eye.R'])
+        obj, bm = open_bmesh(facemesh)
+        rebuild_faces(bm, mapping.face_verts['eye.L'], obj.active_material_index)
+        rebuild_faces(bm, mapping.face_verts['eye.R'], obj.active_material_index)
+        close_bmesh(facemesh, bm)
 
         bpy.ops.object.mode_set(mode=starting_mode)
 
@@ -231,15 +254,18 @@ class FacemeshCleanupOpenMouthOperator(bpy.types.Operator):
 
 
     def execute(self, context):
-        if len(facemesh_config_data.keys()) == 0:
-            load_config()
+        mapping = scene_index.get_mapping()
 
         facemesh = context.scene.cyanic_facemesh
         starting_mode = bpy.context.object.mode
 
-        delete_faces(facemesh, facemesh_config_data['face_verts']['mouth'])
-
-        delete_edges(facemesh, facemesh_config_data['edge_verts']['mouth'])
+        obj, bm = open_bmesh(facemesh)
+        # Find everything by index before the first delete, deleting edges takes loose verts and shifts the indexes
+        faces = find_faces(bm, mapping.face_verts['mouth'])
+        edges = find_edges(bm, mapping.edge_verts['mouth'])
+        delete_faces(bm, faces)
+        delete_edges(bm, edges)
+        close_bmesh(facemesh, bm)
 
         bpy.ops.object.mode_set(mode=starting_mode)
 
@@ -253,13 +279,14 @@ class FacemeshCleanupCloseMouthOperator(bpy.types.Operator):
 
 
     def execute(self, context):
-        if len(facemesh_config_data.keys()) == 0:
-            load_config()
+        mapping = scene_index.get_mapping()
 
         facemesh = context.scene.cyanic_facemesh
         starting_mode = bpy.context.object.mode
 
-        rebuild_faces(facemesh, facemesh_config_data['face_verts']['mouth'])
+        obj, bm = open_bmesh(facemesh)
+        rebuild_faces(bm, mapping.face_verts['mouth'], obj.active_material_index)
+        close_bmesh(facemesh, bm)
 
         bpy.ops.object.mode_set(mode=starting_mode)
 
@@ -1,13 +1,31 @@
 import bpy
-import mathutils
 import os
+import sys
+import time
 
 import importlib
 from collections import namedtuple
+
+from .faceimg2facemesh import get_preference, get_save_dir, get_landmark_backend
+from .scene_index import findObjectByNameAndType
+
+# The bpy-free helpers live in scripts/
+script_dir = os.path.dirname(__file__)
+pipeline_dir = os.path.join(os.path.split(script_dir)[0], 'scripts')
+if pipeline_dir not in sys.path:
+    sys.path.append(pipeline_dir)
+
 Dependency = namedtuple("Dependency", ["module", "package", "name"])
 dependencies = (
+    Dependency(module="numpy", package=None, name='np'),
+    Dependency(module="scipy", package=None, name=None),
     Dependency(module="cv2", package="opencv-python", name=None),
-    Dependency(module="mediapipe", package=None, name=None),
+    Dependency(module="landmark_cache", package=None, name=None),
+    Dependency(module="mocap_landmarks", package=None, name=None),
+    Dependency(module="mocap_stream", package=None, name=None),
+    Dependency(module="mocap_recording", package=None, name=None),
+    Dependency(module="landmark_filters", package=None, name=None),
+    Dependency(module="mocap_retarget", package=None, name=None),
 )
 dependencies_imported = False
 
@@ -58,7 +76,61 @@ class GenRigFromMetaRigOperator(bpy.types.Operator):
         return {'FINISHED'}
 
 
-class MocapOperator(bpy.types.Operator):
+# Shown in the mocap panel while the live webcam preview runs. stop is set by the panel's stop button
+live_stats = {'running': False, 'stop': False, 'fps': 0.0, 'latency': 0.0, 'dropped': 0}
+
+
+class MocapLiveStopOperator(bpy.types.Operator):
+    """Stop the live webcam mocap preview"""
+    bl_idname = "object.mocap_live_stop"
+    bl_label = "Stop live mocap"
+
+    def execute(self, context):
+        live_stats['stop'] = True
+        return {'FINISHED'}
+
+
+class MocapKeyframer:
+    # Shared by the operators that turn landmark frames into keyframes on the mocap empties
+    pending = {} # part: ([scene frame], [(landmark count, 3) locations]) not written as keyframes yet
+    filters = {} # part: streaming filter from landmark_filters
+    filter_kind = None
+    filter_settings = {}
+
+    def setup_filters(self, context):
+        self.filters = {}
+        self.filter_kind, self.filter_settings = get_filter_settings(context.scene)
+
+    def filter_landmarks(self, landmark_frame, timestamp):
+        # Smooths x, y, z with a streaming filter per part, visibility is left alone.
+        # Recordings always keep the unfiltered landmarks, so the filter can be changed and replayed later
+        if self.filter_kind is None:
+            return landmark_frame
+        filtered = {}
+        for part, landmarks in landmark_frame.items():
+            if part not in self.filters:
+                self.filters[part] = landmark_filters.create_filter(self.filter_kind, **self.filter_settings)
+            landmarks = landmarks.copy()
+            landmarks[:, :3] = self.filters[part].filter(landmarks[:, :3], timestamp)
+            filtered[part] = landmarks
+        return filtered
+
+    def landmark_frame_to_pose(self, landmark_frame, image_width, image_height, frame):
+        # landmark_frame is a dict of part: (x, y, z, visibility) arrays, see scripts/mocap_landmarks.py.
+        # The locations wait in self.pending until flush_keyframes() writes them
+        for part, locations in mocap_landmarks.frame_to_locations(landmark_frame, image_width, image_height).items():
+            frames, part_locations = self.pending.setdefault(part, ([], []))
+            frames.append(frame)
+            part_locations.append(locations)
+
+    def flush_keyframes(self, context):
+        for part, (frames, part_locations) in self.pending.items():
+            targets = get_targets(context, part, len(part_locations[0]))
+            write_keyframes(targets, np.array(frames, dtype=np.float32), np.stack(part_locations))
+        self.pending = {}
+
+
+class MocapOperator(MocapKeyframer, bpy.types.Operator):
     """Generate mocap"""
     bl_idname = "object.mocap"
     bl_label = "Mocap"
@@ -67,18 +139,32 @@ class MocapOperator(bpy.types.Operator):
     script_dir = os.path.dirname(__file__)
     data_dir = os.path.join(os.path.split(script_dir)[0], 'data')
     armature = None
+    stream = None
+    timer = None
+    holistic_options = {}
+    backend = None
+    recording = None
+    live = False
+    live_targets = {} # part: mocap empties, looked up once per live run
+    live_rig = None # (rig object, rig_rest_pose results) when the live pose goes on the generated rig's bones
+    last_applied = None
+    scene_seconds = 0 # Time spent writing keyframes, to go with the stream's decode and inference times
+    write_budget = 0.05 # Seconds per timer tick spent putting frames in the scene, so the UI stays responsive
 
     # Note: The Mediapipe Holistic detection has been "coming soon!" for too long, so I'm basing this off the Legacy Solution
     # "Coming Soon" page - https://ai.google.dev/edge/mediapipe/solutions/vision/holistic_landmarker
     # Legacy Solution page - https://github.com/google-ai-edge/mediapipe/blob/master/docs/solutions/holistic.md
     def execute(self, context):
+        import_dependencies()
+        self.pending = {}
+        self.setup_filters(context)
         self.armature = context.scene.cyanic_rigify_gen_rig
         # if self.armature is None:
         #     # Not ready to rig
         #     self.report({'ERROR_INVALID_INPUT'}, "Rig not provided")
         #     return {'CANCELLED'}
 
-        self.holistic_processing(context)
+        return self.holistic_processing(context)
 
 
 
@@ -93,10 +179,12 @@ class MocapOperator(bpy.types.Operator):
             context.scene.cyanic_mocap_file_path = 'data/test_pose.jpg'
             file_path = context.scene.cyanic_mocap_file_path
 
-        mp_holistic = mediapipe.solutions.holistic
         # Set what kind of media is being used
         static_image_mode = True 
-        model_complexity = 2 # 0 for fastest, 2 for most detailed, 1 for middle ground
+        model_complexity = context.scene.cyanic_mocap_model_complexity # 0 for fastest, 2 for most detailed, 1 for middle ground
+        if model_complexity == 'auto':
+            model_complexity = 0 if source_input == 'webcam_input' else 2 # Realtime - make it fast, from file - make it detailed
+        model_complexity = int(model_complexity)
         smooth_landmarks = True # If multiple images, it'll reduce jitter. Ignored if static_image_mode is True
         refine_face_landmarks = False # Used to increase details around the eyes and lips, and add irises
         min_detection_confidence = 0.5
@@ -105,33 +193,56 @@ class MocapOperator(bpy.types.Operator):
         if source_type == 'image_mode':
             # Adjust settings for static content
             static_image_mode = True
-            model_complexity = 2
             refine_face_landmarks = True
 
+            holistic_options = dict(
+                static_image_mode=static_image_mode,
+                model_complexity=model_complexity,
+                refine_face_landmarks=refine_face_landmarks,
+                smooth_landmarks=smooth_landmarks
+            )
             image = None
+            cache_key = None
+            backend = get_landmark_backend(holistic_options)
 
             if source_input == 'file_input':
+                if not os.path.isfile(file_path):
+                    self.report({'ERROR_INVALID_INPUT'}, "Could not read image file")
+                    return {'CANCELLED'}
+
+                # Same image + same settings = same landmarks, skip mediapipe if they're already cached
+                landmark_cache.max_cache_bytes = get_preference('landmark_cache_mb', 64) * 1024 * 1024
+                if backend.pose_cache_key() is not None:
+                    cache_key = landmark_cache.image_key(file_path, *backend.pose_cache_key())
+                cached = landmark_cache.load(cache_key) if cache_key is not None else None
+                if cached is not None:
+                    image_width, image_height = cached.pop('image_size')
+                    self.landmark_frame_to_pose(cached, image_width, image_height, context.scene.frame_current)
+                    self.flush_keyframes(context)
+                    return {'FINISHED'}
+
                 # Read a single image
-                try:
-                    image = cv2.imread(file_path)
-                except:
+                image = cv2.imread(file_path) # None if it can't be read
+                if image is None:
                     self.report({'ERROR_INVALID_INPUT'}, "Could not read image file")
                     return {'CANCELLED'}
 
             elif source_input == 'webcam_input':    
                 # TODO: Add a way to get a still image from webcam, probably using a countdown timer
-                pass
+                self.report({'ERROR_INVALID_INPUT'}, "Webcam images aren't supported yet")
+                return {'CANCELLED'}
 
-            with mp_holistic.Holistic(
-                static_image_mode=static_image_mode,
-                model_complexity=model_complexity,
-                refine_face_landmarks=refine_face_landmarks,
-                smooth_landmarks=smooth_landmarks
-            ) as holistic:
-                image_height, image_width, _ = image.shape
+            image_height, image_width, _ = image.shape
+            try:
                 # Convert the BGR image to RGB before processing.
-                results = holistic.process(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-                self.landmark_frame_to_pose(results, image_width, image_height)
+                frame = backend.detect_pose(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+            except IOError as e:
+                self.report({'ERROR_INVALID_INPUT'}, '%s' % e)
+                return {'CANCELLED'}
+            if cache_key is not None:
+                landmark_cache.save(cache_key, image_size=np.array([image_width, image_height]), **frame)
+            self.landmark_frame_to_pose(frame, image_width, image_height, context.scene.frame_current)
+            self.flush_keyframes(context)
 
 
         elif source_type == 'video_mode':
@@ -141,142 +252,450 @@ class MocapOperator(bpy.types.Operator):
             min_detection_confidence = 0.5
             min_tracking_confidence = 0.5
 
-            cap = None
+            source = None
 
             if source_input == 'file_input':
-                model_complexity = 2 # From file - make it detailed
-                try:
-                    cap = cv2.VideoCapture(file_path)
-                except:
-                    self.report({'ERROR_INVALID_INPUT'}, "Could not read video file")
-                    return {'CANCELLED'}
+                source = file_path
                 
             elif source_input == 'webcam_input':
-                model_complexity = 0 # Realtime - make it fast
-                cap = cv2.VideoCapture(0) # Selects the default webcam
+                source = 0 # Selects the default webcam
 
-            with mp_holistic.Holistic(
+            self.holistic_options = dict(
                 min_detection_confidence=min_detection_confidence,
                 min_tracking_confidence=min_tracking_confidence,
                 model_complexity=model_complexity,
                 refine_face_landmarks=refine_face_landmarks,
                 smooth_landmarks=smooth_landmarks
-            ) as holistic:
-                while cap.isOpened():
-                    success, image = cap.read()
-                    if not success:
-                        # Ignore the empty camera frame
-                        break
-                    
-                    # To improve performance, optionally mark the image as not writeable to
-                    # pass by reference.
-                    image.flags.writeable = False
-                    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-                    image_height, image_width, _ = image.shape
-                    results = holistic.process(image)
-
-                    self.landmark_frame_to_pose(results, image_width, image_height)
+            )
+            # reset so tracking doesn't carry over from the last video
+            self.backend = get_landmark_backend(self.holistic_options)
+            self.backend.reset()
+
+            # Decoding and detection run on their own threads, modal() puts the results in the scene as they come in
+            self.live = source_input == 'webcam_input'
+            if self.live:
+                # Live preview, the newest result is shown every tick and nothing is keyframed
+                try:
+                    self.stream = mocap_stream.MocapStream(source, self.backend, downscale=context.scene.cyanic_mocap_downscale, latest_only=True).start()
+                except IOError:
+                    self.report({'ERROR_INVALID_INPUT'}, "Could not open the webcam")
+                    return {'CANCELLED'}
+                self.live_targets = {}
+                self.live_rig = self.get_live_rig(context)
+                self.last_applied = None
+                live_stats.update(running=True, stop=False, fps=0.0, latency=0.0)
+                wm = context.window_manager
+                self.timer = wm.event_timer_add(1 / 60, window=context.window)
+                wm.modal_handler_add(self)
+                return {'RUNNING_MODAL'}
+
+            try:
+                self.stream = mocap_stream.MocapStream(
+                    source,
+                    self.backend,
+                    start_frame=context.scene.cyanic_mocap_frame_start,
+                    end_frame=context.scene.cyanic_mocap_frame_end if context.scene.cyanic_mocap_frame_end > 0 else None,
+                    stride=context.scene.cyanic_mocap_frame_stride,
+                    downscale=context.scene.cyanic_mocap_downscale
+                ).start()
+                self.scene_seconds = 0
+            except IOError:
+                self.report({'ERROR_INVALID_INPUT'}, "Could not read video file")
+                return {'CANCELLED'}
+
+            # Save the landmarks as they come in, so the take can be replayed later without running mediapipe again.
+            # Only files get here, the webcam is always live
+            recording_name = os.path.splitext(os.path.basename(file_path))[0]
+            recording_path = os.path.join(get_save_dir(file_path), recording_name + mocap_recording.recording_extension)
+            try:
+                self.recording = mocap_recording.RecordingWriter(recording_path, self.stream.fps, source=file_path, backend=self.backend.kind, holistic_options=self.holistic_options)
+            except OSError as e:
+                self.recording = None
+                self.report({'WARNING'}, 'Not saving a recording: %s' % e)
+
+            wm = context.window_manager
+            self.timer = wm.event_timer_add(0.02, window=context.window)
+            wm.progress_begin(0, 100)
+            wm.modal_handler_add(self)
+            return {'RUNNING_MODAL'}
 
 
         return {'FINISHED'}
 
-    def get_vector(self, landmark, image_width, image_height, scaler, offset=None):
-        if offset:
-            blender_x = offset.x + (landmark.x * image_width / scaler)
-            blender_z = offset.z + (-1 * landmark.y * image_height / scaler)
-            blender_y = offset.y + (landmark.z * image_width / scaler) # "The magnitude of z uses roughly the same scale as x."
-            return mathutils.Vector((blender_x, blender_y, blender_z))
+    def modal(self, context, event):
+        if event.type == 'ESC' or (self.live and live_stats['stop']):
+            self.stream.cancel()
+            self.end_stream(context)
+            if self.live:
+                self.report({'INFO'}, 'Live mocap stopped. %s' % self.stage_timings())
+                return {'FINISHED'}
+            self.report({'INFO'}, 'Mocap cancelled after %s frames. %s' % (self.stream.frames_taken, self.stage_timings()))
+            return {'CANCELLED'}
+
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+
+        if self.live:
+            return self.live_tick(context)
+
+        # Write frames until this tick's time is used up, anything left waits for the next tick.
+        # Until then the inference thread blocks on the full results queue, instead of getting further ahead
+        start = time.perf_counter()
+        first_frame = context.scene.frame_start - self.stream.start_frame # Put the start of the range on the scene's first frame
+        while time.perf_counter() - start < self.write_budget:
+            stream_frames = self.stream.take()
+            if len(stream_frames) == 0:
+                break
+            for stream_frame in stream_frames:
+                image_width, image_height = stream_frame.image_size
+                if self.recording is not None:
+                    self.recording.append(stream_frame.index, stream_frame.landmarks, stream_frame.image_size)
+                timestamp = stream_frame.index / (self.stream.fps or context.scene.render.fps)
+                landmarks = self.filter_landmarks(stream_frame.landmarks, timestamp)
+                self.landmark_frame_to_pose(landmarks, image_width, image_height, first_frame + stream_frame.index)
+        self.scene_seconds += time.perf_counter() - start
+
+        progress = self.stream.progress()
+        if progress is not None:
+            context.window_manager.progress_update(progress * 100)
+            context.workspace.status_text_set('Mocap: %s of %s frames, Esc to cancel' % (self.stream.frames_taken, self.stream.total_frames))
         else:
-            blender_x = landmark.x * image_width / scaler
-            blender_z = landmark.y * -1 * image_height / scaler
-            blender_y = landmark.z * image_width / scaler # "The magnitude of z uses roughly the same scale as x."
-            return mathutils.Vector((blender_x, blender_y, blender_z))
-
-    def add_obj_to_collection(self, object, collection):
-            # new_point = bpy.context.active_object
-            for coll in object.users_collection: # Remove from other collections
-                coll.objects.unlink(object)
-            collection.objects.link(object)
-
-    def landmark_frame_to_pose(self, mp_results, image_width, image_height, frame=-1):
-        # frame -1 means append it after the last frame.
-        # To prototype, just create empties at the landmark locations
-
-        # mp_results.pose_world_landmarks.landmark
-        # mp_results.right_hand_landmarks.landmark
-        # mp_results.left_hand_landmarks.landmark
-        # mp_results.face_landmarks.landmark
-        print('Ready to landmark')
-        scaler = 200 # How to set scale this?
-
-        right_wrist_origin = mathutils.Vector((0,0,0))
-        left_wrist_origin = mathutils.Vector((0,0,0))
-        head_origin = mathutils.Vector((0,0,0))
-
-        scale = (0.01,0.01,0.01)
-
-        pose_collection = bpy.context.blend_data.collections.new(name='Pose')
-        bpy.context.collection.children.link(pose_collection)
-        for index, landmark in enumerate(mp_results.pose_world_landmarks.landmark):
-            # 0,0,0 = between the hips
-            v = self.get_vector(landmark, image_width, image_height, scaler)
-
-            if index == 0:
-                head_origin = v
-            if index == 15:
-                left_wrist_origin = v
-            if index == 16:
-                right_wrist_origin = v
-
-            face_indexes = [1,2,3,4,5,6,7,8,9,10]
-            left_hand_indexes = [17,19,21]
-            right_hand_indexes = [18,20,22]
-            if index in face_indexes or index in left_hand_indexes or index in right_hand_indexes:
-                # Skip drawing
-                # continue
-                pass 
-
-            # bpy.ops.object.empty_add(type='PLAIN_AXES', align='WORLD', location=v, scale=scale)
-            bpy.ops.object.empty_add(type='PLAIN_AXES', align='WORLD', location=v)
-            bpy.context.active_object.name = 'Pose.%s' % index
-            self.add_obj_to_collection(bpy.context.active_object, pose_collection)
-
-
-        right_hand_collection = bpy.context.blend_data.collections.new(name='Hand.R')
-        bpy.context.collection.children.link(right_hand_collection)
-        v = self.get_vector(mp_results.right_hand_landmarks.landmark[0], image_width, image_height, scaler)
-        if v != mathutils.Vector((0.0, 0.0, 0.0)):
-            # Correct the offset
-            right_wrist_origin = right_wrist_origin - (v - mathutils.Vector((0.0, 0.0, 0.0)))
-        for landmark in mp_results.right_hand_landmarks.landmark:
-            v = self.get_vector(landmark, image_width, image_height, scaler, right_wrist_origin)
-            bpy.ops.object.empty_add(type='PLAIN_AXES', align='WORLD', location=v, scale=scale)
-            bpy.context.active_object.name = 'Hand.R.%s' % index
-            self.add_obj_to_collection(bpy.context.active_object, right_hand_collection)
-
-
-        left_hand_collection = bpy.context.blend_data.collections.new(name='Hand.L')
-        bpy.context.collection.children.link(left_hand_collection)
-        v = self.get_vector(mp_results.left_hand_landmarks.landmark[0], image_width, image_height, scaler)
-        if v != mathutils.Vector((0.0, 0.0, 0.0)):
-            # Correct the offset
-            left_wrist_origin = left_wrist_origin - (v - mathutils.Vector((0.0, 0.0, 0.0)))
-        for landmark in mp_results.left_hand_landmarks.landmark:
-            v = self.get_vector(landmark, image_width, image_height, scaler, left_wrist_origin)
-            bpy.ops.object.empty_add(type='PLAIN_AXES', align='WORLD', location=v, scale=scale)
-            bpy.context.active_object.name = 'Hand.L.%s' % index
-            self.add_obj_to_collection(bpy.context.active_object, left_hand_collection)
-
-
-        face_collection = bpy.context.blend_data.collections.new(name='Face')
-        bpy.context.collection.children.link(face_collection)
-        v = self.get_vector(mp_results.face_landmarks.landmark[1], image_width, image_height, scaler) # Point 1 is the tip of the nose
-        if v != mathutils.Vector((0.0, 0.0, 0.0)):
-            # Correct the offset
-            head_origin = head_origin - (v - mathutils.Vector((0.0, 0.0, 0.0)))
-        for landmark in mp_results.face_landmarks.landmark:
-            v = self.get_vector(landmark, image_width, image_height, scaler, head_origin)
-            bpy.ops.object.empty_add(type='PLAIN_AXES', align='WORLD', location=v, scale=scale)
-            bpy.context.active_object.name = 'Face.%s' % index
-            self.add_obj_to_collection(bpy.context.active_object, face_collection)
-        
\ No newline at end of file
+            context.workspace.status_text_set('Mocap: %s frames, Esc to stop' % self.stream.frames_taken)
+
+        if self.stream.done:
+            self.end_stream(context)
+            if self.stream.error is not None:
+                self.report({'ERROR'}, self.stream.error)
+                return {'CANCELLED'}
+            self.report({'INFO'}, 'Mocap finished, %s frames. %s' % (self.stream.frames_taken, self.stage_timings()))
+            return {'FINISHED'}
+        return {'PASS_THROUGH'}
+
+    def live_tick(self, context):
+        # Frames the model didn't get to in time were already dropped by the stream, only the newest one is shown
+        stream_frame = self.stream.take_latest()
+        if stream_frame is not None:
+            image_width, image_height = stream_frame.image_size
+            landmarks = self.filter_landmarks(stream_frame.landmarks, stream_frame.captured_at)
+            if self.live_rig is not None and 'pose' in landmarks:
+                # The pose goes on the rig's bones, the hands and face (which the retarget mapping doesn't cover)
+                # still go on the empties
+                self.pose_live_rig(landmarks['pose'])
+                landmarks = {part: part_landmarks for part, part_landmarks in landmarks.items() if part != 'pose'}
+            for part, locations in mocap_landmarks.frame_to_locations(landmarks, image_width, image_height).items():
+                if part not in self.live_targets:
+                    self.live_targets[part] = get_targets(context, part, len(locations))
+                for obj, location in zip(self.live_targets[part], locations.tolist()):
+                    obj.location = location
+
+            # Smoothed, so the numbers are readable
+            now = time.perf_counter()
+            live_stats['latency'] = 0.9 * live_stats['latency'] + 0.1 * (now - stream_frame.captured_at)
+            if self.last_applied is not None:
+                live_stats['fps'] = 0.9 * live_stats['fps'] + 0.1 / max(now - self.last_applied, 1e-6)
+            self.last_applied = now
+            live_stats['dropped'] = self.stream.frames_dropped
+            for area in context.window.screen.areas:
+                if area.type == 'VIEW_3D':
+                    area.tag_redraw()
+            context.workspace.status_text_set('Live mocap: %.0f fps, %.0fms latency, Esc to stop' % (live_stats['fps'], live_stats['latency'] * 1000))
+
+        if self.stream.done:
+            self.end_stream(context)
+            if self.stream.error is not None:
+                self.report({'ERROR'}, self.stream.error)
+                return {'CANCELLED'}
+            return {'FINISHED'}
+        return {'PASS_THROUGH'}
+
+    def get_live_rig(self, context):
+        # The generated rig and what solve_rotations needs to know about it, found once per live run.
+        # None without a rig (or one with none of the mapped bones), the pose then goes on the empties
+        if self.armature is None:
+            return None
+        rig_obj = findObjectByNameAndType(self.armature.name, 'ARMATURE')
+        if rig_obj is None:
+            return None
+        rest_pose = rig_rest_pose(rig_obj, mocap_retarget.get_mapping())
+        if len(rest_pose[0]) == 0:
+            return None
+        for bone_name in rest_pose[1]:
+            rig_obj.pose.bones[bone_name].rotation_mode = 'QUATERNION'
+        return rig_obj, rest_pose
+
+    def pose_live_rig(self, pose_landmarks):
+        # Same solve as MocapRetargetOperator, for just the newest frame and without keyframing
+        rig_obj, (mapped, bone_names, rest_directions, rest_rotations, parents) = self.live_rig
+        retarget_mapping = mocap_retarget.get_mapping()
+        locations = mocap_retarget.to_blender_space(pose_landmarks[None, :, :3])
+        directions = mocap_retarget.bone_directions(locations, retarget_mapping)[:, mapped]
+        visible = mocap_retarget.bone_visibility(pose_landmarks[None, :, 3], retarget_mapping)[0, mapped] >= MocapRetargetOperator.min_visibility
+        rotations = mocap_retarget.solve_rotations(directions, rest_directions, rest_rotations, parents)[0]
+        for bone_index, bone_name in enumerate(bone_names):
+            if visible[bone_index]:
+                rig_obj.pose.bones[bone_name].rotation_quaternion = rotations[bone_index].tolist()
+
+    def stage_timings(self):
+        # Average time per frame for each stage. Decode and inference overlap, so the slowest stage sets the pace
+        frame_count = max(self.stream.frames_taken, 1)
+        stage_seconds = dict(self.stream.stage_seconds, keyframes=self.scene_seconds)
+        timings = ', '.join(['%s %.1fms' % (stage, seconds * 1000 / frame_count) for stage, seconds in stage_seconds.items()])
+        print('Mocap per frame: %s' % timings)
+        return 'Per frame: %s' % timings
+
+    def cancel(self, context):
+        # Blender is stopping the operator (closing the window, loading a file)
+        if self.stream is not None:
+            self.stream.cancel()
+            self.end_stream(context)
+
+    def end_stream(self, context):
+        live_stats['running'] = False
+        # The whole take is written in one go, so every F-curve is only touched once however long the video is.
+        # Keep whatever was done, even when cancelled
+        self.flush_keyframes(context)
+        if self.recording is not None:
+            self.recording.close()
+            context.scene.cyanic_mocap_recording_path = self.recording.path
+            self.recording = None
+        wm = context.window_manager
+        if self.timer is not None:
+            wm.event_timer_remove(self.timer)
+            self.timer = None
+        if not self.live:
+            wm.progress_end()
+        context.workspace.status_text_set(None)
+
+
+class MocapReplayOperator(MocapKeyframer, bpy.types.Operator):
+    """Keyframe a saved mocap recording without running the landmark detection again"""
+    bl_idname = "object.mocap_replay"
+    bl_label = "Replay mocap recording"
+    bl_options = {'REGISTER', 'UNDO'} # Enable undo for operations
+
+    def execute(self, context):
+        import_dependencies()
+        self.pending = {}
+        self.setup_filters(context)
+        recording_path = bpy.path.abspath(context.scene.cyanic_mocap_recording_path).rstrip('/\\')
+        if not mocap_recording.is_recording(recording_path):
+            self.report({'ERROR_INVALID_INPUT'}, 'No mocap recording at %s' % recording_path)
+            return {'CANCELLED'}
+
+        recording = mocap_recording.load_recording(recording_path)
+        image_width, image_height = recording.meta['image_size'] or (1, 1)
+        first_frame = context.scene.cyanic_mocap_frame_start
+        frame_index, parts = read_scene_range(context.scene, recording)
+
+        # Offline, so each part is filtered as one (frames, landmarks, 3) array. Frames where the part wasn't found
+        # are left out, the timestamps keep the spacing between the rest right
+        fps = recording.meta['fps'] or context.scene.render.fps
+        if self.filter_kind is not None:
+            for part, (present, landmarks) in parts.items():
+                if len(landmarks) > 0:
+                    landmarks[..., :3] = landmark_filters.filter_frames(self.filter_kind, landmarks[..., :3], frame_index[present] / fps, **self.filter_settings)
+
+        # Row of each part's landmarks for every frame it was found in
+        part_rows = {part: np.cumsum(present) - 1 for part, (present, _) in parts.items()}
+        for row in range(len(frame_index)):
+            landmark_frame = {part: landmarks[part_rows[part][row]] for part, (present, landmarks) in parts.items() if present[row]}
+            self.landmark_frame_to_pose(landmark_frame, image_width, image_height, context.scene.frame_start + frame_index[row] - first_frame)
+        self.flush_keyframes(context)
+
+        self.report({'INFO'}, 'Replayed %s frames' % len(frame_index))
+        return {'FINISHED'}
+
+
+class MocapRetargetOperator(bpy.types.Operator):
+    """Turn the pose landmarks of a saved mocap recording into bone rotations on the generated Rigify rig"""
+    bl_idname = "object.mocap_retarget"
+    bl_label = "Retarget mocap recording"
+    bl_options = {'REGISTER', 'UNDO'} # Enable undo for operations
+
+    min_visibility = 0.5 # Bones aimed at landmarks mediapipe is guessing at (off screen, hidden) aren't keyed
+
+    def execute(self, context):
+        import_dependencies()
+        scene = context.scene
+        if scene.cyanic_rigify_gen_rig is None:
+            self.report({'ERROR_INVALID_INPUT'}, 'No Rigify rig selected')
+            return {'CANCELLED'}
+        recording_path = bpy.path.abspath(scene.cyanic_mocap_recording_path).rstrip('/\\')
+        if not mocap_recording.is_recording(recording_path):
+            self.report({'ERROR_INVALID_INPUT'}, 'No mocap recording at %s' % recording_path)
+            return {'CANCELLED'}
+
+        rig_obj = findObjectByNameAndType(scene.cyanic_rigify_gen_rig.name, 'ARMATURE')
+        retarget_mapping = mocap_retarget.get_mapping()
+        mapped, bone_names, rest_directions, rest_rotations, parents = rig_rest_pose(rig_obj, retarget_mapping)
+        if len(mapped) == 0:
+            self.report({'ERROR_INVALID_INPUT'}, "%s doesn't have any of the mapped bones" % rig_obj.name)
+            return {'CANCELLED'}
+
+        recording = mocap_recording.load_recording(recording_path)
+        frame_index, parts = read_scene_range(scene, recording)
+        present, landmarks = parts['pose']
+        if len(landmarks) == 0:
+            self.report({'WARNING'}, 'No pose found in the recording')
+            return {'CANCELLED'}
+
+        # (frames, 33, 3) for every frame with a pose, the whole range is solved in one go
+        fps = recording.meta['fps'] or scene.render.fps
+        filter_kind, filter_settings = get_filter_settings(scene)
+        locations = landmarks[..., :3]
+        if filter_kind is not None:
+            locations = landmark_filters.filter_frames(filter_kind, locations, frame_index[present] / fps, **filter_settings)
+        locations = mocap_retarget.to_blender_space(locations)
+
+        directions = mocap_retarget.bone_directions(locations, retarget_mapping)[:, mapped]
+        visible = mocap_retarget.bone_visibility(landmarks[..., 3], retarget_mapping)[:, mapped] >= self.min_visibility
+        rotations = mocap_retarget.solve_rotations(directions, rest_directions, rest_rotations, parents)
+
+        frames = (scene.frame_start + frame_index[present] - scene.cyanic_mocap_frame_start).astype(np.float32)
+        for bone_index, bone_name in enumerate(bone_names):
+            rig_obj.pose.bones[bone_name].rotation_mode = 'QUATERNION'
+            data_path = 'pose.bones["%s"].rotation_quaternion' % bpy.utils.escape_identifier(bone_name)
+            bone_visible = visible[:, bone_index]
+            for axis, fcurve in enumerate(get_fcurves(rig_obj, data_path, 4, group=bone_name)):
+                write_fcurve(fcurve, frames[bone_visible], rotations[bone_visible, bone_index, axis])
+
+        self.report({'INFO'}, 'Retargeted %s frames onto %s bones' % (len(frames), len(bone_names)))
+        return {'FINISHED'}
+
+
+def rig_rest_pose(rig_obj, retarget_mapping):
+    # What solve_rotations needs to know about the rig, for the mapped bones it has:
+    # (indexes into the mapping, bone names to key, rest directions, rest rotations, parent indexes)
+    bones = rig_obj.data.bones
+    mapped = []
+    bone_names = []
+    rest_directions = []
+    rest_rotations = []
+    for index, rig_bones in enumerate(retarget_mapping.rig_bones):
+        bone_name = next((name for name in rig_bones if name in bones), None)
+        if bone_name is None:
+            continue
+        # A generated rig keeps the metarig's bones as ORG-, those still have the original head and tail
+        first, last = [bones.get('ORG-' + name) or bones.get(name) for name in retarget_mapping.rest_bones[index]]
+        if first is None or last is None:
+            first = last = bones[bone_name]
+        mapped.append(index)
+        bone_names.append(bone_name)
+        rest_directions.append(tuple((last.tail_local - first.head_local).normalized()))
+        rest_rotations.append(tuple(bones[bone_name].matrix_local.to_quaternion()))
+
+    # Nearest keyed ancestor, the bones in between stay at rest
+    parents = []
+    for bone_name in bone_names:
+        parent = bones[bone_name].parent
+        while parent is not None and parent.name not in bone_names:
+            parent = parent.parent
+        parents.append(-1 if parent is None else bone_names.index(parent.name))
+    return np.array(mapped, dtype=np.int32), bone_names, np.array(rest_directions), np.array(rest_rotations), np.array(parents, dtype=np.int32)
+
+
+def read_scene_range(scene, recording):
+    # The rows of the recording in the panel's frame range, see mocap_recording.read_range.
+    # The range is in source video frames. Only those rows of the recording get read off the disk
+    first_frame = scene.cyanic_mocap_frame_start
+    last_frame = scene.cyanic_mocap_frame_end
+    start = int(np.searchsorted(recording.frame_index, first_frame, side='left'))
+    end = int(np.searchsorted(recording.frame_index, last_frame, side='right')) if last_frame > 0 else None
+    return mocap_recording.read_range(recording, start, end)
+
+
+def get_filter_settings(scene):
+    # (landmark_filters kind, settings) from the mocap panel, kind is None with no filter
+    kind = scene.cyanic_mocap_filter
+    if kind == 'one_euro':
+        return kind, dict(min_cutoff=scene.cyanic_mocap_filter_cutoff, beta=scene.cyanic_mocap_filter_beta)
+    if kind == 'kalman':
+        return kind, dict(measurement_noise=scene.cyanic_mocap_filter_noise ** 2)
+    if kind == 'savgol':
+        return kind, dict(window=scene.cyanic_mocap_filter_window)
+    return None, {}
+
+
+# The empties the landmarks are keyframed on, named like '<collection name>.<landmark index>'
+part_collections = {'pose': 'Pose', 'right_hand': 'Hand.R', 'left_hand': 'Hand.L', 'face': 'Face'}
+
+def get_targets(context, part, count):
+    # One empty per landmark, made the first time and reused by every run after that
+    collection_name = part_collections[part]
+    collection = bpy.data.collections.get(collection_name)
+    if collection is None:
+        collection = bpy.data.collections.new(name=collection_name)
+        context.scene.collection.children.link(collection)
+
+    targets = []
+    for index in range(count):
+        name = '%s.%s' % (collection_name, index)
+        obj = bpy.data.objects.get(name)
+        if obj is None:
+            obj = bpy.data.objects.new(name, None)
+            obj.empty_display_type = 'PLAIN_AXES'
+            if part != 'pose':
+                obj.empty_display_size = 0.01
+            collection.objects.link(obj)
+        targets.append(obj)
+    return targets
+
+def get_fcurves(obj, data_path, count, group=None):
+    # The F-curves for data_path[0] to data_path[count - 1] in the object's action, made if they're missing
+    if obj.animation_data is None:
+        obj.animation_data_create()
+    if obj.animation_data.action is None:
+        obj.animation_data.action = bpy.data.actions.new(name=obj.name)
+    action = obj.animation_data.action
+    group = obj.name if group is None else group
+    if bpy.app.version >= (4, 4, 0):
+        # Layered actions keep the F-curves in a slot per datablock
+        return [action.fcurve_ensure_for_datablock(obj, data_path, index=index, group_name=group) for index in range(count)]
+    fcurves = []
+    for index in range(count):
+        fcurve = action.fcurves.find(data_path, index=index)
+        if fcurve is None:
+            fcurve = action.fcurves.new(data_path, index=index, action_group=group)
+        fcurves.append(fcurve)
+    return fcurves
+
+def write_fcurve(fcurve, frames, values):
+    # frames, values: (frame count,), frames in order. Written with one keyframe_points.add and one foreach_set,
+    # instead of a keyframe_insert per key. Keys already on these frames are replaced
+    keyframe_points = fcurve.keyframe_points
+    if len(frames) == 0:
+        return
+    new = np.empty((len(frames), 2), dtype=np.float32)
+    new[:, 0] = frames
+    new[:, 1] = values
+
+    existing_count = len(keyframe_points)
+    if existing_count == 0 or keyframe_points[-1].co[0] < frames[0]:
+        # Nothing to merge with (a new curve, or a take that carries on after the last key), the keys are added on
+        # the end and the ones already there are left as they are
+        keyframe_points.add(len(frames))
+        co = np.empty((existing_count + len(frames)) * 2, dtype=np.float32)
+        keyframe_points.foreach_get('co', co)
+        co[existing_count * 2:] = new.ravel()
+        keyframe_points.foreach_set('co', co)
+        fcurve.update() # Recalculates the handles
+        return
+
+    # Overlaps keys already on the curve, merge and rewrite it
+    existing = np.empty(existing_count * 2, dtype=np.float32)
+    keyframe_points.foreach_get('co', existing)
+    existing = existing.reshape(-1, 2)
+    existing = existing[~np.isin(existing[:, 0], frames)]
+
+    co = np.concatenate([existing, new])
+    co = co[np.argsort(co[:, 0], kind='stable')]
+    keyframe_points.clear()
+    keyframe_points.add(len(co))
+    keyframe_points.foreach_set('co', co.ravel())
+    fcurve.update() # Recalculates the handles
+
+def write_keyframes(targets, frames, locations):
+    # frames: (frame count,) scene frames, locations: (frame count, len(targets), 3)
+    for target_index, obj in enumerate(targets):
+        for axis, fcurve in enumerate(get_fcurves(obj, 'location', 3)):
+            write_fcurve(fcurve, frames, locations[:, target_index, axis])
@@ -1,35 +1,95 @@
 import bpy
 import os
-import json
-
-# data_dir = 'data'
-script_dir = os.path.dirname(__file__)
-data_dir = os.path.join(os.path.split(script_dir)[0], 'data')
-facemesh_mapping_file = os.path.join(data_dir, 'facemesh_rigify_mapping.json')
-facemesh_config_data = {}
-
-def load_config():
-    global facemesh_config_data
-    # with open(os.path.join(root_url, facemesh_mapping_file), 'r') as input_file:
-    with open(facemesh_mapping_file, 'r') as input_file:
-        string_format = input_file.read()
-        facemesh_config_data = json.loads(string_format)
-
-def findObjectByNameAndType(name, obj_type):
-    objects = [obj for obj in bpy.context.scene.objects if obj.type == obj_type and obj.data.name == name]
-    if len(objects) == 1:
-        return objects[0]
-    print('Found %s objects for %s, %s' % (len(objects), name, obj_type))
-    print(objects)
-    return objects[-1]
-
-def selectObject(name, obj_type):
+
+import importlib
+from collections import namedtuple
+
+from . import scene_index
+from .scene_index import findObjectByNameAndType, selectObject
+
+Dependency = namedtuple("Dependency", ["module", "package", "name"])
+dependencies = (
+    Dependency(module="numpy", package=None, name='np'),
+)
+dependencies_imported = False
+
+def import_module(module_name, global_name, reload=True):
+    """
+    Import a module.
+    :param module_name: Module to import.
+    :param global_name: (Optional) Name under which the module is imported. If None the module_name will be used.
+        This allows to import under a different name with the same effect as e.g. "import numpy as np" where "np" is
+        the global_name under which the module can be accessed.
+    :raises: ImportError and ModuleNotFoundError
+    """
+    if global_name is None:
+        global_name = module_name
+    
+    if global_name in globals():
+        importlib.reload(globals()[global_name])
+    else:
+        # Attempt to import the module and assign it to globals dictionary. This allow to access the module under
+        # the given name, just like the regular import would.
+        globals()[global_name] = importlib.import_module(module_name)
+
+def import_dependencies():
+    global dependencies_imported
+    if not dependencies_imported:
+        for dependency in dependencies:
+            import_module(dependency.module, dependency.name)
+        dependencies_imported = True
+
+def mapped_bone_positions(armature_objs, facemesh_objs):
+    # Head and tail of every mapped bone for each armature/facemesh pair, in the armature's space.
+    # Returns (heads, tails), float (pairs, bones, 3) arrays in facemesh_mapping bone_names order.
+    # Rows where the mapping has no vert (jaw's head) are filled with whatever vert 0 lands on, check mapping.heads >= 0
+    mapping = scene_index.get_mapping()
+    used_verts, inverse = np.unique(np.concatenate([mapping.heads, mapping.tails]).clip(0), return_inverse=True)
+
+    # Snapshot only the verts the mapping uses from each facemesh
+    co = np.empty((len(facemesh_objs), len(used_verts), 3), dtype=np.float64)
+    for index, facemesh_obj in enumerate(facemesh_objs):
+        facemesh_co = np.empty(len(facemesh_obj.data.vertices) * 3, dtype=np.float32)
+        facemesh_obj.data.vertices.foreach_get('co', facemesh_co)
+        co[index] = facemesh_co.reshape(-1, 3)[used_verts]
+
+    # facemesh local -> world -> armature local, for all pairs at once
+    to_armature = np.array([np.array(armature_obj.matrix_world.inverted() @ facemesh_obj.matrix_world) for armature_obj, facemesh_obj in zip(armature_objs, facemesh_objs)]).reshape(-1, 4, 4)
+    armature_co = np.einsum('pij,pvj->pvi', to_armature[:, :3, :3], co) + to_armature[:, None, :3, 3]
+
+    bone_count = len(mapping.bone_names)
+    return armature_co[:, inverse[:bone_count]], armature_co[:, inverse[bone_count:]]
+
+def align_bones(armature_objs, facemesh_objs):
+    # The armatures need to be in Edit mode already
+    mapping = scene_index.get_mapping()
+    heads, tails = mapped_bone_positions(armature_objs, facemesh_objs)
+    has_head = (mapping.heads >= 0).tolist()
+    has_tail = (mapping.tails >= 0).tolist()
+    for armature_obj, armature_heads, armature_tails in zip(armature_objs, heads, tails):
+        edit_bones = armature_obj.data.edit_bones
+        bone_ids = scene_index.bone_indexes(armature_obj.data).tolist()
+        for bone_index, bone_id in enumerate(bone_ids):
+            if bone_id < 0:
+                continue # Not in this metarig
+            if has_head[bone_index]:
+                edit_bones[bone_id].head = armature_heads[bone_index]
+            if has_tail[bone_index]:
+                edit_bones[bone_id].tail = armature_tails[bone_index]
+
+def align_metarigs_to_facemeshes(armature_objs, facemesh_objs):
+    # For crowds: line up each metarig with the facemesh at the same position in the list, using a single trip into
+    # Edit mode for all of them
+    import_dependencies()
     bpy.ops.object.mode_set(mode='OBJECT')
     bpy.ops.object.select_all(action='DESELECT')
-    obj = findObjectByNameAndType(name, obj_type)
-    bpy.context.view_layer.objects.active = obj # Active object is what transform_apply is interacting with
-    bpy.data.objects[obj.name].select_set(True)
-    return obj
+    for armature_obj in armature_objs:
+        armature_obj.select_set(True)
+    bpy.context.view_layer.objects.active = armature_objs[0]
+    bpy.ops.object.mode_set(mode='EDIT')
+    align_bones(armature_objs, facemesh_objs)
+    bpy.ops.object.mode_set(mode='OBJECT')
+
 
 class AddRigOperator(bpy.types.Operator):
     """Add a Rigify Meta-Rig to the scene"""
@@ -53,8 +113,7 @@ class RigFacemeshOperator(bpy.types.Operator):
     bl_options = {'REGISTER', 'UNDO'} # Enable undo for operations
 
     def execute(self, context):
-        if len(facemesh_config_data.keys()) == 0:
-            load_config()
+        import_dependencies()
         
         facemesh = context.scene.cyanic_facemesh
         armature = context.scene.cyanic_rigify_rig
@@ -73,25 +132,7 @@ class RigFacemeshOperator(bpy.types.Operator):
         bpy.ops.object.mode_set(mode='EDIT')
 
         facemesh_obj = findObjectByNameAndType(facemesh.name, 'MESH')
-        facemesh_world_matrix = facemesh_obj.matrix_world
-        for bone_name in facemesh_config_data['bone_positions'].keys():
-            if bone_name.lower() == 'desc':
-                continue
-            bone_id = armature.bones.find(bone_name)
-            # print('%s = %s' % (bone_name, bone_id))
-            head = facemesh_config_data['bone_positions'][bone_name]['head']
-            if head is not None:
-                facemesh_co = facemesh.vertices[head].co
-                world_co = facemesh_world_matrix @ facemesh_co
-                # bpy.data.objects[armature.name].data.edit_bones[bone_id].head = facemesh_co
-                armature_obj.data.edit_bones[bone_id].head = armature_world_matrix_inverted @ world_co
-            
-            tail = facemesh_config_data['bone_positions'][bone_name]['tail']
-            if tail is not None:
-                facemesh_co = facemesh.vertices[tail].co
-                world_co = facemesh_world_matrix @ facemesh_co
-                # bpy.data.objects[armature.name].data.edit_bones[bone_id].tail = facemesh_co
-                armature_obj.data.edit_bones[bone_id].tail = armature_world_matrix_inverted @ world_co
+        align_bones([armature_obj], [facemesh_obj])
 
         eye_bone_names = []
         eye_objs = []
@@ -0,0 +1,165 @@
+import bpy
+import os
+import sys
+
+import importlib
+from collections import namedtuple
+
+# Lookups the rig and cleanup operators would otherwise redo on every run, kept until the data they came from changes
+script_dir = os.path.dirname(__file__)
+pipeline_dir = os.path.join(os.path.split(script_dir)[0], 'scripts')
+if pipeline_dir not in sys.path:
+    sys.path.append(pipeline_dir)
+
+Dependency = namedtuple("Dependency", ["module", "package", "name"])
+dependencies = (
+    Dependency(module="numpy", package=None, name='np'),
+    Dependency(module="facemesh_mapping", package=None, name=None),
+)
+dependencies_imported = False
+
+def import_module(module_name, global_name, reload=True):
+    """
+    Import a module.
+    :param module_name: Module to import.
+    :param global_name: (Optional) Name under which the module is imported. If None the module_name will be used.
+        This allows to import under a different name with the same effect as e.g. "import numpy as np" where "np" is
+        the global_name under which the module can be accessed.
+    :raises: ImportError and ModuleNotFoundError
+    """
+    if global_name is None:
+        global_name = module_name
+
+    if global_name in globals():
+        importlib.reload(globals()[global_name])
+    else:
+        # Attempt to import the module and assign it to globals dictionary. This allow to access the module under
+        # the given name, just like the regular import would.
+        globals()[global_name] = importlib.import_module(module_name)
+
+def import_dependencies():
+    global dependencies_imported
+    if not dependencies_imported:
+        for dependency in dependencies:
+            import_module(dependency.module, dependency.name)
+        dependencies_imported = True
+
+
+bone_indexes_cache = {} # armature session_uid: int32 bone index for each of facemesh_mapping's bone_names
+object_index = {} # (object type, data name): names of the scene's objects using that data
+object_index_scene = None # session_uid of the scene object_index was built from
+poll_results = {} # mesh/armature session_uid: {check name: result}, for the PointerProperty polls
+
+
+def get_mapping():
+    import_dependencies()
+    return facemesh_mapping.get_mapping()
+
+def bone_indexes(armature):
+    # Index into armature.bones (and edit_bones) for every mapped bone, -1 if the armature doesn't have it
+    indexes = bone_indexes_cache.get(armature.session_uid)
+    if indexes is None:
+        mapping = get_mapping()
+        indexes = np.array([armature.bones.find(bone_name) for bone_name in mapping.bone_names], dtype=np.int32)
+        bone_indexes_cache[armature.session_uid] = indexes
+    return indexes
+
+
+def memoized_poll(check_name, id_data, check):
+    # The scene property pickers call their poll for every mesh/armature each time the dropdown redraws.
+    # Results are kept until the depsgraph reports a change to that datablock
+    results = poll_results.setdefault(id_data.session_uid, {})
+    if check_name not in results:
+        results[check_name] = check(id_data)
+    return results[check_name]
+
+
+def build_object_index(scene):
+    global object_index_scene
+    object_index.clear()
+    for obj in scene.objects:
+        if obj.data is not None:
+            object_index.setdefault((obj.type, obj.data.name), []).append(obj.name)
+    object_index_scene = scene.session_uid
+
+def indexed_objects(name, obj_type):
+    # The objects the index has for this data, or None if any of them are out of date
+    # (deleted, renamed, new data, or unlinked from the scene but still in bpy.data)
+    scene_objects = bpy.context.scene.objects
+    objects = []
+    for obj_name in object_index.get((obj_type, name), []):
+        obj = bpy.data.objects.get(obj_name)
+        if obj is None or obj.name not in scene_objects or obj.type != obj_type or obj.data is None or obj.data.name != name:
+            return None
+        objects.append(obj)
+    return objects if len(objects) > 0 else None
+
+def findObjectByNameAndType(name, obj_type):
+    # Find the object using the mesh/armature data called name, without scanning every object in the scene
+    scene = bpy.context.scene
+    objects = None
+    if object_index_scene == scene.session_uid:
+        objects = indexed_objects(name, obj_type)
+    if objects is None:
+        # Missing or stale, the scene changed in a way the depsgraph handler didn't catch
+        build_object_index(scene)
+        objects = indexed_objects(name, obj_type) or []
+    if len(objects) == 1:
+        return objects[0]
+    print('Found %s objects for %s, %s' % (len(objects), name, obj_type))
+    print(objects)
+    return objects[-1]
+
+def selectObject(name, obj_type):
+    bpy.ops.object.mode_set(mode='OBJECT')
+    bpy.ops.object.select_all(action='DESELECT')
+    obj = findObjectByNameAndType(name, obj_type)
+    bpy.context.view_layer.objects.active = obj # Active object is what transform_apply is interacting with
+    obj.select_set(True)
+    return obj
+
+
+@bpy.app.handlers.persistent
+def clear_changed(scene, depsgraph):
+    for update in depsgraph.updates:
+        updated = update.id.original
+        # Renaming, adding or removing bones shows up as an update to the armature data
+        if isinstance(updated, bpy.types.Armature):
+            bone_indexes_cache.pop(updated.session_uid, None)
+        if isinstance(updated, (bpy.types.Mesh, bpy.types.Armature)):
+            poll_results.pop(updated.session_uid, None)
+
+        # New objects, objects given other data, and renamed data all need the object index rebuilt.
+        # Plain transform and edit updates on objects it already knows about are skipped
+        if len(object_index) == 0:
+            continue
+        if isinstance(updated, bpy.types.Object) and updated.data is not None:
+            if updated.name not in object_index.get((updated.type, updated.data.name), []):
+                object_index.clear()
+        elif isinstance(updated, (bpy.types.Mesh, bpy.types.Armature)):
+            if (updated.id_type, updated.name) not in object_index:
+                object_index.clear()
+
+@bpy.app.handlers.persistent
+def clear_all(*_):
+    # session_uids are only unique within one session of a file, and undo can swap the data out from under them
+    bone_indexes_cache.clear()
+    object_index.clear()
+    poll_results.clear()
+
+
+def register_scene_index():
+    get_mapping() # Compile the mapping now, instead of on the first click
+    if clear_changed not in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.append(clear_changed)
+    for handlers in (bpy.app.handlers.load_post, bpy.app.handlers.undo_post, bpy.app.handlers.redo_post):
+        if clear_all not in handlers:
+            handlers.append(clear_all)
+
+def unregister_scene_index():
+    if clear_changed in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.remove(clear_changed)
+    for handlers in (bpy.app.handlers.load_post, bpy.app.handlers.undo_post, bpy.app.handlers.redo_post):
+        if clear_all in handlers:
+            handlers.remove(clear_all)
+    clear_all()
@@ -0,0 +1,46 @@
+import bpy
+import os
+import sys
+
+# landmarker_session has no dependencies of its own, so it can be imported right away
+script_dir = os.path.dirname(__file__)
+pipeline_dir = os.path.join(os.path.split(script_dir)[0], 'scripts')
+if pipeline_dir not in sys.path:
+    sys.path.append(pipeline_dir)
+import landmarker_session
+
+
+@bpy.app.handlers.persistent
+def release_on_load(_):
+    # Opening another .blend file is a good time to hand the memory back
+    landmarker_session.release()
+
+max_idle_seconds = 10 * 60 # Models nobody has used for this long get closed
+
+def release_idle():
+    landmarker_session.release(max_idle=max_idle_seconds)
+    return 60 # Check again in a minute
+
+def register_handlers():
+    if release_on_load not in bpy.app.handlers.load_pre:
+        bpy.app.handlers.load_pre.append(release_on_load)
+    if not bpy.app.timers.is_registered(release_idle):
+        bpy.app.timers.register(release_idle, first_interval=60, persistent=True)
+
+def unregister_handlers():
+    if release_on_load in bpy.app.handlers.load_pre:
+        bpy.app.handlers.load_pre.remove(release_on_load)
+    if bpy.app.timers.is_registered(release_idle):
+        bpy.app.timers.unregister(release_idle)
+    landmarker_session.release()
+
+
+class ReleaseLandmarkersOperator(bpy.types.Operator):
+    """Close the mediapipe models that are kept loaded between runs, to free their memory"""
+    bl_idname = "cyanic.release_landmarkers"
+    bl_label = "Free landmark models"
+
+    def execute(self, context):
+        closed = landmarker_session.release()
+        self.report({'INFO'}, 'Closed %s landmark models' % closed)
+        return {'FINISHED'}
@@ -1,6 +1,6 @@
 import bpy
 
-from ..operators import FileBrowserOperator, FaceImg2FacemeshOperator
+from ..operators import FileBrowserOperator, FaceImg2FacemeshOperator, FaceImg2FacemeshBatchOperator
 
 class FACEMESH_BUILDER_PT_Panel(bpy.types.Panel):
     bl_label = "Facemesh Builder"
@@ -26,3 +26,11 @@ class FACEMESH_BUILDER_PT_Panel(bpy.types.Panel):
         # col.operator(FileBrowserOperator.bl_idname, text='Select face image')
         # Preview face image?
         col.operator(FaceImg2FacemeshOperator.bl_idname, text='Create face mesh')
+
+        # Batch mode
+        col2 = layout.column(align=True)
+        sub2 = col2.column()
+        sub2.prop(view, 'cyanic_img_batch_path')
+        sub2.prop(view, 'cyanic_batch_workers')
+        sub2.prop(view, 'cyanic_batch_import')
+        col2.operator(FaceImg2FacemeshBatchOperator.bl_idname, text='Create face meshes from folder')
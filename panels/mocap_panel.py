@@ -1,6 +1,7 @@
 import bpy
 
-from ..operators import GenRigFromMetaRigOperator, MocapOperator
+from ..operators import GenRigFromMetaRigOperator, MocapOperator, MocapReplayOperator, MocapRetargetOperator, MocapLiveStopOperator
+from ..operators.mocap import live_stats
 
 class MOCAP_PT_Panel(bpy.types.Panel):
     bl_label = "Mocap"
@@ -37,6 +38,45 @@ class MOCAP_PT_Panel(bpy.types.Panel):
         row3 = layout.row()
         row3.prop(view, 'cyanic_mocap_file_path')
 
+        layout.prop(view, 'cyanic_mocap_model_complexity')
+
+        # Smoothing, used by video, live and replay
+        filter_col = layout.column(align=True)
+        filter_col.prop(view, 'cyanic_mocap_filter')
+        if view.cyanic_mocap_filter == 'one_euro':
+            filter_col.prop(view, 'cyanic_mocap_filter_cutoff')
+            filter_col.prop(view, 'cyanic_mocap_filter_beta')
+        elif view.cyanic_mocap_filter == 'kalman':
+            filter_col.prop(view, 'cyanic_mocap_filter_noise')
+        elif view.cyanic_mocap_filter == 'savgol':
+            filter_col.prop(view, 'cyanic_mocap_filter_window')
+
+        if view.cyanic_source_type == 'video_mode':
+            # Trade accuracy for speed on long or high resolution takes
+            video_col = layout.column(align=True)
+            range_row = video_col.row(align=True)
+            range_row.prop(view, 'cyanic_mocap_frame_start')
+            range_row.prop(view, 'cyanic_mocap_frame_end')
+            video_col.prop(view, 'cyanic_mocap_frame_stride')
+            video_col.prop(view, 'cyanic_mocap_downscale')
+
         # If webcam, need option to record, with timer delay
         col2 = layout.column(align=True)
-        col2.operator(MocapOperator.bl_idname, text='Generate mocap')
+        if live_stats['running']:
+            col2.label(text='%.0f fps, %.0fms latency, %s frames dropped' % (live_stats['fps'], live_stats['latency'] * 1000, live_stats['dropped']))
+            col2.operator(MocapLiveStopOperator.bl_idname, text='Stop live preview')
+        elif view.cyanic_source_type == 'video_mode' and view.cyanic_source_input == 'webcam_input':
+            col2.operator(MocapOperator.bl_idname, text='Start live preview')
+        else:
+            col2.operator(MocapOperator.bl_idname, text='Generate mocap')
+
+        # Replay saved landmarks
+        box = layout.box()
+        box.prop(view, 'cyanic_mocap_recording_path')
+        if view.cyanic_source_type != 'video_mode':
+            # Otherwise it's already shown above, the replay uses the same range
+            row4 = box.row(align=True)
+            row4.prop(view, 'cyanic_mocap_frame_start')
+            row4.prop(view, 'cyanic_mocap_frame_end')
+        box.operator(MocapReplayOperator.bl_idname, text='Replay recording')
+        box.operator(MocapRetargetOperator.bl_idname, text='Retarget recording to rig')
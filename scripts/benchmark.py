@@ -0,0 +1,279 @@
+# Repeatable timings for the hot paths, so slowdowns show up between releases.
+#   python benchmark.py --iterations 20 --json results.json
+# Suites (all of them by default, or pick some with --suites):
+#   load - creating each model
+#   inference - cold (first image on a new model) and warm (model already running) inference, split Tasks API
+#     models against Holistic
+#   facemesh - every stage of the image -> facemesh pipeline: detect, normalize, align, warp, write_obj
+#   mocap - the cost of one video frame: detection, scene locations, smoothing, and the retarget solve per frame
+# facemesh and mocap detect with --backend (see landmark_backends.py). --backend replay skips mediapipe entirely,
+# so the stages after detection can be timed on their own, on made up landmarks or a --recording.
+# Every timing is run --iterations times and reported as mean/min/percentiles in milliseconds. The Tasks API models
+# that aren't in data/ are skipped, see landmarker_session.model_urls. Nothing in here imports bpy.
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+
+import numpy as np
+
+import facemesh_pipeline
+import landmarker_session
+import landmark_backends
+import mocap_landmarks
+import landmark_filters
+import mocap_retarget
+
+script_dir = os.path.dirname(__file__)
+data_dir = os.path.join(os.path.split(script_dir)[0], 'data')
+
+reference_path = os.path.join(data_dir, 'test_pose.jpg')
+
+suites = ('load', 'inference', 'facemesh', 'mocap')
+
+# Same settings the mocap operator uses for a single image
+holistic_options = dict(static_image_mode=True, model_complexity=2, enable_segmentation=False, refine_face_landmarks=True)
+
+
+def summarize(samples):
+    # Seconds in, milliseconds out
+    samples = np.asarray(samples, dtype=np.float64) * 1000
+    if len(samples) == 0:
+        return {'count': 0}
+    p50, p90, p95, p99 = np.percentile(samples, [50, 90, 95, 99])
+    return {'count': len(samples), 'mean': samples.mean(), 'std': samples.std(), 'min': samples.min(),
+            'p50': p50, 'p90': p90, 'p95': p95, 'p99': p99, 'max': samples.max()}
+
+
+def time_calls(function, iterations, warmup=0):
+    # Seconds for each call of function(), after warmup calls that aren't counted
+    for _ in range(warmup):
+        function()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def task_models():
+    # name: function making a new Tasks API model, for the .task files that are downloaded
+    models = {}
+    pose_model_path = landmarker_session.pose_model_paths[holistic_options['model_complexity']]
+    if os.path.isfile(pose_model_path):
+        models['pose_landmarker'] = lambda: landmarker_session.create_pose_landmarker(pose_model_path)
+    if os.path.isfile(landmarker_session.hand_model_path):
+        models['hand_landmarker'] = lambda: landmarker_session.create_hand_landmarker(num_hands=2)
+    if os.path.isfile(landmarker_session.face_model_path):
+        models['face_landmarker'] = lambda: landmarker_session.create_face_landmarker()
+    return models
+
+
+def legacy_models():
+    # name: (function making a new model, function running it on an RGB image)
+    return {
+        'holistic': (lambda: landmarker_session.create_holistic(**holistic_options), lambda model, img: model.process(img)),
+        'face_mesh': (lambda: landmarker_session.create_face_mesh(**facemesh_pipeline.face_mesh_options), lambda model, img: model.process(img)),
+    }
+
+
+def load_image(path):
+    import skimage.io
+    img = skimage.io.imread(path)
+    return img[..., :3] if img.ndim == 3 else img
+
+
+def run_load(args, img):
+    results = {}
+    for name, create in task_models().items():
+        results[name] = summarize(time_calls(lambda: create().close(), args.iterations))
+    for name, (create, _) in legacy_models().items():
+        results[name] = summarize(time_calls(lambda: create().close(), args.iterations))
+    return results
+
+
+def run_inference(args, img):
+    import mediapipe
+    results = {}
+    mp_image = mediapipe.Image(image_format=mediapipe.ImageFormat.SRGB, data=np.ascontiguousarray(img))
+
+    runners = {name: (create, lambda model: model.detect(mp_image)) for name, create in task_models().items()}
+    for name, (create, process) in legacy_models().items():
+        runners[name] = (create, lambda model, process=process: process(model, img))
+
+    for name, (create, run) in runners.items():
+        # Cold: the first image on a model that was just made, the model load itself isn't counted
+        cold = []
+        for _ in range(args.cold_iterations):
+            model = create()
+            cold.extend(time_calls(lambda: run(model), 1))
+            model.close()
+        model = create()
+        warm = time_calls(lambda: run(model), args.iterations, args.warmup)
+        model.close()
+        results[name] = {'cold': summarize(cold), 'warm': summarize(warm)}
+
+    # Split is all of the Tasks API models on the same image (one person's pose, hands and face), Holistic does it in one
+    split_names = [name for name in ('pose_landmarker', 'hand_landmarker', 'face_landmarker') if name in runners]
+    if len(split_names) > 0:
+        split_models = [(runners[name][0](), runners[name][1]) for name in split_names]
+        split = time_calls(lambda: [run(model) for model, run in split_models], args.iterations, args.warmup)
+        for model, _ in split_models:
+            model.close()
+        results['split'] = {'models': split_names, 'warm': summarize(split)}
+    return results
+
+
+def create_backend(args, pose_options=None):
+    if args.backend == 'replay' and len(args.recording) == 0:
+        return landmark_backends.ReplayBackend.synthetic(args.warmup + args.iterations)
+    return landmark_backends.create_backend(args.backend, pose_options, args.recording)
+
+
+def run_facemesh(args, img):
+    backend = create_backend(args)
+    uv_map = facemesh_pipeline.load_uv_map(data_dir)
+    facemesh_pipeline.load_face_model(data_dir) # Cached after the first call, like in Blender
+    stages = {stage: [] for stage in ('detect', 'normalize', 'align', 'warp', 'write_obj', 'total')}
+    with tempfile.TemporaryDirectory() as save_dir:
+        obj_path = os.path.join(save_dir, 'benchmark.obj')
+        texture_path = os.path.join(save_dir, 'benchmark_texture.jpg')
+        for iteration in range(args.warmup + args.iterations):
+            timings = {}
+            start = time.perf_counter()
+            _, keypoints, keypoints3d = facemesh_pipeline.detect_landmarks(backend, img)
+            timings['detect'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            vertices = facemesh_pipeline.normalize_keypoints(keypoints3d)
+            timings['normalize'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            vertices = facemesh_pipeline.align_keypoints_to_grid(vertices)
+            timings['align'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            texture = facemesh_pipeline.prep_texture(img, keypoints, uv_map, args.texture_size)
+            timings['warp'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            facemesh_pipeline.save_facemesh(obj_path, texture_path, vertices, texture, data_dir)
+            timings['write_obj'] = time.perf_counter() - start
+
+            timings['total'] = sum(timings.values())
+            if iteration >= args.warmup:
+                for stage, seconds in timings.items():
+                    stages[stage].append(seconds)
+    return {stage: summarize(samples) for stage, samples in stages.items()}
+
+
+def run_mocap(args, img):
+    backend = create_backend(args, dict(holistic_options, static_image_mode=False))
+    backend.reset()
+    image_height, image_width = img.shape[:2]
+    stages = {stage: [] for stage in ('detect', 'to_locations', 'filter', 'total')}
+    filters = {}
+    frame = {}
+    frame_time = 1 / 30
+    for iteration in range(args.warmup + args.iterations):
+        timings = {}
+        start = time.perf_counter()
+        frame = backend.detect_pose(img)
+        timings['detect'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        mocap_landmarks.frame_to_locations(frame, image_width, image_height)
+        timings['to_locations'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for part, landmarks in frame.items():
+            if part not in filters:
+                filters[part] = landmark_filters.create_filter('one_euro')
+            filters[part].filter(landmarks[:, :3], iteration * frame_time)
+        timings['filter'] = time.perf_counter() - start
+
+        timings['total'] = sum(timings.values())
+        if iteration >= args.warmup:
+            for stage, seconds in timings.items():
+                stages[stage].append(seconds)
+    results = {stage: summarize(samples) for stage, samples in stages.items()}
+
+    # Retargeting runs on whole clips, so time a clip of the detected pose and divide by its length
+    if 'pose' in frame:
+        retarget_mapping = mocap_retarget.get_mapping()
+        bone_count = len(retarget_mapping.bone_names)
+        noise = np.random.default_rng(0).normal(scale=0.01, size=(args.clip_frames, len(frame['pose']), 3))
+        locations = mocap_retarget.to_blender_space(frame['pose'][:, :3] + noise)
+        rest_directions = np.tile([0.0, 0.0, 1.0], (bone_count, 1))
+        rest_rotations = np.tile([1.0, 0.0, 0.0, 0.0], (bone_count, 1))
+        parents = np.full(bone_count, -1, dtype=np.int32)
+        solve = lambda: mocap_retarget.solve_rotations(mocap_retarget.bone_directions(locations, retarget_mapping), rest_directions, rest_rotations, parents)
+        samples = np.array(time_calls(solve, args.iterations, args.warmup)) / args.clip_frames
+        results['retarget_per_frame'] = dict(summarize(samples), clip_frames=args.clip_frames)
+    return results
+
+
+runners = {'load': run_load, 'inference': run_inference, 'facemesh': run_facemesh, 'mocap': run_mocap}
+
+
+def environment():
+    versions = {'python': platform.python_version(), 'numpy': np.__version__}
+    for module_name in ('mediapipe', 'cv2', 'scipy', 'skimage'):
+        try:
+            versions[module_name] = __import__(module_name).__version__
+        except Exception:
+            versions[module_name] = None
+    return {'platform': platform.platform(), 'processor': platform.processor(), 'cpu_count': os.cpu_count(), 'versions': versions}
+
+
+def print_results(results, prefix=''):
+    for name, value in results.items():
+        if isinstance(value, dict) and 'count' in value:
+            if value['count'] == 0:
+                print('%s%s: no samples' % (prefix, name))
+                continue
+            print('%s%-20s mean %9.2fms  p50 %9.2fms  p90 %9.2fms  p99 %9.2fms  (n=%s)' % (prefix, name, value['mean'], value['p50'], value['p90'], value['p99'], value['count']))
+        elif isinstance(value, dict):
+            print('%s%s' % (prefix, name))
+            print_results(value, prefix + '  ')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time model loading, inference, the facemesh pipeline and per-frame mocap')
+    parser.add_argument('--image', default=reference_path, help='Image to run everything on')
+    parser.add_argument('--suites', nargs='+', choices=suites, default=None, help="Which timings to run. Defaults to all of them, or the ones that don't need mediapipe with --backend replay")
+    parser.add_argument('--iterations', type=int, default=20, help='Timed runs of everything')
+    parser.add_argument('--warmup', type=int, default=2, help="Runs before the timed ones that aren't counted")
+    parser.add_argument('--cold-iterations', type=int, default=3, help='New models made for the cold inference timings')
+    parser.add_argument('--texture-size', type=int, default=512, help='Width and height of the facemesh texture')
+    parser.add_argument('--backend', default='solutions', choices=landmark_backends.backend_kinds, help='Landmark detector for the facemesh and mocap suites')
+    parser.add_argument('--recording', default='', help='Mocap recording for --backend replay, made up landmarks are used without one')
+    parser.add_argument('--clip-frames', type=int, default=1000, help='Clip length the retarget solve is timed on')
+    parser.add_argument('--json', default='', help='Write the results here as JSON')
+    args = parser.parse_args()
+
+    if args.suites is None:
+        args.suites = ['facemesh', 'mocap'] if args.backend == 'replay' else list(suites)
+
+    img = load_image(args.image)
+    report = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'image': os.path.abspath(args.image), 'backend': args.backend,
+              'image_size': [img.shape[1], img.shape[0]], 'iterations': args.iterations, 'warmup': args.warmup,
+              'environment': environment(), 'results': {}}
+    for suite in args.suites:
+        print(suite)
+        report['results'][suite] = runners[suite](args, img)
+        print_results(report['results'][suite], '  ')
+
+    if len(args.json) > 0:
+        with open(args.json, 'w') as output_file:
+            json.dump(report, output_file, indent=2, default=float) # numpy floats aren't json serializable
+        print('Saved %s' % args.json)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,61 @@
+# facemesh_rigify_mapping.json compiled into numpy index arrays.
+# The json is nested lists and dicts with 'desc' entries mixed in, which is nice to edit but slow to walk on every
+# operator run. This turns it into flat int arrays once, so the cleanup and rig operators can index the facemesh
+# verts directly. Nothing in here imports bpy.
+import os
+import json
+from collections import namedtuple
+
+import numpy as np
+
+script_dir = os.path.dirname(__file__)
+data_dir = os.path.join(os.path.split(script_dir)[0], 'data')
+mapping_file = os.path.join(data_dir, 'facemesh_rigify_mapping.json')
+
+# bone_names: Rigify bone names, in the same order as heads and tails
+# heads, tails: int32 facemesh vert index for each bone end, -1 where the mapping leaves it as None
+# center: int32 verts that sit on the X = 0 plane
+# mirror_pairs: int32 (n, 2) of left/right vert pairs
+# face_verts: region name ('eye.L', 'eye.R', 'mouth'): int32 (n, 3) triangles covering the opening
+# edge_verts: region name: int32 (n, 2) edges inside the opening
+# midpoint_verts: region name: {'horizontal': int32 (2,), 'vertical': int32 (2,)}
+FacemeshMapping = namedtuple('FacemeshMapping', ['bone_names', 'heads', 'tails', 'center', 'mirror_pairs', 'face_verts', 'edge_verts', 'midpoint_verts'])
+
+mapping = None
+
+
+def without_desc(section):
+    return {key: value for key, value in section.items() if key.lower() != 'desc'}
+
+
+def index_array(values, columns=None):
+    array = np.asarray(values, dtype=np.int32)
+    if columns is not None:
+        array = array.reshape(-1, columns)
+    return array
+
+
+def compile_mapping(path=mapping_file):
+    with open(path, 'r') as input_file:
+        config = json.load(input_file)
+
+    bone_positions = without_desc(config['bone_positions'])
+    bone_names = tuple(bone_positions.keys())
+    heads = index_array([-1 if bone_positions[name]['head'] is None else bone_positions[name]['head'] for name in bone_names])
+    tails = index_array([-1 if bone_positions[name]['tail'] is None else bone_positions[name]['tail'] for name in bone_names])
+
+    symmetry = config['symmetry']
+    face_verts = {region: index_array(verts, 3) for region, verts in without_desc(config['face_verts']).items()}
+    edge_verts = {region: index_array(verts, 2) for region, verts in without_desc(config['edge_verts']).items()}
+    midpoint_verts = {region: {axis: index_array(verts) for axis, verts in axes.items()} for region, axes in without_desc(config['midpoint_verts']).items()}
+
+    return FacemeshMapping(bone_names, heads, tails, index_array(symmetry['center']), index_array(symmetry['mirror_pairs'], 2), face_verts, edge_verts, midpoint_verts)
+
+
+def get_mapping():
+    # Compiled the first time it's asked for, the same arrays are shared after that
+    global mapping
+    if mapping is None:
+        mapping = compile_mapping()
+    return mapping
+
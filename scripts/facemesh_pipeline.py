@@ -0,0 +1,620 @@
+# The image -> facemesh steps that don't need Blender.
+# Nothing in here imports bpy, so it can be loaded by worker processes (which run Blender's bundled
+# python, not Blender itself) or run from the command line:
+#   python facemesh_pipeline.py "C:\casting\*.jpg" --workers 4
+import os
+import sys
+import json
+import glob
+import time
+import argparse
+import multiprocessing
+import concurrent.futures
+from collections import namedtuple
+
+import numpy as np
+import scipy.spatial
+import skimage.io
+import skimage.color
+
+script_dir = os.path.dirname(__file__)
+data_dir = os.path.join(os.path.split(script_dir)[0], 'data')
+
+batch_image_extensions = ('.jpg', '.jpeg', '.png')
+
+FacemeshJob = namedtuple("FacemeshJob", ["img_path", "save_dir", "obj_name", "texture_name", "precision", "texture_size"], defaults=[6, 512])
+FacemeshResult = namedtuple("FacemeshResult", ["img_path", "obj_path", "error", "timings"])
+
+
+# Settings for single face still images. One instance can process any number of images.
+face_mesh_options = dict(
+    static_image_mode=True,
+    refine_landmarks=True,
+    max_num_faces=1,
+    min_detection_confidence=0.5,
+)
+
+def collect_batch_images(batch_path):
+    # A folder uses every image inside it, anything else is treated as a glob pattern (ex: C:\casting\*_front.jpg)
+    if os.path.isdir(batch_path):
+        img_paths = [os.path.join(batch_path, name) for name in os.listdir(batch_path)]
+    else:
+        img_paths = glob.glob(batch_path)
+    return sorted([path for path in img_paths if os.path.isfile(path) and os.path.splitext(path)[1].lower() in batch_image_extensions])
+
+
+def output_names(img_path):
+    # (obj name, texture name) for the files generated from img_path
+    filename =  os.path.splitext(os.path.basename(img_path))[0] # the name without the extension
+    return "%s.obj" % filename, ".%s_texture.jpg" % filename
+
+
+def run_face_mesh(face_mesh, img):
+    # Returns (img, landmarks). landmarks are mediapipe's normalized (x, y, z), (478, 3) with refine_landmarks.
+    # img is returned because it may have been converted to RGB.
+    # Raises ValueError with a message that can be shown to the user.
+    # run facial landmark detection
+    # TODO: Just check the extension of the image path first to see if it's a PNG
+    try:
+        results = face_mesh.process(img)
+    except Exception as e:
+        if type(e) == ValueError and 'must contain three channel rgb info' in '%s' % e:
+            # PNG was probaly provided, try to convert to JPG
+            try:
+                img = skimage.color.rgba2rgb(img)
+                results = face_mesh.process(img)
+            except Exception as e:
+                # raise Exception('Unable to use a PNG, and unable to automatically convert PNG to JPG')
+                raise ValueError('Unable to use this image, please try a JPG/JPEG image instead.')
+        else:
+            # Not a 3-channel issue
+            raise ValueError('%s: %s' % (type(e), e))
+
+    # Only support one face per image, ignores any other faces detected
+    if not results.multi_face_landmarks: # None when no face was found
+        raise ValueError('Unable to find a face in this image. Please try a closer image.')
+    face_landmarks = results.multi_face_landmarks[0]
+    landmarks = np.array([(point.x, point.y, point.z) for point in face_landmarks.landmark], dtype=np.float32)
+    return img, landmarks
+
+
+def landmarks_to_keypoints(landmarks, img_shape):
+    # Returns (keypoints, keypoints3d): the pixel locations of the landmarks in the image, and the landmarks in 3D
+    H,W = img_shape[:2]
+    landmarks = landmarks[0:468].astype(np.float64) #after 468 is iris or something else
+    keypoints = landmarks[:, :2] * (W, H)
+
+    # The X, Y, and Z coords are normalized to 0.0 to 1.0 for the width and height of the image (Z is at the same scale as X).
+    # To restore the face to it's original ratio, the X and Z coordinates need to be scaled by the ratio of width to height
+    # See https://google.github.io/mediapipe/solutions/face_mesh#output for more details
+
+    width_ratio = W / H
+    keypoints3d = landmarks * (width_ratio, 1, width_ratio)
+    return keypoints, keypoints3d
+
+
+def detect_landmarks(backend, img):
+    # Returns (img, keypoints, keypoints3d), see landmark_backends.LandmarkBackend.detect_face and landmarks_to_keypoints
+    img, landmarks = backend.detect_face(img)
+    keypoints, keypoints3d = landmarks_to_keypoints(landmarks, img.shape)
+    return img, keypoints, keypoints3d
+
+
+# borrowed from https://github.com/YadiraF/DECA/blob/f84855abf9f6956fb79f3588258621b363fa282c/decalib/utils/util.py
+def load_obj(obj_filename):
+    """ Ref: https://github.com/facebookresearch/pytorch3d/blob/25c065e9dafa90163e7cec873dbb324a637c68b7/pytorch3d/io/obj_io.py
+    Load a mesh from a file-like object.
+    """
+    with open(obj_filename, 'r') as f:
+        lines = [line.strip() for line in f]
+
+    verts, uvcoords = [], []
+    faces, uv_faces = [], []
+    # startswith expects each line to be a string. If the file is read in as
+    # bytes then first decode to strings.
+    if lines and isinstance(lines[0], bytes):
+        lines = [el.decode("utf-8") for el in lines]
+
+    for line in lines:
+        tokens = line.strip().split()
+        if line.startswith("v "):  # Line is a vertex.
+            vert = [float(x) for x in tokens[1:4]]
+            if len(vert) != 3:
+                msg = "Vertex %s does not have 3 values. Line: %s"
+                raise ValueError(msg % (str(vert), str(line)))
+            verts.append(vert)
+        elif line.startswith("vt "):  # Line is a texture.
+            tx = [float(x) for x in tokens[1:3]]
+            if len(tx) != 2:
+                raise ValueError(
+                    "Texture %s does not have 2 values. Line: %s" % (str(tx), str(line))
+                )
+            uvcoords.append(tx)
+        elif line.startswith("f "):  # Line is a face.
+            # Update face properties info.
+            face = tokens[1:]
+            face_list = [f.split("/") for f in face]
+            for vert_props in face_list:
+                # Vertex index.
+                faces.append(int(vert_props[0]))
+                if len(vert_props) > 1:
+                    if vert_props[1] != "":
+                        # Texture index is present e.g. f 4/1/1.
+                        uv_faces.append(int(vert_props[1]))
+
+    verts = np.array(verts)
+    uvcoords = np.array(uvcoords)
+    faces = np.array(faces); faces = faces.reshape(-1, 3) - 1
+    uv_faces = np.array(uv_faces); uv_faces = uv_faces.reshape(-1, 3) - 1
+    return (
+        verts,
+        uvcoords,
+        faces,
+        uv_faces
+    )
+
+
+def format_rows(line_format, array):
+    # Formats every row of a 2D array with one % operation, instead of one .format() call per row
+    return (line_format * array.shape[0]) % tuple(array.ravel().tolist())
+
+
+# borrowed from https://github.com/YadiraF/DECA/blob/f84855abf9f6956fb79f3588258621b363fa282c/decalib/utils/util.py
+def write_obj(obj_name,
+              vertices,
+              faces,
+              texture_name = "texture.jpg",
+              colors=None,
+              texture=None,
+              uvcoords=None,
+              uvfaces=None,
+              precision=6
+              ):
+    ''' Save 3D face model with texture. 
+    Ref: https://github.com/patrikhuber/eos/blob/bd00155ebae4b1a13b08bf5a991694d682abbada/include/eos/core/Mesh.hpp
+    Args:
+        obj_name: str
+        vertices: shape = (nver, 3)
+        colors: shape = (nver, 3)
+        faces: shape = (ntri, 3)
+        texture: shape = (uv_size, uv_size, 3)
+        uvcoords: shape = (nver, 2) max value<=1
+        precision: digits after the decimal point for vertices/uvs/colors. None writes the full float
+    '''
+    if os.path.splitext(obj_name)[-1] != '.obj':
+        obj_name = obj_name + '.obj'
+    mtl_name = obj_name.replace('.obj', '.mtl')
+    material_name = 'FaceTexture'
+    float_format = '%r' if precision is None else '%%.%sf' % precision
+
+    # mesh lab start with 1, python/c++ start from 0
+    faces = faces + 1
+
+    # The whole file is built in memory, then written in one go
+    lines = []
+    # first line: write mtlib(material library)
+    if texture is not None:
+        lines.append('mtllib %s\n\n' % os.path.basename(mtl_name))
+
+    # write vertices
+    if colors is None:
+        lines.append(format_rows('v %s\n' % ' '.join([float_format] * 3), vertices))
+    else:
+        lines.append(format_rows('v %s\n' % ' '.join([float_format] * 6), np.hstack([vertices[:, :3], colors[:, :3]])))
+
+    # write uv coords
+    if texture is None:
+        lines.append(format_rows('f %d %d %d\n', faces[:, ::-1]))
+    else:
+        lines.append(format_rows('vt %s\n' % ' '.join([float_format] * 2), uvcoords))
+        lines.append('usemtl %s\n' % material_name)
+        # write f: ver ind/ uv ind
+        uvfaces = uvfaces + 1
+        # Interleave the columns to vert/uv pairs: v0 uv0 v1 uv1 v2 uv2
+        face_pairs = np.stack([faces, uvfaces], axis=-1).reshape(-1, 6)
+        lines.append(format_rows('f %d/%d %d/%d %d/%d\n', face_pairs))
+
+    with open(obj_name, 'w') as f:
+        f.write(''.join(lines))
+
+    if texture is not None:
+        # write mtl
+        with open(mtl_name, 'w') as f:
+            f.write('newmtl %s\nmap_Kd %s\n' % (material_name, os.path.basename(texture_name))) # map to image
+        try:
+            skimage.io.imsave(texture_name, texture)
+        except Exception as e:
+            # There's still an alpha channel in the image
+            skimage.io.imsave(texture_name, skimage.color.rgba2rgb(texture))
+
+
+def normalize_keypoints(keypoints3d):
+    # Rotates and centers the points. Works on one face (468, 3) or a stack of faces (N, 468, 3)
+    # One of the rotations is a little too far
+    #  Landmarks labeled
+    #  https://github.com/google/mediapipe/blob/a908d668c730da128dfa8d9f6bd25d519d006692/mediapipe/modules/face_geometry/data/canonical_face_model_uv_visualization.png
+    center = keypoints3d[..., 0:1, :]
+    keypoints3d = keypoints3d - center # This centering is undone by some later step
+    # axis1 = keypoints3d[165] - keypoints3d[391] # 165 = left side between nose and lip, # right side between nose and lip (one vertex off center)
+    # axis2 = keypoints3d[2] - keypoints3d[0] # 2 = below nose, 0 = above lip (only 1 vertex apart)
+    axis1 = keypoints3d[..., 454, :] - keypoints3d[..., 234, :] # side of face to side of face
+    axis2 = keypoints3d[..., 10, :] - keypoints3d[..., 152, :] # forehead to chin
+    axis3 = np.cross(axis2,axis1)
+    axis3 = axis3/np.linalg.norm(axis3, axis=-1, keepdims=True)
+    axis2 = axis2/np.linalg.norm(axis2, axis=-1, keepdims=True)
+    axis1 = np.cross(axis3, axis2) # Should be redundant
+    axis1 = axis1/np.linalg.norm(axis1, axis=-1, keepdims=True)
+    U = np.stack([axis3,axis2,axis1], axis=-2) # Would changing this order help correctly orient the object?
+    keypoints3d = np.matmul(keypoints3d, U)
+    keypoints3d = keypoints3d - keypoints3d.mean(axis=-2, keepdims=True) # Doesn't seem to make a difference
+
+    return keypoints3d
+
+
+def rotation_matrix(opp_side, adj_side, angle):
+    # The rotation done by rotate_around_origin as a 3x3 matrix (new = matrix @ old).
+    # If angle is an array of N angles, an (N, 3, 3) stack of matrices is returned
+    angle = np.asarray(angle, dtype=np.float64)
+    cos, sin = np.cos(angle), np.sin(angle)
+    matrix = np.zeros(angle.shape + (3, 3))
+    other_side = 3 - opp_side - adj_side
+    matrix[..., other_side, other_side] = 1
+    matrix[..., opp_side, opp_side] = cos
+    matrix[..., opp_side, adj_side] = -sin
+    matrix[..., adj_side, adj_side] = cos
+    matrix[..., adj_side, opp_side] = sin
+    return matrix
+
+
+def rotate_around_origin(keypoints3d, opp_side, adj_side, angle):
+    return np.matmul(keypoints3d, rotation_matrix(opp_side, adj_side, angle).T)
+
+
+def grid_alignment(keypoints3d):
+    # The single rotation align_keypoints_to_grid applies, for (468, 3) or (N, 468, 3) keypoints that are centered on keypoints3d[0].
+    # Each step's angle depends on the steps before it, but only a couple of landmarks are needed to work the angles out,
+    # so those get rotated on their own and the full face is only rotated once at the end.
+    # Rotate the face left-to-right to be straight up-and-down
+    forehead = keypoints3d[..., 10, :]
+    rotation = rotation_matrix(2, 1, np.arctan2(forehead[..., 2], forehead[..., 1]))
+
+    # Rotate the face forward-and-back
+    brow = np.einsum('...ij,...j->...i', rotation, keypoints3d[..., 9, :]) # Center of brow
+    rotation = np.matmul(rotation_matrix(0, 1, np.arctan2(brow[..., 0], brow[..., 1])), rotation)
+
+    # Rotate the face to be looking straight ahead
+    # The original version moved the midpoint between the sides of the face to the origin first, but the angle only
+    # depends on the direction from one side to the other, and the translation is removed when re-centering on keypoints3d[0]
+    face_width = np.einsum('...ij,...j->...i', rotation, keypoints3d[..., 454, :] - keypoints3d[..., 234, :])
+    rotation = np.matmul(rotation_matrix(2, 0, np.arctan2(face_width[..., 2], face_width[..., 0])), rotation)
+    return rotation
+
+
+def align_keypoints_to_grid(keypoints3d):
+    # Center at keypoints3d[0]
+    # Put chin and forehead (keypoints3d[152] and keypoints3d[10]) on Z axis
+    # Put left and right cheeks (keypoints3d[234] and keypoints3d[454]) on X axis
+    #  Landmarks labeled
+    #  https://github.com/google/mediapipe/blob/a908d668c730da128dfa8d9f6bd25d519d006692/mediapipe/modules/face_geometry/data/canonical_face_model_uv_visualization.png
+    # Works on one face (468, 3) or a stack of faces (N, 468, 3), ex: every frame of a video
+    keypoints3d = keypoints3d - keypoints3d[..., 0:1, :]
+    rotation = grid_alignment(keypoints3d)
+    return np.matmul(keypoints3d, np.swapaxes(rotation, -1, -2))
+
+
+FaceModel = namedtuple("FaceModel", ["verts", "uvcoords", "faces", "uv_faces", "uv_map"])
+face_model_sources = ("canonical_face_model.obj", "uv_map.json")
+face_model_cache_name = "face_model_cache.npz"
+face_models = {} # data_dir: FaceModel, so each process only loads it once
+
+def compile_face_model(data_dir=data_dir):
+    # Parse the text versions of the static face data
+    obj_filename = os.path.join(data_dir, "canonical_face_model.obj")
+    verts,uvcoords,faces,uv_faces = load_obj(obj_filename)
+
+    uv_path = os.path.join(data_dir, "uv_map.json") # taken from https://github.com/spite/FaceMeshFaceGeometry/blob/353ee557bec1c8b55a5e46daf785b57df819812c/js/geometry.js
+    with open(uv_path, 'r') as input_file:
+        uv_map_dict = json.load(input_file)
+    uv_map = np.array([ (uv_map_dict["u"][str(i)],uv_map_dict["v"][str(i)]) for i in range(468)])
+    return FaceModel(verts, uvcoords, faces, uv_faces, uv_map)
+
+
+def face_model_stamp(data_dir=data_dir):
+    # Modified time and size of the source files, used to tell if the cache is out of date
+    stamp = []
+    for source in face_model_sources:
+        stat = os.stat(os.path.join(data_dir, source))
+        stamp.extend([stat.st_mtime_ns, stat.st_size])
+    return np.array(stamp, dtype=np.int64)
+
+
+def load_face_model(data_dir=data_dir):
+    # The canonical face model and UV map, from memory if possible, then the .npz cache, then the source files
+    if data_dir in face_models:
+        return face_models[data_dir]
+
+    cache_path = os.path.join(data_dir, face_model_cache_name)
+    stamp = face_model_stamp(data_dir)
+    face_model = None
+    if os.path.isfile(cache_path):
+        try:
+            with np.load(cache_path) as cache:
+                if np.array_equal(cache['stamp'], stamp):
+                    face_model = FaceModel(*[cache[field] for field in FaceModel._fields])
+        except (OSError, KeyError, ValueError):
+            face_model = None # Unreadable cache, rebuild it
+
+    if face_model is None:
+        face_model = compile_face_model(data_dir)
+        try:
+            # Write to a temp file first, so another process never reads a half written cache
+            tmp_path = '%s.%s.tmp' % (cache_path, os.getpid())
+            with open(tmp_path, 'wb') as output_file:
+                np.savez(output_file, stamp=stamp, **face_model._asdict())
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            # Add-on folder might not be writable, the memory copy still helps
+            print('Unable to save face model cache: %s' % e)
+
+    face_models[data_dir] = face_model
+    return face_model
+
+
+def load_uv_map(data_dir=data_dir):
+    return load_face_model(data_dir).uv_map
+
+
+# Which triangle of the UV layout each texture pixel is in, and where in that triangle it is.
+# These only depend on the UV map and the texture size, so they're worked out once and reused for every texture.
+# Past max_cached_weights_size only the triangle of each pixel is kept (2 bytes a pixel), and the weights are
+# recalculated one strip at a time while baking, so an 8K texture doesn't need gigabytes of cache.
+TextureWarp = namedtuple("TextureWarp", ["shape", "simplices", "transform", "triangles", "weights"])
+texture_warps = {} # (height, width, uv_map bytes): TextureWarp
+max_cached_weights_size = 1024
+strip_pixels = 1 << 20 # Pixels handled at once by each thread, keeps the temporary arrays around 50MB per thread
+
+def texture_strips(shape):
+    # (first row, last row + 1) of each strip of the texture
+    H,W = shape
+    strip_rows = max(1, strip_pixels // W)
+    return [(row, min(H, row + strip_rows)) for row in range(0, H, strip_rows)]
+
+
+def run_strips(function, strips, threads):
+    # numpy and qhull let go of the GIL for the heavy parts, so threads are enough to use more cores
+    if threads <= 1 or len(strips) == 1:
+        for strip in strips:
+            function(*strip)
+    else:
+        with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+            list(executor.map(lambda strip: function(*strip), strips))
+
+
+def strip_points(shape, row_start, row_end):
+    # warp() samples at the pixel centers, (x, y) = (column, row)
+    rows, cols = np.mgrid[row_start:row_end, 0:shape[1]]
+    return np.column_stack([cols.ravel(), rows.ravel()]).astype(np.float32)
+
+
+def barycentric_weights(transform, triangles, points):
+    # Weights of each point in its triangle. Applying them to the triangle's corners in the photo gives the
+    # same point as the per-triangle affine transform
+    transform = transform[triangles]
+    weights = np.einsum('nij,nj->ni', transform[:, :2], points - transform[:, 2])
+    return np.column_stack([weights, 1 - weights.sum(axis=1)])
+
+
+def get_texture_warp(uv_map, texture_size=512, threads=1):
+    H_new,W_new = texture_size,texture_size
+    key = (H_new, W_new, uv_map.tobytes())
+    if key in texture_warps:
+        return texture_warps[key]
+
+    # Same triangulation skimage's PiecewiseAffineTransform would make from the UV keypoints
+    keypoints_uv = uv_map * (W_new, H_new)
+    triangulation = scipy.spatial.Delaunay(keypoints_uv)
+    transform = triangulation.transform.astype(np.float32)
+
+    triangles = np.empty(H_new * W_new, dtype=np.int16) # -1 is outside of the UV layout, those pixels stay black
+    weights = None
+    if texture_size <= max_cached_weights_size:
+        weights = np.zeros((H_new * W_new, 3), dtype=np.float32)
+
+    def find_triangles(row_start, row_end):
+        points = strip_points((H_new, W_new), row_start, row_end)
+        strip_triangles = triangulation.find_simplex(points)
+        triangles[row_start * W_new:row_end * W_new] = strip_triangles
+        if weights is not None:
+            inside = np.flatnonzero(strip_triangles >= 0)
+            weights[row_start * W_new + inside] = barycentric_weights(transform, strip_triangles[inside], points[inside])
+
+    run_strips(find_triangles, texture_strips((H_new, W_new)), threads)
+
+    texture_warp = TextureWarp((H_new, W_new), triangulation.simplices.astype(np.int32), transform, triangles, weights)
+    texture_warps[key] = texture_warp
+    return texture_warp
+
+
+def sample_bilinear(img, x, y):
+    # Bilinear sample of img at the (x, y) points, 0 outside of the image. Returned in the image's own range as float32
+    H,W = img.shape[:2]
+    if img.ndim == 2:
+        img = img[..., None]
+    flat_img = img.reshape(H * W, img.shape[2])
+    x0 = np.floor(x).astype(np.int32)
+    y0 = np.floor(y).astype(np.int32)
+    fx = (x - x0).astype(np.float32)
+    fy = (y - y0).astype(np.float32)
+
+    sampled = np.zeros((len(x), img.shape[2]), dtype=np.float32)
+    for dx, dy, weight in ((0, 0, (1 - fx) * (1 - fy)), (1, 0, fx * (1 - fy)), (0, 1, (1 - fx) * fy), (1, 1, fx * fy)):
+        xi = x0 + dx
+        yi = y0 + dy
+        # Clamp the lookups to the image, and drop the ones that were outside with a weight of 0
+        weight[(xi < 0) | (xi >= W) | (yi < 0) | (yi >= H)] = 0
+        index = np.clip(yi, 0, H - 1) * W + np.clip(xi, 0, W - 1)
+        sampled += weight[:, None] * np.take(flat_img, index, axis=0)
+    return sampled
+
+
+def prep_texture(img, keypoints, uv_map, texture_size=512, threads=0):
+    # Warps the face in img onto the UV layout. Same result as skimage's PiecewiseAffineTransform + warp,
+    # without re-triangulating the UV map or searching for every pixel's triangle each time.
+    # The texture is done in strips of rows, spread over threads (0 = one per CPU core), with float32 temporary arrays
+    if threads <= 0:
+        threads = os.cpu_count() or 1
+    texture_warp = get_texture_warp(uv_map, texture_size, threads)
+    H_new,W_new = texture_warp.shape
+    keypoints = keypoints.astype(np.float32)
+
+    # Same scaling as skimage's img_as_float followed by *255
+    if np.issubdtype(img.dtype, np.integer):
+        scale = 255 / np.iinfo(img.dtype).max
+    else:
+        scale = 255
+
+    channels = 1 if img.ndim == 2 else img.shape[2]
+    texture = np.zeros((H_new * W_new, channels), dtype=np.uint8)
+
+    def bake_strip(row_start, row_end):
+        start, end = row_start * W_new, row_end * W_new
+        strip_triangles = texture_warp.triangles[start:end]
+        inside = np.flatnonzero(strip_triangles >= 0)
+        strip_triangles = strip_triangles[inside]
+        if texture_warp.weights is not None:
+            weights = texture_warp.weights[start + inside]
+        else:
+            points = strip_points(texture_warp.shape, row_start, row_end)[inside]
+            weights = barycentric_weights(texture_warp.transform, strip_triangles, points)
+
+        # Where each texture pixel comes from in the photo
+        source = np.einsum('nk,nkj->nj', weights, keypoints[texture_warp.simplices[strip_triangles]])
+        sampled = sample_bilinear(img, source[:, 0], source[:, 1])
+        sampled *= scale
+        texture[start + inside] = sampled
+
+    run_strips(bake_strip, texture_strips(texture_warp.shape), threads)
+
+    texture = texture.reshape((H_new, W_new, channels))
+    if img.ndim == 2:
+        texture = texture[..., 0]
+    return texture
+
+
+def landmarks_to_3d(keypoints3d):
+    # keypoints3d already has a face that's more round than the original
+    vertices = normalize_keypoints(keypoints3d)
+    # Rotate the vertices so the face isn't at an odd angle
+    return align_keypoints_to_grid(vertices)
+
+
+def save_facemesh(obj_path, texture_path, vertices, texture, data_dir=data_dir, precision=6):
+    face_model = load_face_model(data_dir)
+
+    save_dir = os.path.split(obj_path)[0]
+    if not os.path.isdir(save_dir):
+        os.makedirs(save_dir)
+
+    # borrowed from https://github.com/YadiraF/PRNet/blob/master/utils/write.py
+    write_obj(obj_path,
+              vertices,
+              face_model.faces,
+              texture_path,
+              texture=texture,
+              uvcoords=face_model.uvcoords,
+              uvfaces=face_model.uv_faces,
+              precision=precision,
+              )
+
+
+# Each worker process keeps its own landmarker for every image it's given
+worker_backend = None
+worker_uv_map = None
+worker_data_dir = data_dir
+
+def init_worker(data_dir, backend='solutions'):
+    global worker_backend, worker_uv_map, worker_data_dir
+    import landmark_backends # Imports this module, so it can't be imported at the top
+    worker_data_dir = data_dir
+    worker_uv_map = load_uv_map(data_dir)
+    worker_backend = landmark_backends.create_backend(backend)
+
+
+def process_job(job):
+    # Runs the whole pipeline for one image. Errors are returned instead of raised so the batch keeps going
+    timings = {}
+    obj_path = os.path.join(job.save_dir, job.obj_name)
+    try:
+        start = time.perf_counter()
+        img = skimage.io.imread(job.img_path)
+        timings['read'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        img, keypoints, keypoints3d = detect_landmarks(worker_backend, img)
+        timings['detect'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        vertices = landmarks_to_3d(keypoints3d)
+        timings['align'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        texture = prep_texture(img, keypoints, worker_uv_map, job.texture_size, threads=1) # Already one process per core
+        timings['texture'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        save_facemesh(obj_path, os.path.join(job.save_dir, job.texture_name), vertices, texture, worker_data_dir, job.precision)
+        timings['write'] = time.perf_counter() - start
+    except Exception as e:
+        return FacemeshResult(job.img_path, None, '%s' % e, timings)
+    return FacemeshResult(job.img_path, obj_path, None, timings)
+
+
+def run_batch(jobs, workers=0, data_dir=data_dir, backend='solutions'):
+    # Yields a FacemeshResult for every job, in the same order as jobs.
+    # workers=0 uses one process per CPU core. backend is a landmark_backends kind
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(jobs)))
+
+    # spawn instead of fork, fork isn't available on Windows and isn't safe with mediapipe's threads.
+    # Spawned processes get the parent's sys.path, which is how they find this module when it's started from Blender.
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(workers, initializer=init_worker, initargs=(data_dir, backend)) as pool:
+        for result in pool.imap(process_job, jobs):
+            yield result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert a folder of face images to face meshes')
+    parser.add_argument('images', help='Folder of images, or a glob pattern like "faces/*.jpg"')
+    parser.add_argument('--out', default='', help='Directory for the generated files. Defaults to the directory of each image')
+    parser.add_argument('--workers', type=int, default=0, help='Number of worker processes. 0 uses one per CPU core')
+    parser.add_argument('--precision', type=int, default=6, help='Digits after the decimal point in the .obj files')
+    parser.add_argument('--texture-size', type=int, default=512, help='Width and height of the textures')
+    parser.add_argument('--backend', default='solutions', choices=('solutions', 'tasks', 'replay'), help='Landmark detector. replay uses made up landmarks, for timing the rest of the pipeline')
+    args = parser.parse_args()
+
+    jobs = []
+    for img_path in collect_batch_images(args.images):
+        save_dir = args.out if len(args.out) > 0 else os.path.split(os.path.abspath(img_path))[0]
+        obj_name, texture_name = output_names(img_path)
+        jobs.append(FacemeshJob(img_path, save_dir, obj_name, texture_name, args.precision, args.texture_size))
+    if len(jobs) == 0:
+        print('No images found for %s' % args.images)
+        return 1
+
+    batch_start = time.perf_counter()
+    failed = 0
+    for index, result in enumerate(run_batch(jobs, args.workers, backend=args.backend)):
+        if result.error is None:
+            print('[%s/%s] %s: %.2fs (%s)' % (index + 1, len(jobs), result.img_path, sum(result.timings.values()),
+                                               ', '.join(['%s %.2fs' % (stage, t) for stage, t in result.timings.items()])))
+        else:
+            failed += 1
+            print('[%s/%s] %s: FAILED %s' % (index + 1, len(jobs), result.img_path, result.error))
+    print('Created %s face meshes in %.1fs, %s failed' % (len(jobs) - failed, time.perf_counter() - batch_start, failed))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,220 @@
+# The landmark detectors the face and mocap operators can use, behind one interface.
+#   solutions - mediapipe's legacy FaceMesh and Holistic (the default)
+#   tasks - the Tasks API: data/face_landmarker.task, plus pose/hand .task files for mocap if they're downloaded
+#   replay - serves landmarks that were already found (a mocap recording, saved arrays, or made up ones) in order,
+#     without touching the image. Same landmarks every run, so everything after detection can be profiled on its own
+# Nothing in here imports bpy, and mediapipe is only imported once a solutions or tasks model is first used.
+import os
+import abc
+
+import numpy as np
+
+import landmarker_session
+import mocap_landmarks
+import facemesh_pipeline
+
+backend_kinds = ('solutions', 'tasks', 'replay')
+no_face_message = 'Unable to find a face in this image. Please try a closer image.'
+
+override = None # A backend to use in place of whatever get_backend() is asked for, for scripts and load tests
+
+
+class LandmarkBackend(abc.ABC):
+    # What the operators need from a detector. Images are RGB numpy arrays
+    kind = None
+
+    def face_cache_key(self):
+        # (detector name, options) for landmark_cache.image_key, None if the landmarks shouldn't be cached
+        return None
+
+    def pose_cache_key(self):
+        return None
+
+    @abc.abstractmethod
+    def detect_face(self, img):
+        # Returns (img, landmarks): normalized (x, y, z), (478, 3) float32, and img in case it had to be converted.
+        # Raises ValueError with a message that can be shown to the user when there's no face
+        pass
+
+    @abc.abstractmethod
+    def detect_pose(self, img):
+        # Returns a mocap_landmarks frame dict
+        pass
+
+    def reset(self):
+        # Forget any tracking from the last video
+        pass
+
+
+class SolutionsBackend(LandmarkBackend):
+    kind = 'solutions'
+
+    def __init__(self, pose_options=None):
+        self.pose_options = pose_options or {}
+
+    def face_cache_key(self):
+        return 'face_mesh', facemesh_pipeline.face_mesh_options
+
+    def pose_cache_key(self):
+        return 'holistic', self.pose_options
+
+    def detect_face(self, img):
+        # landmarker_session keeps the model loaded between calls
+        return facemesh_pipeline.run_face_mesh(landmarker_session.get_face_mesh(**facemesh_pipeline.face_mesh_options), img)
+
+    def detect_pose(self, img):
+        # Asking the session for the model every frame also keeps the idle timer from closing it mid video
+        holistic = landmarker_session.get_holistic(**self.pose_options)
+        return mocap_landmarks.results_to_frame(holistic.process(img))
+
+    def reset(self):
+        landmarker_session.get_holistic(reset=True, **self.pose_options)
+
+
+class TasksBackend(LandmarkBackend):
+    # The Tasks API models are run in IMAGE mode, so video frames are each detected from scratch
+    kind = 'tasks'
+    face_options = dict(num_faces=1, min_face_detection_confidence=0.5)
+
+    def __init__(self, pose_options=None):
+        # pose_options are the Holistic ones, model_complexity picks the pose model and min_detection_confidence
+        # carries over. The rest don't have a Tasks API equivalent
+        pose_options = pose_options or {}
+        self.pose_model_path = landmarker_session.pose_model_paths[pose_options.get('model_complexity', 2)]
+        confidence = pose_options.get('min_detection_confidence', 0.5)
+        self.pose_options = dict(num_poses=1, min_pose_detection_confidence=confidence)
+        self.hand_options = dict(num_hands=2, min_hand_detection_confidence=confidence)
+
+    def face_cache_key(self):
+        return 'face_landmarker', self.face_options
+
+    def pose_cache_key(self):
+        return 'pose_landmarker', dict(self.pose_options, model=self.pose_model_path)
+
+    @staticmethod
+    def to_mp_image(img):
+        import mediapipe
+        if img.dtype != np.uint8:
+            img = np.clip(img * 255 if img.max() <= 1 else img, 0, 255).astype(np.uint8)
+        if img.ndim == 2:
+            img = np.stack([img] * 3, axis=-1)
+        return mediapipe.Image(image_format=mediapipe.ImageFormat.SRGB, data=np.ascontiguousarray(img[..., :3]))
+
+    def detect_face(self, img):
+        if img.ndim == 3 and img.shape[2] == 4:
+            # Same conversion the legacy FaceMesh needs for PNGs, so the texture comes out the same
+            import skimage.color
+            img = skimage.color.rgba2rgb(img)
+        result = landmarker_session.get_face_landmarker(**self.face_options).detect(self.to_mp_image(img))
+        if not result.face_landmarks:
+            raise ValueError(no_face_message)
+        return img, landmark_array(result.face_landmarks[0])[:, :3]
+
+    def detect_pose(self, img):
+        mp_image = self.to_mp_image(img)
+        frame = {}
+        result = landmarker_session.get_pose_landmarker(model_asset_path=self.pose_model_path, **self.pose_options).detect(mp_image)
+        if result.pose_world_landmarks:
+            frame['pose'] = landmark_array(result.pose_world_landmarks[0])
+
+        if os.path.isfile(landmarker_session.hand_model_path):
+            result = landmarker_session.get_hand_landmarker(**self.hand_options).detect(mp_image)
+            for handedness, landmarks in zip(result.handedness, result.hand_landmarks):
+                # Handedness assumes a mirrored (selfie) image, so 'Left' is the person's right hand
+                part = 'right_hand' if handedness[0].category_name == 'Left' else 'left_hand'
+                frame[part] = landmark_array(landmarks)
+
+        result = landmarker_session.get_face_landmarker(**self.face_options).detect(mp_image)
+        if result.face_landmarks:
+            frame['face'] = landmark_array(result.face_landmarks[0])
+        return frame
+
+
+class ReplayBackend(LandmarkBackend):
+    # Hands out the given landmarks one after the other, whatever the image is, starting over after the last one
+    kind = 'replay'
+
+    def __init__(self, face_frames=None, pose_frames=None):
+        # face_frames: (frames, 478, 3) normalized landmarks, pose_frames: list of mocap_landmarks frame dicts
+        self.face_frames = np.zeros((0, 478, 3), dtype=np.float32) if face_frames is None else np.asarray(face_frames, dtype=np.float32)
+        self.pose_frames = [] if pose_frames is None else list(pose_frames)
+        self.face_index = 0
+        self.pose_index = 0
+
+    @classmethod
+    def from_recording(cls, path):
+        # Every frame of a mocap_recording, the face landmarks (when there are any) double as the faces
+        import mocap_recording
+        recording = mocap_recording.load_recording(path)
+        frame_index, parts = mocap_recording.read_range(recording)
+        part_rows = {part: np.cumsum(present) - 1 for part, (present, _) in parts.items()}
+        pose_frames = []
+        for row in range(len(frame_index)):
+            pose_frames.append({part: landmarks[part_rows[part][row]] for part, (present, landmarks) in parts.items() if present[row]})
+        _, face_landmarks = parts['face']
+        return cls(face_landmarks[..., :3], pose_frames)
+
+    @classmethod
+    def synthetic(cls, frame_count=1, seed=0):
+        # Made up landmarks with the right shapes, for timing. The faces are the canonical face model placed in the
+        # middle of the image, with a little noise so every frame is different
+        rng = np.random.default_rng(seed)
+        verts = facemesh_pipeline.load_face_model().verts
+        face = np.stack([0.5 + verts[:, 0] / 50, 0.5 - verts[:, 1] / 50, -verts[:, 2] / 50], axis=1)
+        face = np.concatenate([face, np.repeat(face[1:2], 10, axis=0)]) # The irises aren't used, the nose tip stands in
+        face_frames = face + rng.normal(scale=0.001, size=(frame_count,) + face.shape)
+
+        pose_frames = []
+        rest = {part: rng.uniform(0.3, 0.7, size=(count, 4)) for part, (_, count) in mocap_landmarks.parts.items()}
+        rest['pose'][:, :3] = rng.normal(scale=0.3, size=(len(rest['pose']), 3)) # World landmarks are in meters around the hips
+        for _ in range(frame_count):
+            frame = {}
+            for part, landmarks in rest.items():
+                landmarks = landmarks + rng.normal(scale=0.002, size=landmarks.shape)
+                landmarks[:, 3] = 1
+                frame[part] = landmarks.astype(np.float32)
+            pose_frames.append(frame)
+        return cls(face_frames, pose_frames)
+
+    def detect_face(self, img):
+        if len(self.face_frames) == 0:
+            raise ValueError(no_face_message)
+        if img.ndim == 3 and img.shape[2] == 4:
+            import skimage.color
+            img = skimage.color.rgba2rgb(img)
+        landmarks = self.face_frames[self.face_index % len(self.face_frames)]
+        self.face_index += 1
+        return img, landmarks
+
+    def detect_pose(self, img):
+        if len(self.pose_frames) == 0:
+            return {}
+        frame = self.pose_frames[self.pose_index % len(self.pose_frames)]
+        self.pose_index += 1
+        return dict(frame)
+
+    def reset(self):
+        self.face_index = 0
+        self.pose_index = 0
+
+
+def landmark_array(landmarks):
+    # Tasks API landmark list -> (n, 4) float32 of x, y, z, visibility, the same as mocap_landmarks.results_to_frame
+    return np.array([(landmark.x, landmark.y, landmark.z, landmark.visibility or 0.0) for landmark in landmarks], dtype=np.float32)
+
+
+def create_backend(kind, pose_options=None, recording_path=None):
+    # recording_path is only for replay, without one it serves synthetic landmarks
+    if kind == 'solutions':
+        return SolutionsBackend(pose_options)
+    if kind == 'tasks':
+        return TasksBackend(pose_options)
+    if kind == 'replay':
+        return ReplayBackend.from_recording(recording_path) if recording_path else ReplayBackend.synthetic()
+    raise ValueError('Unknown landmark backend %s, expected one of %s' % (kind, ', '.join(backend_kinds)))
+
+
+def get_backend(kind='solutions', pose_options=None):
+    if override is not None:
+        return override
+    return create_backend(kind, pose_options)
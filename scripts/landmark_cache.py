@@ -0,0 +1,78 @@
+# On-disk cache of landmark detection results.
+# Entries are keyed by a hash of the image file's bytes plus the detector and its options, so running the same
+# image through the same model again (undo, tweaking save settings, re-posing) skips mediapipe entirely.
+# Each entry is a small .npz of named arrays. When the folder grows past max_cache_bytes the least recently
+# used entries are removed. Nothing in here imports bpy.
+import os
+import zipfile
+import hashlib
+import pathlib
+
+import numpy as np
+
+cache_dir = os.path.join('%s' % pathlib.Path.home(), 'cyanic_face_meshes', 'landmark_cache')
+max_cache_bytes = 64 * 1024 * 1024 # 0 turns the cache off
+
+
+def image_key(img_path, kind, options):
+    # kind is the detector ('face_mesh', 'holistic', ...), options the settings it was created with
+    digest = hashlib.sha1()
+    with open(img_path, 'rb') as input_file:
+        for chunk in iter(lambda: input_file.read(1 << 20), b''):
+            digest.update(chunk)
+    digest.update(repr((kind, sorted(options.items()))).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def entry_path(key):
+    return os.path.join(cache_dir, '%s.npz' % key)
+
+
+def load(key):
+    # dict of the saved arrays, or None if there's no entry for key
+    path = entry_path(key)
+    if max_cache_bytes <= 0 or not os.path.isfile(path):
+        return None
+    try:
+        with np.load(path) as entry:
+            arrays = {name: entry[name] for name in entry.files}
+        os.utime(path) # Mark as recently used
+    except (OSError, ValueError, zipfile.BadZipFile) as e:
+        print('Ignoring damaged landmark cache entry %s: %s' % (path, e))
+        return None
+    return arrays
+
+
+def save(key, **arrays):
+    if max_cache_bytes <= 0:
+        return
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        path = entry_path(key)
+        # Write to a temp file first, so a half written entry is never loaded
+        tmp_path = '%s.%s.tmp' % (path, os.getpid())
+        with open(tmp_path, 'wb') as output_file:
+            np.savez_compressed(output_file, **arrays)
+        os.replace(tmp_path, path)
+        evict()
+    except OSError as e:
+        # The cache is only a speed up, never stop the operator over it
+        print('Unable to save landmark cache entry: %s' % e)
+
+
+def evict():
+    # Remove the least recently used entries until the cache fits in max_cache_bytes
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith('.npz'):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum([size for _, size, _ in entries])
+    for _, size, path in sorted(entries):
+        if total <= max_cache_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass # Probably removed by another process already
@@ -0,0 +1,156 @@
+# Temporal smoothing for landmarks, so cheaper (noisier) detection settings can be cleaned up afterwards.
+# Every filter works on whole arrays at once: one call handles all the landmarks (and x, y, z) of a frame.
+# Each one can be used two ways:
+#   streaming - create_filter() then .filter(values, timestamp) once per frame, with a fixed amount of state
+#   batch - filter_frames() on a (frames, landmarks, 3) array, for recordings that are already on disk
+# Nothing in here imports bpy.
+import math
+
+import numpy as np
+
+filter_kinds = ('one_euro', 'kalman', 'savgol')
+
+
+class OneEuroFilter:
+    # One Euro filter (Casiez et al. 2012). Smooths heavily while a point is still, and follows it closely when it
+    # moves fast, which is what jittery landmarks need.
+    # min_cutoff (Hz) sets the smoothing at rest, beta how quickly it loosens up with speed.
+    # The default beta suits mediapipe's normalized (0-1 across the image) coordinates
+    def __init__(self, min_cutoff=1.0, beta=20.0, d_cutoff=1.0):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.values = None
+        self.speeds = None
+        self.timestamp = None
+
+    @staticmethod
+    def alpha(cutoff, dt):
+        tau = 1.0 / (2 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+    def filter(self, values, timestamp):
+        values = np.asarray(values, dtype=np.float64)
+        if self.values is None or self.values.shape != values.shape:
+            self.values = values.copy()
+            self.speeds = np.zeros_like(values)
+            self.timestamp = timestamp
+            return values
+        dt = max(timestamp - self.timestamp, 1e-6)
+        speeds = (values - self.values) / dt
+        self.speeds += self.alpha(self.d_cutoff, dt) * (speeds - self.speeds)
+        cutoff = self.min_cutoff + self.beta * np.abs(self.speeds)
+        self.values += self.alpha(cutoff, dt) * (values - self.values)
+        self.timestamp = timestamp
+        return self.values.copy()
+
+
+class KalmanFilter:
+    # Constant velocity Kalman filter, run independently on every coordinate.
+    # process_noise is how much the velocity is expected to change, measurement_noise how far off the detections
+    # are (in the same units as the values). Higher measurement_noise = smoother
+    def __init__(self, process_noise=1.0, measurement_noise=1e-4):
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.values = None
+        self.timestamp = None
+
+    def filter(self, values, timestamp):
+        values = np.asarray(values, dtype=np.float64)
+        if self.values is None or self.values.shape != values.shape:
+            self.values = values.copy()
+            self.velocities = np.zeros_like(values)
+            # Covariance [[p00, p01], [p01, p11]] for every coordinate
+            self.p00 = np.full_like(values, self.measurement_noise)
+            self.p01 = np.zeros_like(values)
+            self.p11 = np.full_like(values, self.process_noise)
+            self.timestamp = timestamp
+            return values
+        dt = max(timestamp - self.timestamp, 1e-6)
+        q = self.process_noise
+
+        # Predict
+        self.values += self.velocities * dt
+        self.p00 += 2 * dt * self.p01 + dt * dt * self.p11 + q * dt ** 3 / 3
+        self.p01 += dt * self.p11 + q * dt * dt / 2
+        self.p11 += q * dt
+
+        # Update
+        gain0 = self.p00 / (self.p00 + self.measurement_noise)
+        gain1 = self.p01 / (self.p00 + self.measurement_noise)
+        residuals = values - self.values
+        self.values += gain0 * residuals
+        self.velocities += gain1 * residuals
+        self.p11 -= gain1 * self.p01
+        self.p01 *= 1 - gain0
+        self.p00 *= 1 - gain0
+
+        self.timestamp = timestamp
+        return self.values.copy()
+
+
+def savgol_weights(window, polyorder, position):
+    # Least squares polynomial fit over the window, evaluated at position (index into the window), as a weight per frame
+    offsets = np.arange(window) - position
+    vandermonde = np.vander(offsets, polyorder + 1, increasing=True)
+    return np.linalg.pinv(vandermonde)[0]
+
+
+class SavgolFilter:
+    # Savitzky-Golay. Streaming only has the frames up to now, so it fits the last window frames and takes the end of
+    # the curve, that lags less than averaging but smooths less than the centered batch version
+    def __init__(self, window=9, polyorder=2):
+        self.window = window
+        self.polyorder = min(polyorder, window - 1)
+        self.history = []
+        self.weights = {}
+
+    def filter(self, values, timestamp):
+        values = np.asarray(values, dtype=np.float64)
+        if len(self.history) > 0 and self.history[-1].shape != values.shape:
+            self.history = []
+        self.history.append(values)
+        if len(self.history) > self.window:
+            self.history.pop(0)
+        count = len(self.history)
+        if count <= self.polyorder:
+            return values
+        if count not in self.weights:
+            self.weights[count] = savgol_weights(count, self.polyorder, count - 1)
+        return np.tensordot(self.weights[count], np.stack(self.history), axes=1)
+
+
+def create_filter(kind, **settings):
+    if kind == 'one_euro':
+        return OneEuroFilter(**settings)
+    if kind == 'kalman':
+        return KalmanFilter(**settings)
+    if kind == 'savgol':
+        return SavgolFilter(**settings)
+    raise ValueError('Unknown filter %s, expected one of %s' % (kind, ', '.join(filter_kinds)))
+
+
+def filter_frames(kind, values, timestamps, **settings):
+    # values: (frames, ...) array, timestamps: (frames,) seconds. Returns a filtered float64 copy.
+    # Leave out frames where the landmarks weren't found before calling, the timestamps keep the spacing right
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) == 0:
+        return values.copy()
+    if kind == 'savgol':
+        # Offline the window can be centered, which smooths without any lag
+        window = settings.get('window', 9)
+        polyorder = settings.get('polyorder', 2)
+        if window % 2 == 0:
+            window += 1 # Centered needs an odd window
+        if len(values) < window:
+            window = len(values) if len(values) % 2 == 1 else len(values) - 1
+        if window <= polyorder:
+            return values.copy()
+        from scipy.signal import savgol_filter
+        return savgol_filter(values, window, polyorder, axis=0, mode='interp')
+
+    stream = create_filter(kind, **settings)
+    filtered = np.empty_like(values)
+    for index in range(len(values)):
+        filtered[index] = stream.filter(values[index], timestamps[index])
+    return filtered
@@ -0,0 +1,126 @@
+# Keeps mediapipe models alive between operator runs.
+# Loading a model takes a noticeable part of the total time for a single image (see scripts/benchmark.py), so instead of
+# building one inside a `with` block on every execute, operators ask for one here and get the same instance back
+# as long as the options match. Nothing in here imports bpy.
+import os
+import time
+import threading
+
+script_dir = os.path.dirname(__file__)
+data_dir = os.path.join(os.path.split(script_dir)[0], 'data')
+
+landmarkers = {} # (kind, options): model
+last_used = {} # (kind, options): time.monotonic() of the last get_landmarker()
+lock = threading.Lock()
+
+
+def create_face_mesh(**options):
+    import mediapipe
+    return mediapipe.solutions.face_mesh.FaceMesh(**options)
+
+
+def create_holistic(**options):
+    import mediapipe
+    return mediapipe.solutions.holistic.Holistic(**options)
+
+
+# Tasks API models. Only face_landmarker.task ships with the add-on, the others go in data/ when they're wanted
+face_model_path = os.path.join(data_dir, 'face_landmarker.task')
+hand_model_path = os.path.join(data_dir, 'hand_landmarker.task')
+# Lite, full and heavy, the same trade off as Holistic's model_complexity 0, 1 and 2
+pose_model_paths = [os.path.join(data_dir, 'pose_landmarker_%s.task' % size) for size in ('lite', 'full', 'heavy')]
+model_urls = { # Where to download them from
+    face_model_path: 'https://storage.googleapis.com/mediapipe-models/face_landmarker/face_landmarker/float16/1/face_landmarker.task',
+    hand_model_path: 'https://storage.googleapis.com/mediapipe-models/hand_landmarker/hand_landmarker/float16/1/hand_landmarker.task',
+}
+for size, path in zip(('lite', 'full', 'heavy'), pose_model_paths):
+    model_urls[path] = 'https://storage.googleapis.com/mediapipe-models/pose_landmarker/pose_landmarker_%s/float16/1/pose_landmarker_%s.task' % (size, size)
+
+
+def check_model_file(model_asset_path):
+    if not os.path.isfile(model_asset_path):
+        raise IOError('Missing %s, download it from %s' % (model_asset_path, model_urls.get(model_asset_path, 'the mediapipe model page')))
+
+
+def create_face_landmarker(model_asset_path=face_model_path, **options):
+    # Tasks API version of the face mesh, using data/face_landmarker.task
+    import mediapipe
+    check_model_file(model_asset_path)
+    base_options = mediapipe.tasks.BaseOptions(model_asset_path=model_asset_path)
+    face_options = mediapipe.tasks.vision.FaceLandmarkerOptions(base_options=base_options, **options)
+    return mediapipe.tasks.vision.FaceLandmarker.create_from_options(face_options)
+
+
+def create_pose_landmarker(model_asset_path=pose_model_paths[-1], **options):
+    import mediapipe
+    check_model_file(model_asset_path)
+    base_options = mediapipe.tasks.BaseOptions(model_asset_path=model_asset_path)
+    pose_options = mediapipe.tasks.vision.PoseLandmarkerOptions(base_options=base_options, **options)
+    return mediapipe.tasks.vision.PoseLandmarker.create_from_options(pose_options)
+
+
+def create_hand_landmarker(model_asset_path=hand_model_path, **options):
+    import mediapipe
+    check_model_file(model_asset_path)
+    base_options = mediapipe.tasks.BaseOptions(model_asset_path=model_asset_path)
+    hand_options = mediapipe.tasks.vision.HandLandmarkerOptions(base_options=base_options, **options)
+    return mediapipe.tasks.vision.HandLandmarker.create_from_options(hand_options)
+
+
+creators = {
+    'face_mesh': create_face_mesh,
+    'holistic': create_holistic,
+    'face_landmarker': create_face_landmarker,
+    'pose_landmarker': create_pose_landmarker,
+    'hand_landmarker': create_hand_landmarker,
+}
+
+
+def get_landmarker(kind, reset=False, **options):
+    # Returns the model for kind with these options, creating it the first time it's asked for.
+    # reset clears any tracking state left over from the last video (only the legacy solutions have reset())
+    key = (kind, tuple(sorted(options.items())))
+    with lock:
+        if key not in landmarkers:
+            landmarkers[key] = creators[kind](**options)
+        elif reset and hasattr(landmarkers[key], 'reset'):
+            landmarkers[key].reset()
+        last_used[key] = time.monotonic()
+        return landmarkers[key]
+
+
+def get_face_mesh(reset=False, **options):
+    return get_landmarker('face_mesh', reset, **options)
+
+
+def get_holistic(reset=False, **options):
+    return get_landmarker('holistic', reset, **options)
+
+
+def get_face_landmarker(**options):
+    return get_landmarker('face_landmarker', **options)
+
+
+def get_pose_landmarker(**options):
+    return get_landmarker('pose_landmarker', **options)
+
+
+def get_hand_landmarker(**options):
+    return get_landmarker('hand_landmarker', **options)
+
+
+def release(kind=None, max_idle=None):
+    # Closes the models (all of them, or just one kind) to free their memory.
+    # max_idle only closes the ones that haven't been used for that many seconds.
+    # Returns how many were closed
+    now = time.monotonic()
+    with lock:
+        keys = [key for key in landmarkers if (kind is None or key[0] == kind) and (max_idle is None or now - last_used[key] >= max_idle)]
+        for key in keys:
+            model = landmarkers.pop(key)
+            last_used.pop(key, None)
+            try:
+                model.close()
+            except Exception as e:
+                print('Unable to close %s landmarker: %s' % (key[0], e))
+    return len(keys)
@@ -0,0 +1,50 @@
+# Plain numpy version of mediapipe's Holistic results.
+# A frame is a dict of part name: (landmark count, 4) float32 array of (x, y, z, visibility).
+# Parts that weren't detected are left out of the dict. Nothing in here imports bpy.
+import numpy as np
+
+# part name: (Holistic results attribute, landmark count)
+parts = {
+    'pose': ('pose_world_landmarks', 33), # Meters, 0,0,0 is between the hips
+    'left_hand': ('left_hand_landmarks', 21), # Normalized to the image
+    'right_hand': ('right_hand_landmarks', 21),
+    'face': ('face_landmarks', 478), # 468 without refine_face_landmarks
+}
+
+
+def results_to_frame(results):
+    frame = {}
+    for part, (attribute, _) in parts.items():
+        landmark_list = getattr(results, attribute, None)
+        if landmark_list is None:
+            continue
+        frame[part] = np.array([(landmark.x, landmark.y, landmark.z, landmark.visibility) for landmark in landmark_list.landmark], dtype=np.float32)
+    return frame
+
+
+def to_blender_space(rows, image_width, image_height, scaler):
+    # mediapipe x right, y down, z away from the camera -> Blender x right, y away, z up.
+    # "The magnitude of z uses roughly the same scale as x."
+    return np.stack([rows[:, 0] * image_width, rows[:, 2] * image_width, -rows[:, 1] * image_height], axis=1) / scaler
+
+
+def frame_to_locations(frame, image_width, image_height, scaler=200):
+    # Where each landmark goes in the scene, part name: (landmark count, 3) float32.
+    # The pose is the skeleton everything hangs off, the hands and face are moved so their wrist/nose lines up with
+    # the pose's wrist/nose
+    locations = {}
+    origins = {'right_hand': np.zeros(3), 'left_hand': np.zeros(3), 'face': np.zeros(3)}
+    anchors = {'right_hand': (16, 0), 'left_hand': (15, 0), 'face': (0, 1)} # part: (pose index, part index). Point 1 of the face is the tip of the nose
+
+    if 'pose' in frame:
+        locations['pose'] = to_blender_space(frame['pose'], image_width, image_height, scaler)
+        for part, (pose_index, _) in anchors.items():
+            origins[part] = locations['pose'][pose_index]
+
+    for part, (_, part_index) in anchors.items():
+        if part not in frame:
+            continue
+        part_locations = to_blender_space(frame[part], image_width, image_height, scaler)
+        locations[part] = origins[part] - part_locations[part_index] + part_locations
+
+    return {part: part_locations.astype(np.float32) for part, part_locations in locations.items()}
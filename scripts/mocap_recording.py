@@ -0,0 +1,111 @@
+# Saves video mocap landmarks to disk so a take can be replayed, re-smoothed or retargeted without mediapipe.
+# A recording is a folder (<name>.mocap) holding:
+#   meta.json - fps, image size, frame count, landmark count per part and whatever else the caller adds
+#   <part>.f32 - float32 (frames, landmarks, 4) of x, y, z, visibility, zeros where the part wasn't found
+#   present.u8 - uint8 (frames, parts) 1 where the part was found, in meta['parts'] order
+#   frame_index.i32 - int32 (frames,) the source video frame each row came from
+# The files are plain arrays with no header, so loading them is just a np.memmap and reading a range of frames only
+# touches that part of the file. Nothing in here imports bpy.
+import os
+import json
+from collections import namedtuple
+
+import numpy as np
+
+import mocap_landmarks
+
+recording_extension = '.mocap'
+
+# meta: the meta.json dict, parts: part name: (frames, landmarks, 4) memmap,
+# present: (frames, parts) bool memmap, frame_index: (frames,) memmap
+Recording = namedtuple('Recording', ['meta', 'parts', 'present', 'frame_index'])
+
+
+class RecordingWriter:
+    # Appends frames as they come in, so a recording of any length never has to fit in memory
+    def __init__(self, path, fps=0, **metadata):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        if is_recording(path):
+            os.remove(os.path.join(path, 'meta.json')) # Overwriting an older take, it isn't valid until close()
+        self.part_names = list(mocap_landmarks.parts.keys())
+        self.meta = dict(metadata, fps=fps, image_size=None, frame_count=0, parts=self.part_names, landmark_counts={})
+        self.files = {part: open(os.path.join(path, '%s.f32' % part), 'wb') for part in self.part_names}
+        self.present_file = open(os.path.join(path, 'present.u8'), 'wb')
+        self.frame_index_file = open(os.path.join(path, 'frame_index.i32'), 'wb')
+        self.unwritten = {part: 0 for part in self.part_names} # Missing frames from before the landmark count was known
+
+    def write_missing(self, part, count):
+        landmark_count = self.meta['landmark_counts'][part]
+        self.files[part].write(np.zeros((count, landmark_count, 4), dtype=np.float32).tobytes())
+
+    def append(self, frame_index, frame, image_size):
+        if self.meta['image_size'] is None:
+            self.meta['image_size'] = [int(image_size[0]), int(image_size[1])]
+        present = np.zeros(len(self.part_names), dtype=np.uint8)
+        for part_index, part in enumerate(self.part_names):
+            if part not in frame:
+                if part in self.meta['landmark_counts']:
+                    self.write_missing(part, 1)
+                else:
+                    self.unwritten[part] += 1
+                continue
+            landmarks = np.ascontiguousarray(frame[part], dtype=np.float32)
+            if part not in self.meta['landmark_counts']:
+                # First time this part showed up, now the rows it missed can be filled in
+                self.meta['landmark_counts'][part] = len(landmarks)
+                self.write_missing(part, self.unwritten[part])
+            elif len(landmarks) != self.meta['landmark_counts'][part]:
+                raise ValueError('%s had %s landmarks, expected %s' % (part, len(landmarks), self.meta['landmark_counts'][part]))
+            self.files[part].write(landmarks.tobytes())
+            present[part_index] = 1
+        self.present_file.write(present.tobytes())
+        self.frame_index_file.write(np.int32(frame_index).tobytes())
+        self.meta['frame_count'] += 1
+
+    def close(self):
+        for part in self.part_names:
+            if part not in self.meta['landmark_counts']:
+                # Never found, fill with the default count so every part has the same number of rows
+                self.meta['landmark_counts'][part] = mocap_landmarks.parts[part][1]
+                self.write_missing(part, self.unwritten[part])
+            self.files[part].close()
+        self.present_file.close()
+        self.frame_index_file.close()
+        # meta.json goes last, a folder without one is an unfinished recording
+        with open(os.path.join(self.path, 'meta.json'), 'w') as output_file:
+            json.dump(self.meta, output_file, indent=2)
+
+
+def is_recording(path):
+    return os.path.isfile(os.path.join(path, 'meta.json'))
+
+
+def load_recording(path):
+    with open(os.path.join(path, 'meta.json'), 'r') as input_file:
+        meta = json.load(input_file)
+    frame_count = meta['frame_count']
+    parts = {}
+    for part in meta['parts']:
+        shape = (frame_count, meta['landmark_counts'][part], 4)
+        parts[part] = np.memmap(os.path.join(path, '%s.f32' % part), dtype=np.float32, mode='r', shape=shape) if frame_count > 0 else np.zeros(shape, dtype=np.float32)
+    if frame_count > 0:
+        present = np.memmap(os.path.join(path, 'present.u8'), dtype=np.uint8, mode='r', shape=(frame_count, len(meta['parts']))).view(bool)
+        frame_index = np.memmap(os.path.join(path, 'frame_index.i32'), dtype=np.int32, mode='r', shape=(frame_count,))
+    else:
+        present = np.zeros((0, len(meta['parts'])), dtype=bool)
+        frame_index = np.zeros(0, dtype=np.int32)
+    return Recording(meta, parts, present, frame_index)
+
+
+def read_range(recording, start=0, end=None):
+    # Rows start to end of a recording, only that part of the files is read.
+    # Returns (frame_index, parts) with parts as part name: (present, landmarks), where present is a (rows,) bool
+    # and landmarks is (present rows, landmark count, 4), in order
+    end = recording.meta['frame_count'] if end is None else min(end, recording.meta['frame_count'])
+    frame_index = np.array(recording.frame_index[start:end])
+    parts = {}
+    for part_index, part in enumerate(recording.meta['parts']):
+        present = np.array(recording.present[start:end, part_index])
+        parts[part] = (present, np.array(recording.parts[part][start:end][present]))
+    return frame_index, parts
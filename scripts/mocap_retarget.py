@@ -0,0 +1,156 @@
+# Pose landmarks to bone rotations, using the 'retarget' section of mediapipe_rigify_mapping.json.
+# Each mapped bone is aimed from its head landmark(s) to its tail landmark(s). Everything works on whole clips:
+# (frames, bones) arrays of quaternions, solved one level of the bone hierarchy at a time, so the cost barely depends
+# on the number of frames. Quaternions are (w, x, y, z) like Blender's. Nothing in here imports bpy.
+import os
+import json
+from collections import namedtuple
+
+import numpy as np
+
+script_dir = os.path.dirname(__file__)
+data_dir = os.path.join(os.path.split(script_dir)[0], 'data')
+mapping_file = os.path.join(data_dir, 'mediapipe_rigify_mapping.json')
+
+# bone_names: metarig bone names, rig_bones: tuple of candidate bones to key for each one
+# rest_bones: (first, last) metarig bones, the rest direction runs from the head of first to the tail of last
+# heads, tails: int32 (bones, 2) pose landmark indexes, the two are averaged (the same index twice for one landmark)
+RetargetMapping = namedtuple('RetargetMapping', ['bone_names', 'rig_bones', 'rest_bones', 'heads', 'tails'])
+
+mapping = None
+
+
+def landmark_pair(indexes):
+    if len(indexes) == 1:
+        return [indexes[0], indexes[0]]
+    return list(indexes)
+
+
+def compile_mapping(path=mapping_file):
+    with open(path, 'r') as input_file:
+        config = json.load(input_file)
+    bones = config['retarget']['bones']
+    bone_names = tuple([bone['bone'] for bone in bones])
+    rig_bones = tuple([tuple(bone['rig_bones']) for bone in bones])
+    rest_bones = tuple([tuple(bone.get('rest', [bone['bone'], bone['bone']])) for bone in bones])
+    heads = np.array([landmark_pair(bone['head']) for bone in bones], dtype=np.int32)
+    tails = np.array([landmark_pair(bone['tail']) for bone in bones], dtype=np.int32)
+    return RetargetMapping(bone_names, rig_bones, rest_bones, heads, tails)
+
+
+def get_mapping():
+    global mapping
+    if mapping is None:
+        mapping = compile_mapping()
+    return mapping
+
+
+def to_blender_space(landmarks):
+    # mediapipe world landmarks (meters, y down, z away from the camera) -> Blender x right, y away, z up.
+    # Same axes as mocap_landmarks.to_blender_space, so a person facing the camera faces -Y like a metarig
+    return np.stack([landmarks[..., 0], landmarks[..., 2], -landmarks[..., 1]], axis=-1)
+
+
+def normalize(vectors):
+    lengths = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(lengths, 1e-9)
+
+
+def quaternion_multiply(a, b):
+    aw, ax, ay, az = np.moveaxis(a, -1, 0)
+    bw, bx, by, bz = np.moveaxis(b, -1, 0)
+    return np.stack([
+        aw * bw - ax * bx - ay * by - az * bz,
+        aw * bx + ax * bw + ay * bz - az * by,
+        aw * by - ax * bz + ay * bw + az * bx,
+        aw * bz + ax * by - ay * bx + az * bw,
+    ], axis=-1)
+
+
+def quaternion_conjugate(q):
+    return q * np.array([1, -1, -1, -1], dtype=q.dtype)
+
+
+def quaternion_rotate(q, vectors):
+    # v' = v + 2w(u x v) + 2u x (u x v), with u the vector part of q
+    w = q[..., :1]
+    u = q[..., 1:]
+    uv = np.cross(u, vectors)
+    return vectors + 2 * w * uv + 2 * np.cross(u, uv)
+
+
+def quaternion_between(a, b):
+    # Shortest arc rotation taking unit vectors a onto b
+    dots = np.sum(a * b, axis=-1, keepdims=True)
+    q = np.concatenate([1 + dots, np.cross(a, b)], axis=-1)
+    # Opposite vectors have no shortest arc, turn 180 degrees around any axis perpendicular to a
+    opposite = dots[..., 0] < -1 + 1e-6
+    if np.any(opposite):
+        axis = np.cross(a[opposite], [1.0, 0.0, 0.0])
+        parallel = np.linalg.norm(axis, axis=-1) < 1e-6
+        axis[parallel] = np.cross(a[opposite][parallel], [0.0, 1.0, 0.0])
+        q[opposite] = np.concatenate([np.zeros((len(axis), 1)), normalize(axis)], axis=-1)
+    return normalize(q)
+
+
+def make_continuous(q):
+    # q and -q are the same rotation, but keyframes interpolate the long way round when the sign flips between frames
+    if len(q) < 2:
+        return q
+    flips = np.where(np.sum(q[1:] * q[:-1], axis=-1) < 0, -1.0, 1.0)
+    q = q.copy()
+    q[1:] *= np.cumprod(flips, axis=0)[..., None]
+    return q
+
+
+def bone_directions(landmarks, retarget_mapping):
+    # landmarks: (frames, 33, 3) Blender space. Returns (frames, bones, 3) unit vectors from head to tail
+    heads = landmarks[:, retarget_mapping.heads].mean(axis=2)
+    tails = landmarks[:, retarget_mapping.tails].mean(axis=2)
+    return normalize(tails - heads)
+
+
+def bone_visibility(visibility, retarget_mapping):
+    # visibility: (frames, 33). The lowest visibility of the landmarks each bone is aimed with, (frames, bones)
+    indexes = np.concatenate([retarget_mapping.heads, retarget_mapping.tails], axis=1)
+    return visibility[:, indexes].min(axis=2)
+
+
+def hierarchy_levels(parents):
+    # Groups of bone indexes where every parent is in an earlier group, so a whole group can be solved at once
+    depths = np.zeros(len(parents), dtype=np.int32)
+    for index in range(len(parents)):
+        parent = parents[index]
+        depth = 0
+        while parent >= 0:
+            depth += 1
+            parent = parents[parent]
+        depths[index] = depth
+    return [np.flatnonzero(depths == depth) for depth in range(depths.max() + 1)] if len(parents) > 0 else []
+
+
+def solve_rotations(directions, rest_directions, rest_rotations, parents):
+    # directions: (frames, bones, 3) unit vectors the bones should point along, in armature space
+    # rest_directions: (bones, 3) unit vectors they point along at rest, in armature space
+    # rest_rotations: (bones, 4) armature space rest orientation of the bones being keyed (matrix_local)
+    # parents: (bones,) index of the nearest keyed ancestor, -1 for none
+    # Returns (frames, bones, 4) rotation_quaternion values.
+    # Bones in between that aren't keyed stay at rest, so they just pass their parent's rotation on. That means each
+    # bone's armature space rotation is its parent's, followed by the swing from where that leaves the bone pointing
+    # to where the landmarks say it points
+    frame_count, bone_count = directions.shape[:2]
+    parents = np.asarray(parents)
+    identity = np.array([1.0, 0.0, 0.0, 0.0])
+    # The extra slot at the end stays the identity, parents of -1 index it
+    world = np.tile(identity, (frame_count, bone_count + 1, 1))
+    for level in hierarchy_levels(parents):
+        parent_world = world[:, parents[level]]
+        current = quaternion_rotate(parent_world, rest_directions[level])
+        swing = quaternion_between(normalize(current), directions[:, level])
+        world[:, level] = quaternion_multiply(swing, parent_world)
+
+    # pose = rest^-1 * parent^-1 * world * rest, the change in the bone's own space
+    rest_rotations = np.asarray(rest_rotations, dtype=np.float64)
+    relative = quaternion_multiply(quaternion_conjugate(world[:, parents]), world[:, :bone_count])
+    local = quaternion_multiply(quaternion_multiply(quaternion_conjugate(rest_rotations), relative), rest_rotations)
+    return make_continuous(normalize(local))
@@ -0,0 +1,192 @@
+# Runs video mocap in the background so Blender's UI keeps going.
+# A decode thread reads frames into a small queue, an inference thread runs them through the landmark backend into a
+# second queue, and the main thread takes finished frames off the end whenever it has time. Both queues are bounded,
+# so a slow stage makes the ones before it wait instead of filling memory. Decoding (OpenCV) and inference (mediapipe)
+# both release the GIL, so the stages really do overlap. Nothing in here imports bpy.
+import time
+import queue
+import threading
+from collections import namedtuple
+
+# index: frame number in the source, landmarks: mocap_landmarks frame dict, image_size: (width, height)
+# timings: seconds spent in each stage for this frame, captured_at: time.perf_counter() when it was read
+StreamFrame = namedtuple('StreamFrame', ['index', 'landmarks', 'image_size', 'timings', 'captured_at'])
+
+end_of_stream = None
+
+
+class MocapStream:
+    def __init__(self, source, backend, max_queued=8, start_frame=0, end_frame=None, stride=1, downscale=1.0, latest_only=False):
+        # source is a video path or a camera index, backend a landmark_backends.LandmarkBackend (anything with a
+        # detect_pose(rgb_image) that returns a mocap_landmarks frame dict).
+        # Only frames start_frame to end_frame (inclusive, None for all of them) are used, every stride'th one.
+        # downscale shrinks the frames before detection, landmarks come back normalized so nothing else changes.
+        # latest_only is for live previews: stages never wait on each other, and any frame a newer one catches up
+        # with is dropped, so what comes out is always as fresh as the model allows
+        self.source = source
+        self.backend = backend
+        self.start_frame = max(start_frame, 0)
+        self.end_frame = end_frame
+        self.stride = max(stride, 1)
+        self.downscale = downscale
+        self.latest_only = latest_only
+        if latest_only:
+            max_queued = 1
+        self.decoded = queue.Queue(maxsize=max_queued)
+        self.results = queue.Queue(maxsize=max_queued)
+        self.stop_event = threading.Event()
+        self.threads = []
+        self.error = None
+        self.done = False
+        self.fps = 0
+        self.total_frames = 0 # 0 when unknown (webcams)
+        self.frames_taken = 0
+        self.frames_dropped = 0
+        self.stage_seconds = {'decode': 0.0, 'inference': 0.0} # Totals for the frames taken so far
+
+    def start(self):
+        import cv2
+        capture = cv2.VideoCapture(self.source)
+        if not capture.isOpened():
+            capture.release()
+            raise IOError('Could not open %s' % self.source)
+        self.fps = capture.get(cv2.CAP_PROP_FPS) or 0
+        frame_count = max(int(capture.get(cv2.CAP_PROP_FRAME_COUNT)), 0)
+        if frame_count > 0:
+            last_frame = frame_count - 1 if self.end_frame is None else min(self.end_frame, frame_count - 1)
+            self.total_frames = max(last_frame - self.start_frame, -1) // self.stride + 1
+        if self.start_frame > 0:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, self.start_frame)
+        self.threads = [
+            threading.Thread(target=self.decode, args=(capture,), daemon=True),
+            threading.Thread(target=self.infer, daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def put(self, target_queue, item):
+        # Blocks while the queue is full (that's the backpressure), but gives up once the stream is cancelled
+        if self.latest_only:
+            return self.replace_queued(target_queue, item)
+        while not self.stop_event.is_set():
+            try:
+                target_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def replace_queued(self, target_queue, item):
+        # Never waits, whatever is still sitting in the queue gets swapped for the newer item
+        while True:
+            try:
+                target_queue.put_nowait(item)
+                return True
+            except queue.Full:
+                try:
+                    target_queue.get_nowait()
+                    self.frames_dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, source_queue):
+        while not self.stop_event.is_set():
+            try:
+                return source_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return end_of_stream
+
+    def decode(self, capture):
+        import cv2
+        try:
+            index = self.start_frame
+            skipped_seconds = 0
+            while not self.stop_event.is_set():
+                if self.end_frame is not None and index > self.end_frame:
+                    break
+                start = time.perf_counter()
+                if (index - self.start_frame) % self.stride != 0 and not self.latest_only:
+                    # Skipped frame, grab() moves past it without converting it to an image
+                    if not capture.grab():
+                        break
+                    skipped_seconds += time.perf_counter() - start
+                    index += 1
+                    continue
+                success, image = capture.read()
+                if not success:
+                    break
+                if self.downscale < 1:
+                    image = cv2.resize(image, None, fx=self.downscale, fy=self.downscale, interpolation=cv2.INTER_AREA)
+                image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+                if not self.put(self.decoded, (index, image, time.perf_counter() - start + skipped_seconds, start)):
+                    break
+                skipped_seconds = 0
+                index += 1
+        except Exception as e:
+            self.error = 'Decoding failed: %s' % e
+        finally:
+            capture.release()
+            self.put(self.decoded, end_of_stream)
+
+    def infer(self):
+        try:
+            while True:
+                item = self.get(self.decoded)
+                if item is end_of_stream:
+                    break
+                index, image, decode_time, captured_at = item
+                start = time.perf_counter()
+                # To improve performance, mark the image as not writeable to pass by reference
+                image.flags.writeable = False
+                landmarks = self.backend.detect_pose(image)
+                timings = {'decode': decode_time, 'inference': time.perf_counter() - start}
+                # The size before downscaling, so the scene scale doesn't depend on it
+                image_height, image_width = [round(size / self.downscale) for size in image.shape[:2]]
+                if not self.put(self.results, StreamFrame(index, landmarks, (image_width, image_height), timings, captured_at)):
+                    break
+        except Exception as e:
+            self.error = 'Landmark detection failed: %s' % e
+            self.stop_event.set() # Nothing left to feed, stop decoding too
+        finally:
+            self.put(self.results, end_of_stream)
+
+    def take(self, max_frames=1):
+        # Up to max_frames of the finished frames available right now, in order, without waiting on the other threads
+        frames = []
+        while not self.done and len(frames) < max_frames:
+            try:
+                item = self.results.get_nowait()
+            except queue.Empty:
+                if not any([thread.is_alive() for thread in self.threads]):
+                    self.done = True # Stopped without getting the end marker through (cancelled or failed)
+                break
+            if item is end_of_stream:
+                self.done = True
+                break
+            frames.append(item)
+            for stage, seconds in item.timings.items():
+                self.stage_seconds[stage] += seconds
+        self.frames_taken += len(frames)
+        return frames
+
+    def take_latest(self):
+        # Only the newest finished frame (or None), everything older is dropped
+        frames = self.take(max_frames=self.results.maxsize + 1)
+        if len(frames) == 0:
+            return None
+        self.frames_dropped += len(frames) - 1
+        return frames[-1]
+
+    def progress(self):
+        # 0-1, or None when the length isn't known
+        if self.total_frames <= 0:
+            return None
+        return min(self.frames_taken / self.total_frames, 1.0)
+
+    def cancel(self):
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join(timeout=2)
+        self.done = True